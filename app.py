@@ -1,23 +1,114 @@
-from flask import Flask, request, jsonify, render_template, render_template_string
+from flask import Flask, request, jsonify, render_template, render_template_string, Response, send_file, \
+    stream_with_context
+from markupsafe import Markup
 from flask_cors import CORS
-from models import db, ClipboardItem
-from db import init_db
+from models import db, ClipboardItem, ClipboardBlob, SyncGroup, blob_file_path, with_content
+from db import init_db, begin_write
+from config import load_config
+from routing import ReadRouter
+from group_commit import GroupCommitter
+from broker import Broker
+from latest_cache import LatestCache
+from pagination import paginate, decode_cursor, encode_key, encode_cursor
+from projection import latest_json, history_json
+from page_cache import PageCache
+from archive import Archive
+from retention import RetentionPolicy, Pruner
+from ratelimit import RateLimiter
+from metrics import Metrics
+from profiler import Profiler
+from compression import GzipRequestMiddleware, compress_response
+from delta import make_delta
+from chunked_upload import UploadStore, UploadError
+from transfer import export_records, ndjson_chunks, open_import_stream, import_ndjson
+from search import search_items, encode_offset, decode_offset, MAX_OFFSET as MAX_SEARCH_OFFSET
+from storage import content_hash, create_item, find_by_client_ids, latest_duplicate, record_collapsed, PREVIEW_CHARS
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 import pytz
+import math
+import zlib
 import os
 
-app = Flask(__name__)
-CORS(app)  # 启用CORS支持
+def create_app(config=None):
+    """创建 Flask 应用：加载配置（默认值、环境变量，再用 config 覆盖，见 config.py）并初始化数据库
 
-# 配置数据库
-if os.environ.get('RAILWAY_ENVIRONMENT'):
-    # Railway环境使用PostgreSQL
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', '').replace('postgres://', 'postgresql://')
-else:
-    # 本地环境使用SQLite
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///clipboard.db'
+    CLIPBOARD_INSTANCE_PATH 可以把数据库等数据文件放到别的目录（必须是绝对路径，压测时使用临时目录）
+    """
+    flask_app = Flask(__name__, instance_path=os.environ.get('CLIPBOARD_INSTANCE_PATH') or None)
+    CORS(flask_app)  # 启用CORS支持
+    load_config(flask_app, config)
+    init_db(flask_app)
+    return flask_app
 
-init_db(app)
+app = create_app()
+
+# 新内容通知：在所有 gunicorn worker 之间广播
+broker = Broker(app.instance_path)
+
+# 每个设备最新记录的缓存，配合 ETag 让空闲轮询不查询数据库
+latest_cache = LatestCache(broker, ttl=int(os.environ.get('LATEST_CACHE_TTL', 60)))
+
+# 只读接口从副本读取（配置了 DATABASE_REPLICA_URL 时），设备刚写入过的读取仍走主库
+read_router = ReadRouter(db, broker, max_lag=app.config['REPLICA_MAX_LAG'],
+                         enabled=bool(app.config['DATABASE_REPLICA_URL']))
+REPLICA_ENDPOINTS = {"index", "page_new_items", "get_latest_clipboard", "get_clipboard_history"}
+
+@app.before_request
+def route_reads():
+    if request.endpoint in REPLICA_ENDPOINTS:
+        read_router.route(request.args.get("device_id"))
+
+# 长轮询最长等待时间（秒），需小于 gunicorn 的 worker 超时
+MAX_WAIT_TIMEOUT = 25
+
+# 内容超过该长度时才尝试增量返回
+DELTA_MIN_SIZE = 4096
+
+# 请求剖析和慢请求记录（见 profiler.py 中的环境变量），默认关闭，关闭时不注册钩子；
+# 在运行指标之前注册，剖析和计时把指标、压缩等其他钩子也算在内
+profiler = Profiler.from_env(os.path.join(app.instance_path, 'profiles'))
+with app.app_context():
+    profiler.init_app(app, *db.engines.values())
+
+# 运行指标：每个 worker 定期把计数写到 instance/metrics，/metrics 汇总所有 worker
+# 需要在压缩之前注册，after_request 按注册的逆序执行，这样记录的是压缩后的响应大小
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+metrics = Metrics(os.path.join(app.instance_path, 'metrics'),
+                  flush_interval=float(os.environ.get('METRICS_FLUSH_INTERVAL', 5)))
+if METRICS_ENABLED:
+    with app.app_context():
+        metrics.init_app(app, *db.engines.values())
+
+# 压缩传输：解压 gzip 请求体，按 Accept-Encoding 压缩响应
+app.wsgi_app = GzipRequestMiddleware(app.wsgi_app, app.config['MAX_DECOMPRESSED_BYTES'])
+app.after_request(compress_response)
+
+# 历史记录归档：开启 ARCHIVE_ENABLED 后，清理任务删除的记录先写入归档
+archive = Archive(os.path.join(app.instance_path, 'archive'))
+ARCHIVE_ENABLED = os.environ.get('ARCHIVE_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+# 保留策略（见 retention.py 中的环境变量），未配置任何限制时不启动清理任务
+def on_items_pruned(device_ids):
+    for device_id in device_ids:
+        broker.publish({"device_id": device_id, "invalidate": True})
+
+pruner = Pruner(app, RetentionPolicy.from_env(), archive if ARCHIVE_ENABLED else None,
+                on_deleted=on_items_pruned)
+pruner.start()
+
+# 组提交（GROUP_COMMIT=1）：几毫秒内到达的上传合并到一个事务里提交
+# WRITE_DURABILITY=wait 时等待提交后返回，enqueue 时放进队列就返回202
+group_commit = GroupCommitter.from_env(app)
+
+# 写入接口的限流（默认关闭）：每个设备和全部设备各一个令牌桶（见 ratelimit.py 中的环境变量），
+# 桶放在 instance 目录下的共享文件里，所有 worker 共用
+rate_limiter = RateLimiter.from_env(os.path.join(app.instance_path, 'ratelimit.bin'))
+
+# 大内容的分块上传会话，保存在 instance/uploads 下，所有 worker 共享
+upload_store = UploadStore(os.path.join(app.instance_path, 'uploads'),
+                           chunk_size=app.config['UPLOAD_CHUNK_SIZE'],
+                           max_size=app.config['MAX_CLIPBOARD_BYTES'])
 
 # HTML模板
 HTML_TEMPLATE = """
@@ -26,6 +117,7 @@ HTML_TEMPLATE = """
 <head>
     <title>剪贴板历史记录</title>
     <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
     <style>
         body {
             font-family: Arial, sans-serif;
@@ -51,6 +143,10 @@ HTML_TEMPLATE = """
             margin-bottom: 10px;
             word-break: break-all;
         }
+        .truncated {
+            color: #999;
+            font-size: 14px;
+        }
         .meta {
             color: #666;
             font-size: 14px;
@@ -67,6 +163,10 @@ HTML_TEMPLATE = """
         .refresh-btn:hover {
             background: #45a049;
         }
+        .pager {
+            text-align: center;
+            margin: 20px 0;
+        }
         .empty-message {
             text-align: center;
             color: #666;
@@ -77,55 +177,506 @@ HTML_TEMPLATE = """
 <body>
     <h1>📋 剪贴板历史记录</h1>
     <div style="text-align: center;">
-        <button class="refresh-btn" onclick="location.reload()">刷新</button>
+        {% if before %}
+        <a class="refresh-btn" href="/">回到最新</a>
+        {% else %}
+        <button class="refresh-btn" onclick="loadNewItems()">刷新</button>
+        {% endif %}
     </div>
-    {% if items %}
-        {% for item in items %}
-        <div class="clipboard-item">
-            <div class="content">{{ item.content }}</div>
-            <div class="meta">
-                📱 设备ID: {{ item.device_id }}<br>
-                ⏰ 时间: {{ item.timestamp }}
-            </div>
-        </div>
-        {% endfor %}
-    {% else %}
-        <div class="empty-message">
-            <p>还没有剪贴板记录</p>
-        </div>
+    <div id="items" data-newest="{{ newest_cursor or '' }}">{{ items_html }}</div>
+    <div class="empty-message" id="empty-message"{% if items_html %} hidden{% endif %}>
+        <p>还没有剪贴板记录</p>
+    </div>
+    {% if next_cursor %}
+    <div class="pager"><a href="/?before={{ next_cursor }}">更早的记录 »</a></div>
     {% endif %}
+    <script>
+        // 只获取比页面上最新一条更新的记录，插到列表顶部，不重新加载整页
+        async function loadNewItems() {
+            const list = document.getElementById("items");
+            while (true) {
+                const cursor = list.dataset.newest;
+                const response = await fetch(cursor ? "/page/items?after=" + encodeURIComponent(cursor) : "/page/items");
+                if (!response.ok) {
+                    location.reload();
+                    return;
+                }
+                const page = await response.json();
+                if (!page.html) {
+                    return;
+                }
+                list.insertAdjacentHTML("afterbegin", page.html);
+                list.dataset.newest = page.cursor;
+                document.getElementById("empty-message").hidden = true;
+                if (!cursor) {
+                    return;
+                }
+            }
+        }
+    </script>
 </body>
 </html>
 """
 
+# 单条记录的片段，整页和增量刷新共用
+ITEMS_TEMPLATE = """
+{% for item in items %}
+<div class="clipboard-item">
+    <div class="content">{{ item.preview }}{% if item.truncated %}<span class="truncated">…（共 {{ item.size }} 字节）</span>{% endif %}</div>
+    <div class="meta">
+        📱 设备ID: {{ item.device_id }}<br>
+        ⏰ 时间: {{ item.time }}
+    </div>
+</div>
+{% endfor %}
+"""
+
+# 模板只编译一次
+page_template = app.jinja_env.from_string(HTML_TEMPLATE)
+items_template = app.jinja_env.from_string(ITEMS_TEMPLATE)
+
+# 渲染好的页面缓存，收到任何写入广播时清空
+page_cache = PageCache(broker, ttl=int(os.environ.get('PAGE_CACHE_TTL', 60)))
+
+PAGE_SIZE = 20
+PAGE_TZ = pytz.timezone('Asia/Shanghai')  # 使用中国时区
+
+def page_items(before=None, after=None):
+    """返回 (页面用的字典, 原始行, next_cursor)；只查询预览和大小，不加载完整内容，也不修改 ORM 对象"""
+    query = db.session.query(
+        ClipboardItem.id, ClipboardItem.device_id, ClipboardItem.timestamp,
+        ClipboardBlob.preview, ClipboardBlob.size,
+    ).join(ClipboardBlob, ClipboardBlob.hash == ClipboardItem.content_hash)
+    rows, next_cursor = paginate(query, ClipboardItem, PAGE_SIZE, before=before, after=after)
+    items = [{
+        "device_id": row.device_id,
+        "time": row.timestamp.replace(tzinfo=pytz.UTC).astimezone(PAGE_TZ).strftime("%Y-%m-%d %H:%M:%S"),
+        "preview": row.preview,
+        "truncated": is_truncated(row.preview, row.size),
+        "size": row.size,
+    } for row in rows]
+    return items, rows, next_cursor
+
+def cached_response(key, render, mimetype):
+    """从缓存或 render() 取得响应体，带上 ETag 并处理条件请求"""
+    cached = page_cache.get(key)
+    if cached:
+        etag, body = cached
+    else:
+        generation = page_cache.generation
+        body = render()
+        etag = page_cache.store(key, body, generation)
+    response = app.response_class(body, mimetype=mimetype)
+    response.set_etag(etag)
+    # 页面会随新记录变化，每次都向服务器确认，内容没变时只返回304
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
 @app.route("/")
 def index():
-    # 获取最近的剪贴板记录
-    items = ClipboardItem.query.order_by(ClipboardItem.timestamp.desc()).limit(20).all()
-    
-    # 转换时间为本地时间
-    local_tz = pytz.timezone('Asia/Shanghai')  # 使用中国时区
-    for item in items:
-        local_time = item.timestamp.replace(tzinfo=pytz.UTC).astimezone(local_tz)
-        item.timestamp = local_time.strftime("%Y-%m-%d %H:%M:%S")
-    
-    return render_template_string(HTML_TEMPLATE, items=items)
+    # 获取最近的剪贴板记录；before 为游标时显示更早的一页
+    before = request.args.get("before")
+    if before:
+        try:
+            decode_cursor(before)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    def render():
+        items, rows, next_cursor = page_items(before=before)
+        with metrics.phase("render"):
+            return page_template.render(
+                items_html=Markup(items_template.render(items=items)) if items else "",
+                newest_cursor=encode_cursor(rows[0]) if rows and not before else None,
+                next_cursor=next_cursor,
+                before=before,
+            )
+
+    return cached_response(("page", before), render, "text/html")
+
+# 👉 页面增量刷新：返回比 after 更新的记录片段（HTML），不带 after 时返回最新一页
+@app.route("/page/items", methods=["GET"])
+def page_new_items():
+    after = request.args.get("after")
+    if after:
+        try:
+            decode_cursor(after)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+
+    def render():
+        items, rows, next_cursor = page_items(after=after)
+        cursor = encode_cursor(rows[0]) if rows else after
+        with metrics.phase("render"):
+            html = items_template.render(items=items) if items else ""
+        return jsonify({"html": html, "cursor": cursor}).get_data(as_text=True)
+
+    return cached_response(("items", after), render, "application/json")
+
+def payload_too_large():
+    """请求体超过 MAX_DECOMPRESSED_BYTES 时返回413响应
+
+    Werkzeug 2.2 的 get_json 不检查 MAX_CONTENT_LENGTH，上传接口在解析之前自己检查；
+    gzip 请求体由 GzipRequestMiddleware 解压，这里的长度是解压后的长度
+    """
+    limit = app.config['MAX_DECOMPRESSED_BYTES']
+    if request.content_length is not None and request.content_length > limit:
+        return jsonify({"error": f"Payload too large (max {limit} bytes)"}), 413
+    return None
 
 # 👉 剪贴板上传接口
 @app.route("/clipboard", methods=["POST"])
 def upload_clipboard():
+    too_large = payload_too_large()
+    if too_large:
+        return too_large
     data = request.get_json()
     content = data.get("content")
+    digest = data.get("content_hash")
     device_id = data.get("device_id")
+    client_id = data.get("client_id")
+    group = data.get("group")
 
-    if not content or not device_id:
+    if not (content or digest) or not device_id:
         return jsonify({"error": "Missing content or device_id"}), 400
+    if invalid_group(group):
+        return jsonify({"error": "Invalid group"}), 400
+    limited = rate_limited(device_id)
+    if limited:
+        return limited
+    if content and digest and content_hash(content) != digest:
+        return jsonify({"error": "content_hash does not match content"}), 400
+    if content and len(content.encode("utf-8")) > app.config['MAX_CLIPBOARD_BYTES']:
+        return jsonify({"error": f"Payload too large (max {app.config['MAX_CLIPBOARD_BYTES']} bytes)"}), 413
+
+    if group_commit.enabled:
+        # 只带哈希的上传需要知道服务器有没有这份内容，总是等待提交结果
+        if group_commit.durability == "enqueue" and content:
+            group_commit.submit(save_item, device_id, content, None, client_id, group, after_commit=after_saved)
+            return jsonify({"status": "queued"}), 202
+        future = group_commit.submit(save_item, device_id, content or None, digest, client_id, group,
+                                     after_commit=after_saved)
+        try:
+            saved = future.result()
+        except IntegrityError:
+            existing = find_by_client_ids(device_id, [client_id]).get(client_id)
+            if not existing:
+                raise
+            return jsonify(saved_response(existing))
+    else:
+        begin_write()
+        saved = save_item(device_id, content or None, digest, client_id, group)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # 同一个 client_id 的并发重试，另一个请求已经写入
+            db.session.rollback()
+            existing = find_by_client_ids(device_id, [client_id]).get(client_id)
+            if not existing:
+                raise
+            return jsonify(saved_response(existing))
+        after_saved(saved)
+
+    if saved is None:
+        return jsonify({"error": "Unknown content_hash", "need_content": True}), 404
+    return jsonify({"status": "collapsed" if saved.get("collapsed") else "success",
+                    "id": saved["id"], "seq": saved["seq"]})
+
+def save_item(device_id, content, digest, client_id, group=None):
+    """写入一条记录但不提交，返回包含 device_id、id、group、seq 和是否新建的字典
+
+    带相同 client_id 的重试直接返回上次的结果；和组里（或该设备）最新的一条内容相同时
+    不新增记录，返回那一条并带上 collapsed；只带哈希而服务器没有这份内容时返回 None。
+    """
+    item = find_by_client_ids(device_id, [client_id]).get(client_id)
+    created = item is None
+    if created:
+        duplicate = latest_duplicate(device_id, digest or content_hash(content), group)
+        if duplicate is not None:
+            record_collapsed(device_id, client_id, duplicate.id)
+            return {"device_id": device_id, "id": duplicate.id, "group": duplicate.sync_group,
+                    "seq": duplicate.seq, "created": False, "collapsed": True}
+        # 只带哈希上传时，服务器已有这份内容就直接引用，否则让客户端补传全文
+        item = create_item(device_id, content=content, digest=digest, client_id=client_id, group=group)
+        if item is None:
+            return None
+        db.session.flush()
+    return {"device_id": device_id, "id": item.id, "group": item.sync_group, "seq": item.seq, "created": created}
+
+def after_saved(saved):
+    """save_item 的事务提交后调用：广播新记录，统计被折叠的上传
+
+    组提交失败后会逐个重新执行 save_item，这些只在提交成功后做一次。
+    """
+    if not saved:
+        return
+    if saved["created"]:
+        publish_item(saved["device_id"], saved["id"], saved["group"], saved["seq"])
+    elif saved.get("collapsed"):
+        count_collapsed("/clipboard")
+
+def publish_item(device_id, item_id, group=None, seq=None):
+    """广播新记录：按设备等待的长轮询和按同步组等待的变更流都会收到"""
+    message = {"device_id": device_id, "id": item_id}
+    if group:
+        message.update(group=group, seq=seq)
+    broker.publish(message)
+
+def count_collapsed(route, count=1):
+    metrics.inc("clipboard_collapsed_uploads_total", {"route": route}, count)
+
+def saved_response(item):
+    return {"status": "success", "id": item.id, "seq": item.seq}
+
+def rate_limited(device_id):
+    """超出限额时返回 429 响应（Retry-After 为需要等待的秒数），否则返回 None"""
+    if not rate_limiter.enabled:
+        return None
+    wait = rate_limiter.acquire(device_id)
+    if not wait:
+        return None
+    response = jsonify({"error": "Too many requests", "retry_after": round(wait, 3)})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(max(1, math.ceil(wait)))
+    return response
+
+def invalid_group(group):
+    return group is not None and (not isinstance(group, str) or not group or len(group) > 100)
+
+# 👉 批量上传接口：在一个事务里按顺序写入多条记录，返回每条记录的ID
+@app.route("/clipboard/batch", methods=["POST"])
+def upload_clipboard_batch():
+    too_large = payload_too_large()
+    if too_large:
+        return too_large
+    data = request.get_json()
+    device_id = data.get("device_id")
+    entries = data.get("items")
+    group = data.get("group")
+
+    if not device_id or not isinstance(entries, list):
+        return jsonify({"error": "Missing items or device_id"}), 400
+    if invalid_group(group):
+        return jsonify({"error": "Invalid group"}), 400
+    limited = rate_limited(device_id)
+    if limited:
+        return limited
+    if len(entries) > app.config['BATCH_MAX_ITEMS']:
+        return jsonify({"error": f"Too many items (max {app.config['BATCH_MAX_ITEMS']})"}), 413
+    for entry in entries:
+        if not isinstance(entry, dict) or not (entry.get("content") or entry.get("content_hash")):
+            return jsonify({"error": "Missing content in batch item"}), 400
+        if entry.get("content") and entry.get("content_hash") \
+                and content_hash(entry["content"]) != entry["content_hash"]:
+            return jsonify({"error": "content_hash does not match content"}), 400
+        if entry.get("content") and len(entry["content"].encode("utf-8")) > app.config['MAX_CLIPBOARD_BYTES']:
+            return jsonify({"error": f"Payload too large (max {app.config['MAX_CLIPBOARD_BYTES']} bytes)"}), 413
+
+    # 并发重试撞上唯一索引时回滚重来一次，这时已写入的记录会被识别为重复
+    for attempt in range(2):
+        begin_write()
+        results, created = save_batch(device_id, entries, group)
+        try:
+            db.session.commit()
+            break
+        except IntegrityError:
+            db.session.rollback()
+            if attempt:
+                raise
+
+    if created:
+        newest = max(created, key=lambda item: item.id)
+        publish_item(device_id, newest.id, newest.sync_group, newest.seq)
+    collapsed = sum(1 for result in results if result["status"] == "collapsed")
+    if collapsed:
+        count_collapsed("/clipboard/batch", collapsed)
+
+    return jsonify({
+        "status": "success",
+        "results": [
+            {"client_id": result["client_id"], "status": result["status"],
+             "id": result["item"].id if result["item"] else None,
+             "seq": result["item"].seq if result["item"] else None}
+            for result in results
+        ]
+    })
+
+def save_batch(device_id, entries, group=None):
+    """写入一批记录（不提交），返回每条的结果和新建的记录
+
+    和当时最新的一条内容相同的记录不新增（状态为 collapsed），返回的是那一条。
+    """
+    existing = find_by_client_ids(device_id, [entry.get("client_id") for entry in entries])
+    results = []
+    created = []
+    collapsed = []
+    for entry in entries:
+        client_id = entry.get("client_id")
+        item = existing.get(client_id)
+        status = "duplicate"
+        if item is None:
+            digest = entry.get("content_hash") or content_hash(entry["content"])
+            if created:
+                item = created[-1] if created[-1].content_hash == digest else None
+            else:
+                item = latest_duplicate(device_id, digest, group)
+            if item is not None:
+                status = "collapsed"
+                collapsed.append((client_id, item))
+            else:
+                item = create_item(device_id, content=entry.get("content") or None,
+                                   digest=entry.get("content_hash"), client_id=client_id, group=group)
+                status = "created" if item else "need_content"
+                if item:
+                    created.append(item)
+            if item and client_id:
+                existing[client_id] = item
+        results.append({"client_id": client_id, "status": status, "item": item})
+    db.session.flush()
+    # 折叠到本批新建的记录上时，flush 之后才有 id
+    for client_id, item in collapsed:
+        record_collapsed(device_id, client_id, item.id)
+    return results, created
+
+# 👉 分块上传：创建上传会话
+@app.route("/clipboard/uploads", methods=["POST"])
+def create_upload():
+    data = request.get_json()
+    device_id = data.get("device_id")
+    digest = data.get("content_hash")
+    size = data.get("size")
+    group = data.get("group")
+
+    if not device_id or not digest or not isinstance(size, int):
+        return jsonify({"error": "Missing device_id, content_hash or size"}), 400
+    if invalid_group(group):
+        return jsonify({"error": "Invalid group"}), 400
+    limited = rate_limited(device_id)
+    if limited:
+        return limited
+
+    try:
+        meta = upload_store.create(device_id, size, digest, client_id=data.get("client_id"), group=group)
+    except UploadError as e:
+        return jsonify({"error": e.message}), e.status
+    return jsonify(upload_status(meta)), 201
+
+# 👉 分块上传：查询会话状态，断线后从 next_chunk 继续
+@app.route("/clipboard/uploads/<upload_id>", methods=["GET"])
+def get_upload(upload_id):
+    try:
+        meta = upload_store.status(upload_id)
+    except UploadError as e:
+        return jsonify({"error": e.message}), e.status
+    return jsonify(upload_status(meta))
+
+# 👉 分块上传：上传第 index 块，请求体为原始字节
+@app.route("/clipboard/uploads/<upload_id>/chunks/<int:index>", methods=["PUT"])
+def put_upload_chunk(upload_id, index):
+    try:
+        meta = upload_store.write_chunk(upload_id, index, request.stream)
+    except UploadError as e:
+        return jsonify({"error": e.message}), e.status
+    return jsonify(upload_status(meta))
+
+# 👉 分块上传：所有分块上传完后提交，校验哈希并写入数据库
+@app.route("/clipboard/uploads/<upload_id>/commit", methods=["POST"])
+def commit_upload(upload_id):
+    try:
+        path, meta = upload_store.verify(upload_id)
+    except UploadError as e:
+        return jsonify({"error": e.message}), e.status
+
+    device_id = meta["device_id"]
+    client_id = meta["client_id"]
+    begin_write()
+    item = find_by_client_ids(device_id, [client_id]).get(client_id)
+    duplicate = None
+    if item is None:
+        duplicate = latest_duplicate(device_id, meta["content_hash"], meta.get("group"))
+    if duplicate is not None:
+        record_collapsed(device_id, client_id, duplicate.id)
+        db.session.commit()
+        count_collapsed("/clipboard/uploads/<upload_id>/commit")
+        upload_store.discard(upload_id)
+        return jsonify(dict(saved_response(duplicate), status="collapsed"))
+    if item is None:
+        item = create_item(device_id, digest=meta["content_hash"], client_id=client_id, group=meta.get("group"),
+                           path=path)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            item = find_by_client_ids(device_id, [client_id]).get(client_id)
+            if not item:
+                raise
+        else:
+            publish_item(device_id, item.id, item.sync_group, item.seq)
+
+    upload_store.discard(upload_id)
+    return jsonify(saved_response(item))
+
+def upload_status(meta):
+    return {
+        "upload_id": meta["upload_id"],
+        "chunk_size": meta["chunk_size"],
+        "next_chunk": meta["next_chunk"],
+        "received": meta["received"],
+        "size": meta["size"]
+    }
+
+def item_to_dict(item):
+    return {
+        "id": item.id,
+        "content": item.content,
+        "device_id": item.device_id,
+        "content_hash": item.content_hash,
+        "timestamp": item.timestamp.isoformat()
+    }
+
+def is_truncated(preview, size):
+    return size > len((preview or "").encode("utf-8"))
+
+def summary_dict(item_id, device_id, timestamp, digest, preview, size):
+    """列表中的一条记录：只有预览、大小和哈希，完整内容从 /clipboard/<id>/content 获取"""
+    return {
+        "id": item_id,
+        "device_id": device_id,
+        "timestamp": timestamp,
+        "content_hash": digest,
+        "preview": preview,
+        "size": size,
+        "truncated": is_truncated(preview, size)
+    }
+
+def item_summary(item):
+    return summary_dict(item.id, item.device_id, item.timestamp.isoformat(),
+                        item.content_hash, item.blob.preview or "", item.blob.size)
 
-    item = ClipboardItem(content=content, device_id=device_id, timestamp=datetime.utcnow())
-    db.session.add(item)
-    db.session.commit()
+def archived_summary(record):
+    content = record["content"]
+    return summary_dict(record["id"], record["device_id"], record["timestamp"], record["content_hash"],
+                        content[:PREVIEW_CHARS], len(content.encode("utf-8")))
 
-    return jsonify({"status": "success", "id": item.id})
+def item_payload(item, delta_base=None):
+    """序列化记录；客户端已持有同一设备的 delta_base 版本且增量更小时，只返回增量"""
+    data = item_to_dict(item)
+    content = data["content"]
+    if delta_base and delta_base != item.id and len(content) >= DELTA_MIN_SIZE:
+        base = db.session.get(ClipboardItem, delta_base)
+        if base and base.device_id == item.device_id:
+            delta = make_delta(base.content, content)
+            if len(delta["insert"]) < len(content) // 2:
+                del data["content"]
+                data["delta"] = dict(delta, base_id=delta_base)
+    return data
+
+def latest_etag(item_id):
+    return f"latest-{item_id}"
+
+def latest_item(device_id):
+    return ClipboardItem.query.filter_by(device_id=device_id).options(with_content())\
+        .order_by(ClipboardItem.timestamp.desc(), ClipboardItem.id.desc()).first()
 
 # 👉 获取最新剪贴板内容接口
 @app.route("/clipboard/latest", methods=["GET"])
@@ -134,37 +685,358 @@ def get_latest_clipboard():
     if not device_id:
         return jsonify({"error": "Missing device_id"}), 400
 
-    item = ClipboardItem.query.filter_by(device_id=device_id)\
-        .order_by(ClipboardItem.timestamp.desc()).first()
+    # 客户端手里已经是最新版本时直接返回304，不查询数据库
+    version = latest_cache.version(device_id)
+    if version is not None and request.if_none_match.contains_weak(latest_etag(version)):
+        response = Response(status=304)
+        response.set_etag(latest_etag(version))
+        return response
 
-    if not item:
-        return jsonify({"message": "No data found"}), 404
+    # 带 delta_base 的请求返回的是增量，不走也不写缓存
+    delta_base = request.args.get("delta_base", type=int)
+    cached = None if delta_base else latest_cache.get(device_id)
+    if cached:
+        item_id, body = cached
+    else:
+        if app.config['PROJECTION_READS'] and not delta_base:
+            latest = latest_json(device_id)
+            if latest is None:
+                return jsonify({"message": "No data found"}), 404
+            item_id, body = latest
+        else:
+            item = latest_item(device_id)
+
+            if not item:
+                return jsonify({"message": "No data found"}), 404
+
+            item_id, body = item.id, jsonify(item_payload(item, delta_base)).get_data()
+        if not delta_base:
+            latest_cache.store(device_id, item_id, body)
+
+    response = app.response_class(body, mimetype="application/json")
+    response.set_etag(latest_etag(item_id))
+    return response.make_conditional(request)
+
+# 👉 长轮询接口：有比 since 更新的内容时立即返回，否则阻塞等待直到超时（204）
+@app.route("/clipboard/wait", methods=["GET"])
+def wait_clipboard():
+    device_id = request.args.get("device_id")
+    if not device_id:
+        return jsonify({"error": "Missing device_id"}), 400
+    since = request.args.get("since", default=0, type=int)
+    delta_base = request.args.get("delta_base", type=int)
+    timeout = min(request.args.get("timeout", default=MAX_WAIT_TIMEOUT, type=float), MAX_WAIT_TIMEOUT)
+
+    # 先订阅再查库，避免在两者之间到达的通知被漏掉
+    with broker.subscribe(lambda m: m.get("device_id") == device_id and m.get("id", 0) > since) as sub:
+        # 缓存确认没有更新的内容时跳过查询，直接开始等待
+        version = latest_cache.version(device_id)
+        if version is None or version > since:
+            item = latest_item(device_id)
+            if item and item.id > since:
+                return jsonify(item_payload(item, delta_base))
+
+        # 等待期间不占用数据库连接
+        db.session.remove()
+        if not sub.wait(timeout):
+            return "", 204
+
+    item = latest_item(device_id)
+    if not item or item.id <= since:
+        return "", 204
+    return jsonify(item_payload(item, delta_base))
+
+def read_changes(group, since, exclude_device, limit):
+    """返回组内序号大于 since 的记录（不含 exclude_device 上传的）、下一次的 since 和是否还有更多
+
+    先读出组内已提交的最大序号，只扫描到这里为止：比它小的序号都已经提交，
+    客户端把 since 推进到这里不会跳过任何记录。
+    """
+    head = db.session.execute(
+        db.select(SyncGroup.last_seq).where(SyncGroup.name == group)
+    ).scalar() or 0
+    query = ClipboardItem.query.filter(
+        ClipboardItem.sync_group == group,
+        ClipboardItem.seq > since,
+        ClipboardItem.seq <= head
+    )
+    if exclude_device:
+        query = query.filter(ClipboardItem.device_id != exclude_device)
+    items = query.options(with_content()).order_by(ClipboardItem.seq).limit(limit).all()
+    if len(items) == limit:
+        return items, items[-1].seq, True
+    return items, max(head, since), False
+
+# 👉 变更流：返回同步组里 since 之后其他设备的新记录，timeout 大于0时没有新记录会等待
+@app.route("/clipboard/changes", methods=["GET"])
+def get_changes():
+    group = request.args.get("group")
+    if not group or invalid_group(group):
+        return jsonify({"error": "Missing group"}), 400
+    since = request.args.get("since", type=int)
+    exclude_device = request.args.get("exclude_device")
+    limit = request.args.get("limit", default=50, type=int)
+    limit = max(1, min(limit, app.config['HISTORY_MAX_LIMIT']))
+    timeout = min(request.args.get("timeout", default=0, type=float), MAX_WAIT_TIMEOUT)
+
+    if since is None:
+        # 第一次同步不回放组里的历史，从当前位置开始
+        head = db.session.execute(
+            db.select(SyncGroup.last_seq).where(SyncGroup.name == group)
+        ).scalar() or 0
+        return jsonify({"items": [], "next_since": head, "has_more": False})
+
+    def is_change(message):
+        return message.get("group") == group and message.get("seq", 0) > since \
+            and message.get("device_id") != exclude_device
+
+    # 先订阅再查库，避免在两者之间到达的通知被漏掉
+    with broker.subscribe(is_change) as sub:
+        items, next_since, has_more = read_changes(group, since, exclude_device, limit)
+        if not items and next_since == since and timeout > 0:
+            # 等待期间不占用数据库连接
+            db.session.remove()
+            if sub.wait(timeout):
+                items, next_since, has_more = read_changes(group, since, exclude_device, limit)
 
     return jsonify({
-        "id": item.id,
-        "content": item.content,
-        "device_id": item.device_id,
-        "timestamp": item.timestamp.isoformat()
+        "items": [dict(item_to_dict(item), seq=item.seq) for item in items],
+        "next_since": next_since,
+        "has_more": has_more
     })
 
-# 👉 获取剪贴板历史记录接口
+# 👉 获取剪贴板历史记录接口（游标分页：before 向更旧翻页，after 获取更新的记录）
+# 默认每条只返回预览、大小和哈希，include_content=1 时返回完整内容
 @app.route("/clipboard/history", methods=["GET"])
 def get_clipboard_history():
     device_id = request.args.get("device_id")
     limit = request.args.get("limit", default=10, type=int)
+    limit = max(1, min(limit, app.config['HISTORY_MAX_LIMIT']))
+    before = request.args.get("before")
+    after = request.args.get("after")
+    if before and after:
+        return jsonify({"error": "Use either before or after, not both"}), 400
+    
+    include_content = request.args.get("include_content") in ("1", "true")
+    include_archive = request.args.get("include_archive") in ("1", "true")
+    since_id = request.args.get("since_id", type=int)
+    if since_id is not None:
+        if before or after:
+            return jsonify({"error": "since_id cannot be combined with before or after"}), 400
+        return history_since(since_id, device_id, limit, include_content)
+    
+    if app.config['PROJECTION_READS'] and not include_archive:
+        try:
+            body = history_json(device_id, limit, before=before, after=after, include_content=include_content)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        return app.response_class(body, mimetype="application/json")
     
     query = ClipboardItem.query
     if device_id:
         query = query.filter_by(device_id=device_id)
+    if include_content:
+        query = query.options(with_content())
     
-    items = query.order_by(ClipboardItem.timestamp.desc()).limit(limit).all()
+    try:
+        items, next_cursor = paginate(query, ClipboardItem, limit, before=before, after=after)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
     
-    return jsonify([{
-        "id": item.id,
-        "content": item.content,
-        "device_id": item.device_id,
-        "timestamp": item.timestamp.isoformat()
-    } for item in items])
+    records = [item_to_dict(item) if include_content else item_summary(item) for item in items]
+    if include_archive:
+        records, next_cursor = merge_archived(records, next_cursor, limit, device_id, before, after,
+                                              include_content)
+    
+    return jsonify({
+        "items": records,
+        "next_cursor": next_cursor,
+        # 这一页最新一条的游标，客户端以后用 after 增量获取比它更新的记录
+        "newest_cursor": encode_cursor(items[0]) if items else after
+    })
+
+def history_since(since_id, device_id, limit, include_content=False):
+    """按记录ID从旧到新返回 since_id 之后写入的记录，供本地历史副本增量同步
+
+    导入的记录时间戳可能比已有的都旧，按时间游标 after 取不到，按ID不会漏掉。
+    """
+    query = ClipboardItem.query.filter(ClipboardItem.id > since_id)
+    if device_id:
+        query = query.filter_by(device_id=device_id)
+    if include_content:
+        query = query.options(with_content())
+    items = query.order_by(ClipboardItem.id).limit(limit).all()
+    return jsonify({
+        "items": [item_to_dict(item) if include_content else item_summary(item) for item in items],
+        "next_since_id": items[-1].id if items else since_id
+    })
+
+def merge_archived(records, next_cursor, limit, device_id, before, after, include_content=False):
+    """把归档中的记录按 (timestamp, id) 合并进数据库查到的这一页"""
+    def archive_bound(cursor):
+        if not cursor:
+            return None
+        timestamp, item_id = decode_cursor(cursor)
+        return timestamp.isoformat(timespec="microseconds"), item_id
+
+    archived = archive.query(limit, device_id=device_id, before=archive_bound(before), after=archive_bound(after))
+    if not archived:
+        return records, next_cursor
+
+    # 清理中途失败时同一条记录可能同时在数据库和归档里
+    if include_content:
+        for record in archived:
+            del record["content_hash"]
+    else:
+        archived = [archived_summary(record) for record in archived]
+    for record in archived:
+        record["archived"] = True
+    merged = {record["id"]: record for record in archived}
+    merged.update({record["id"]: record for record in records})
+    merged = sorted(merged.values(), key=lambda r: (datetime.fromisoformat(r["timestamp"]), r["id"]), reverse=True)
+
+    def cursor_of(record):
+        return encode_key(datetime.fromisoformat(record["timestamp"]), record["id"])
+
+    if after:
+        page = merged[-limit:]
+        return page, cursor_of(page[0])
+    page = merged[:limit]
+    return page, cursor_of(page[-1]) if len(page) == limit else None
+
+# 👉 获取单条记录的完整内容：支持 Range 分段下载，存为文件的内容直接从文件流式发送
+@app.route("/clipboard/<int:item_id>/content", methods=["GET"])
+def get_clipboard_content(item_id):
+    item = db.session.get(ClipboardItem, item_id)
+    if not item:
+        return jsonify({"message": "No data found"}), 404
+
+    blob = item.blob
+    if blob.location:
+        response = send_file(blob_file_path(blob.location), mimetype="text/plain",
+                             download_name=f"{item_id}.txt", conditional=True, etag=blob.hash)
+    else:
+        response = app.response_class(blob.content.encode("utf-8"), mimetype="text/plain")
+        response.set_etag(blob.hash)
+        response = response.make_conditional(request, accept_ranges=True, complete_length=blob.size)
+    response.accept_ranges = "bytes"
+    # 同一条记录的内容不会改变
+    response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    return response
+
+# 👉 批量导出：按时间顺序流式返回 NDJSON，gzip=1 时返回 gzip 压缩的文件
+@app.route("/clipboard/export", methods=["GET"])
+def export_clipboard():
+    device_id = request.args.get("device_id")
+    group = request.args.get("group")
+    compress = request.args.get("gzip") in ("1", "true")
+
+    filename = f"clipboard-export-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.ndjson"
+    if compress:
+        filename += ".gz"
+    body = stream_with_context(ndjson_chunks(export_records(device_id, group), compress))
+    response = Response(body, mimetype="application/gzip" if compress else "application/x-ndjson")
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+# 👉 批量导入：请求体为 NDJSON（Content-Type 为 application/gzip 时先解压），边读边分批写入
+# device_id 为缺少设备ID的记录使用的默认值，content_field 指定内容所在的字段
+@app.route("/clipboard/import", methods=["POST"])
+def import_clipboard():
+    device_id = request.args.get("device_id")
+    content_field = request.args.get("content_field", "content")
+    compressed = request.mimetype == "application/gzip"
+
+    # 和其他写入接口一样限流；没有指定设备时按来源地址计数
+    limited = rate_limited(device_id or request.remote_addr)
+    if limited:
+        return limited
+    limit = app.config['IMPORT_MAX_BYTES']
+    if request.content_length is not None and request.content_length > limit:
+        return jsonify({"error": f"Import too large (max {limit} bytes)"}), 413
+
+    try:
+        summary, devices, groups = import_ndjson(
+            open_import_stream(request.stream, compressed, limit), device_id=device_id,
+            content_field=content_field, max_bytes=app.config['MAX_CLIPBOARD_BYTES'])
+    except (OSError, EOFError, zlib.error):
+        return jsonify({"error": "Invalid gzip body"}), 400
+
+    for device in devices:
+        broker.publish({"device_id": device, "invalidate": True})
+    for group, (seq, device) in groups.items():
+        # 唤醒等待这个同步组变更的长轮询
+        broker.publish({"device_id": device, "invalidate": True, "group": group, "seq": seq})
+
+    too_large = summary.pop("too_large", None)
+    if too_large:
+        # 已经提交的批次保留，统计里是它们的结果
+        return jsonify(dict(summary, error=too_large)), 413
+    return jsonify(dict(summary, status="success"))
+
+# 👉 全文搜索接口：按相关度排序，返回高亮片段而不是完整内容
+@app.route("/clipboard/search", methods=["GET"])
+def search_clipboard():
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "Missing query"}), 400
+    device_id = request.args.get("device_id")
+    limit = request.args.get("limit", default=10, type=int)
+    limit = max(1, min(limit, app.config['HISTORY_MAX_LIMIT']))
+    cursor = request.args.get("cursor")
+    try:
+        offset = decode_offset(cursor) if cursor else 0
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    results, has_more = search_items(query, device_id=device_id, limit=limit, offset=offset)
+    next_offset = offset + len(results)
+    return jsonify({
+        "items": results,
+        "next_cursor": encode_offset(next_offset) if has_more and next_offset <= MAX_SEARCH_OFFSET else None
+    })
+
+# 👉 运行指标（Prometheus 文本格式）
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics disabled"}), 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def profiles_unavailable():
+    """剖析接口不可用时返回错误响应：没有开启剖析，或者设置了 PROFILE_TOKEN 但请求没有带上"""
+    if not profiler.enabled:
+        return jsonify({"error": "Profiling disabled"}), 404
+    if profiler.token and not profiler.authorized():
+        return jsonify({"error": "Forbidden"}), 403
+    return None
+
+# 👉 剖析结果：按路由汇总的列表和最近的慢请求（id 参数只返回这一条）
+@app.route("/debug/profiles", methods=["GET"])
+def list_profiles():
+    error = profiles_unavailable()
+    if error:
+        return error
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), 500)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    return jsonify({
+        "routes": profiler.summary(),
+        "slow": profiler.recent_traces(limit, request.args.get("id")),
+    })
+
+# 👉 下载某个路由合并了所有 worker 的剖析结果（pstats 格式）
+@app.route("/debug/profiles/<name>.prof", methods=["GET"])
+def download_profile(name):
+    error = profiles_unavailable()
+    if error:
+        return error
+    data = profiler.merged(name)
+    if data is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return Response(data, mimetype="application/octet-stream",
+                    headers={"Content-Disposition": f"attachment; filename={name}.prof"})
 
 if __name__ == "__main__":
     port = int(os.environ.get('PORT', 5001))
@@ -0,0 +1,117 @@
+"""剪贴板历史的归档层
+
+清理任务删除的旧记录可以先写进归档：gzip 压缩、只追加的 NDJSON 分段文件。
+每次追加写一个新的 gzip member（gzip 格式允许多个 member 首尾相接），
+分段超过大小上限后换新文件。segments.json 记录每个分段的 (timestamp, id) 范围，
+查询时跳过范围不相交的分段，按时间顺序逐个解压分段，凑够一页后就停止。
+"""
+import gzip
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+
+
+def record_key(record):
+    return record["timestamp"], record["id"]
+
+
+class Archive:
+    def __init__(self, directory, max_segment_bytes=16 * 1024 * 1024):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.directory, "segments.json")
+
+    def segments(self):
+        try:
+            with open(self._manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def _save_segments(self, segments):
+        tmp = f"{self._manifest_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(segments, f)
+        os.replace(tmp, self._manifest_path)
+
+    def append(self, records):
+        """追加一批记录（字典，timestamp 为 ISO 格式字符串）
+
+        调用方需保证同一时间只有一个写入者（清理任务持有文件锁）。
+        """
+        if not records:
+            return
+        with self._lock:
+            segments = self.segments()
+            if not segments or segments[-1]["bytes"] >= self.max_segment_bytes:
+                name = f"segment-{time.strftime('%Y%m%d%H%M%S')}-{len(segments):06d}.ndjson.gz"
+                segments.append({"name": name, "bytes": 0, "count": 0, "min_key": None, "max_key": None})
+            segment = segments[-1]
+
+            data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode("utf-8")
+            with open(os.path.join(self.directory, segment["name"]), "ab") as f:
+                f.write(gzip.compress(data))
+                f.flush()
+                os.fsync(f.fileno())
+
+            keys = [list(record_key(record)) for record in records]
+            segment["bytes"] += len(data)
+            segment["count"] += len(records)
+            segment["min_key"] = min([segment["min_key"]] + keys) if segment["min_key"] else min(keys)
+            segment["max_key"] = max([segment["max_key"]] + keys) if segment["max_key"] else max(keys)
+            self._save_segments(segments)
+
+    def _read_segment(self, name):
+        with gzip.open(os.path.join(self.directory, name), "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def query(self, limit, device_id=None, before=None, after=None):
+        """按 (timestamp, id) 查询归档记录，返回从新到旧排列的最多 limit 条
+
+        before/after 为 (timestamp ISO 字符串, id) 形式的边界，语义与历史记录分页一致：
+        before 取更旧的记录，after 取紧接在边界之后更新的记录。
+        """
+        def matches(record):
+            key = record_key(record)
+            if device_id and record["device_id"] != device_id:
+                return False
+            if before and key >= tuple(before):
+                return False
+            return not (after and key <= tuple(after))
+
+        segments = [segment for segment in self.segments() if segment["count"]
+                    and not (before and tuple(segment["min_key"]) >= tuple(before))
+                    and not (after and tuple(segment["max_key"]) <= tuple(after))]
+        # 没有 after 时从最新的分段往旧的方向读，after 方向从紧接边界的分段往新的方向读；
+        # 已经凑够 limit 条、剩下的分段里不可能有更合适的记录时停止，不用解压整个归档
+        newest_first = not after
+        if newest_first:
+            segments.sort(key=lambda segment: tuple(segment["max_key"]), reverse=True)
+            pick = heapq.nlargest
+        else:
+            segments.sort(key=lambda segment: tuple(segment["min_key"]))
+            pick = heapq.nsmallest
+
+        records = []  # 按读取方向排好序，最后一条是目前入选的边界
+        for segment in segments:
+            if len(records) >= limit:
+                bound = record_key(records[-1])
+                if newest_first and tuple(segment["max_key"]) < bound:
+                    break
+                if not newest_first and tuple(segment["min_key"]) > bound:
+                    break
+            # 流式取前 limit 条，内存只和 limit 有关
+            matched = (record for record in self._read_segment(segment["name"]) if matches(record))
+            records = pick(limit, itertools.chain(records, matched), key=record_key)
+        records.sort(key=record_key, reverse=True)
+        return records
@@ -0,0 +1,103 @@
+"""剪贴板历史的备份和迁移命令行工具
+
+    python backup.py export -o history.ndjson.gz          # 导出全部历史（.gz 结尾时压缩）
+    python backup.py import history.ndjson.gz --server https://新服务器
+
+导出和导入都走服务器的 /clipboard/export 和 /clipboard/import 接口，数据边下载边写文件、
+边读文件边上传，不会整个读进内存。在 SQLite 和 PostgreSQL 之间迁移时，
+从旧服务器导出再导入新服务器即可；重复导入同一个文件不会产生重复记录。
+"""
+import argparse
+import sys
+import time
+from urllib.parse import urljoin
+
+from http_client import HttpClient
+
+SERVER_URL = "http://127.0.0.1:5001"
+TRANSFER_TIMEOUT = 600  # 导入大文件时服务器处理的时间较长（秒）
+
+
+def export_history(server_url, output=None, device_id=None, group=None, compress=None):
+    """把历史记录下载到 output（为空时写到标准输出），返回写入的字节数"""
+    if compress is None:
+        compress = bool(output and output.endswith(".gz"))
+    params = {"gzip": "1" if compress else "0"}
+    if device_id:
+        params["device_id"] = device_id
+    if group:
+        params["group"] = group
+
+    http = HttpClient()
+    response = http.get(urljoin(server_url, "/clipboard/export"), params=params,
+                        stream=True, timeout=TRANSFER_TIMEOUT)
+    response.raise_for_status()
+    written = 0
+    out = open(output, "wb") if output else sys.stdout.buffer
+    try:
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            out.write(chunk)
+            written += len(chunk)
+    finally:
+        if output:
+            out.close()
+    return written
+
+
+def import_history(server_url, path, device_id=None, content_field=None):
+    """上传 NDJSON 文件（.gz 结尾时按 gzip 上传），返回服务器的导入统计"""
+    params = {}
+    if device_id:
+        params["device_id"] = device_id
+    if content_field:
+        params["content_field"] = content_field
+    content_type = "application/gzip" if path.endswith(".gz") else "application/x-ndjson"
+
+    http = HttpClient()
+    with open(path, "rb") as f:
+        response = http.post(urljoin(server_url, "/clipboard/import"), params=params, data=f,
+                             headers={"Content-Type": content_type}, timeout=TRANSFER_TIMEOUT)
+    if response.status_code != 200:
+        raise RuntimeError(f"{response.status_code} {response.text}")
+    return response.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="剪贴板历史的导出和导入")
+    parser.add_argument("--server", default=SERVER_URL, help=f"服务器地址（默认 {SERVER_URL}）")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="导出历史记录为 NDJSON")
+    export_parser.add_argument("-o", "--output", help="输出文件，.gz 结尾时压缩（默认输出到标准输出）")
+    export_parser.add_argument("--device", help="只导出某个设备的记录")
+    export_parser.add_argument("--group", help="只导出某个同步组的记录")
+    export_parser.add_argument("--gzip", action="store_true", default=None, help="压缩输出")
+
+    import_parser = commands.add_parser("import", help="从 NDJSON 文件导入历史记录")
+    import_parser.add_argument("files", nargs="+", help="NDJSON 文件，.gz 结尾时按 gzip 读取")
+    import_parser.add_argument("--device", help="记录中没有 device_id 时使用的设备ID")
+    import_parser.add_argument("--content-field", help="内容所在的字段（默认 content）")
+
+    args = parser.parse_args()
+    try:
+        if args.command == "export":
+            start = time.time()
+            written = export_history(args.server, args.output, args.device, args.group, args.gzip)
+            if args.output:
+                print(f"✅ 已导出到 {args.output}（{written} 字节，用时 {time.time() - start:.1f} 秒）")
+            return
+
+        for path in args.files:
+            start = time.time()
+            result = import_history(args.server, path, args.device, args.content_field)
+            print(f"✅ {path}: 导入 {result['imported']} 条，跳过重复 {result['skipped']} 条，"
+                  f"无效 {result['invalid']} 条（用时 {time.time() - start:.1f} 秒）")
+            for error in result["errors"]:
+                print(f"   ⚠️ 第 {error['line']} 行: {error['error']}")
+    except Exception as e:
+        print(f"❌ 操作失败: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
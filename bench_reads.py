@@ -0,0 +1,123 @@
+"""读接口的微基准：对比投影查询（projection.py）和原来的 ORM 路径
+
+在临时数据目录里写入一批记录，然后在本进程里用 Flask 测试客户端反复请求
+/clipboard/latest 和 /clipboard/history，分别在 PROJECTION_READS 打开和关闭时计时，
+输出每个请求的平均耗时和提速比例；同时检查两条路径返回的响应体逐字节相同。
+最新内容的进程内缓存会被关闭（LATEST_CACHE_TTL=0），每次请求都查询数据库。
+
+示例：
+    python bench_reads.py
+    python bench_reads.py --items 20000 --limit 100 --iterations 500
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def seed_items(app, count, devices, rng):
+    """直接写入 count 条记录，内容长度大多较短，少量超过预览长度"""
+    from models import db
+    from storage import import_items
+
+    start = datetime.utcnow() - timedelta(seconds=count)
+    records = []
+    for i in range(count):
+        size = rng.choice((20, 80, 400, 3000))
+        content = "".join(rng.choice("abcdefghij 剪贴板同步\n") for _ in range(size))
+        records.append({
+            "device_id": f"bench-{i % devices}",
+            "content": f"{i}: {content}",
+            "timestamp": start + timedelta(seconds=i, microseconds=rng.randrange(1000000)),
+            "client_id": f"bench-{i}",
+            "group": None,
+        })
+    with app.app_context():
+        for offset in range(0, count, 1000):
+            import_items(records[offset:offset + 1000])
+            db.session.commit()
+
+
+def measure(client, url, iterations):
+    """返回 (平均耗时微秒, 最后一次的响应体)"""
+    body = None
+    client.get(url)  # 预热
+    start = time.perf_counter()
+    for _ in range(iterations):
+        response = client.get(url)
+        body = response.get_data()
+    elapsed = time.perf_counter() - start
+    if response.status_code != 200:
+        raise RuntimeError(f"{url}: {response.status_code} {body[:200]!r}")
+    return elapsed / iterations * 1e6, body
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    instance_path = tempfile.mkdtemp(prefix="clipboard-bench-reads-")
+    os.environ.update(CLIPBOARD_INSTANCE_PATH=instance_path, LATEST_CACHE_TTL="0",
+                      RATE_LIMIT_PER_DEVICE="0", METRICS_ENABLED="0")
+    sys.path.insert(0, HERE)
+    try:
+        from app import app
+        seed_items(app, args.items, args.devices, rng)
+        client = app.test_client()
+
+        first_page = client.get(f"/clipboard/history?limit={args.limit}").get_json()
+        cases = {
+            "latest": "/clipboard/latest?device_id=bench-0",
+            "history": f"/clipboard/history?limit={args.limit}",
+            "history_device": f"/clipboard/history?device_id=bench-1&limit={args.limit}",
+            "history_before": f"/clipboard/history?limit={args.limit}&before={first_page['next_cursor']}",
+            "history_after": f"/clipboard/history?limit={args.limit}&after={first_page['next_cursor']}",
+            "history_content": f"/clipboard/history?limit={args.limit}&include_content=1",
+        }
+        results = {}
+        for name, url in cases.items():
+            timings = {}
+            bodies = {}
+            for mode, enabled in (("orm", False), ("projection", True)):
+                app.config["PROJECTION_READS"] = enabled
+                timings[mode], bodies[mode] = measure(client, url, args.iterations)
+            results[name] = {
+                "orm_us": round(timings["orm"], 1),
+                "projection_us": round(timings["projection"], 1),
+                "speedup": round(timings["orm"] / timings["projection"], 2),
+                "identical": bodies["orm"] == bodies["projection"],
+            }
+            print(f"{name:16s} ORM {timings['orm']:>9.1f} µs  投影 {timings['projection']:>9.1f} µs  "
+                  f"x{results[name]['speedup']:.2f}  响应一致: {'是' if results[name]['identical'] else '否'}")
+        return results
+    finally:
+        shutil.rmtree(instance_path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="读接口微基准：投影查询 vs ORM")
+    parser.add_argument("--items", type=int, default=5000, help="写入的记录数")
+    parser.add_argument("--devices", type=int, default=10, help="记录分布在多少台设备上")
+    parser.add_argument("--limit", type=int, default=50, help="历史记录每页条数")
+    parser.add_argument("--iterations", type=int, default=1000, help="每种情况请求的次数")
+    parser.add_argument("--seed", type=int, default=1, help="随机数种子")
+    parser.add_argument("--output", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ 结果已保存到 {args.output}")
+    if not all(result["identical"] for result in results.values()):
+        print("❌ 两条路径的响应不一致")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
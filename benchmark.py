@@ -0,0 +1,415 @@
+"""剪贴板服务器压测工具
+
+模拟 N 台设备同时访问服务器，按比例混合上传（POST /clipboard）、轮询最新内容
+（/clipboard/latest，带 If-None-Match）和读取历史（/clipboard/history）。
+上传内容从种子文件（JSONL，例如 requests.jsonl）中截取，长度按小/中/大三档分布，
+一部分上传会重复之前的内容。
+
+两种运行方式：
+- inprocess：在本进程里用 Flask 测试客户端，不经过网络，主要测应用和数据库本身
+- gunicorn：在本地启动 gunicorn（gthread worker），通过 HTTP keep-alive 连接访问
+
+都使用临时的数据目录，不会影响 instance/ 中的数据。结果以 JSON 输出：
+每个接口的请求数、吞吐量、错误率、p50/p95/p99 延迟，以及数据库文件的增长，
+用 --compare 和之前保存的结果对比。
+
+示例：
+    python benchmark.py --mode inprocess --devices 20 --duration 10
+    python benchmark.py --mode gunicorn --workers 4 --devices 50 --output before.json
+    python benchmark.py --mode gunicorn --workers 4 --devices 50 --compare before.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# (权重, 最小长度, 最大长度)：大部分是短文本，少量是长文本
+PAYLOAD_SIZES = [
+    (70, 10, 200),
+    (25, 200, 4000),
+    (5, 4000, 256 * 1024),
+]
+
+
+def load_corpus(path):
+    """从 JSONL 文件中取出所有字符串字段拼成语料"""
+    texts = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                texts.append(line)
+                continue
+            if isinstance(record, dict):
+                texts.extend(value for value in record.values() if isinstance(value, str))
+            elif isinstance(record, str):
+                texts.append(record)
+    corpus = "\n".join(texts)
+    if not corpus:
+        raise ValueError(f"No text found in {path}")
+    return corpus
+
+
+class PayloadGenerator:
+    def __init__(self, corpus, rng, repeat_ratio=0.1):
+        self.corpus = corpus
+        self.rng = rng
+        self.repeat_ratio = repeat_ratio
+        self.recent = []
+
+    def _size(self):
+        weights = [w for w, _, _ in PAYLOAD_SIZES]
+        _, low, high = self.rng.choices(PAYLOAD_SIZES, weights=weights)[0]
+        return self.rng.randint(low, high)
+
+    def next(self):
+        if self.recent and self.rng.random() < self.repeat_ratio:
+            return self.rng.choice(self.recent)
+        size = self._size()
+        start = self.rng.randrange(len(self.corpus))
+        text = (self.corpus * (size // len(self.corpus) + 2))[start:start + size]
+        self.recent = (self.recent + [text])[-20:]
+        return text
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # 最近秩法
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}  # endpoint -> [(latency 秒, status, 是否出错)]
+
+    def record(self, endpoint, latency, status, error):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((latency, status, error))
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = sorted(s[0] * 1000 for s in samples)
+            errors = sum(1 for s in samples if s[2])
+            statuses = {}
+            for _, status, _ in samples:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            endpoints[endpoint] = {
+                "count": len(samples),
+                "errors": errors,
+                "error_rate": round(errors / len(samples), 4),
+                "throughput_rps": round(len(samples) / elapsed, 2),
+                "status": statuses,
+                "latency_ms": {
+                    "mean": round(sum(latencies) / len(latencies), 3),
+                    "p50": round(percentile(latencies, 50), 3),
+                    "p95": round(percentile(latencies, 95), 3),
+                    "p99": round(percentile(latencies, 99), 3),
+                    "max": round(latencies[-1], 3),
+                },
+            }
+        total = sum(e["count"] for e in endpoints.values())
+        errors = sum(e["errors"] for e in endpoints.values())
+        return {
+            "total_requests": total,
+            "total_errors": errors,
+            "error_rate": round(errors / total, 4) if total else 0,
+            "throughput_rps": round(total / elapsed, 2),
+            "endpoints": endpoints,
+        }
+
+
+class TestClientTransport:
+    """通过 Flask 测试客户端发请求，返回 (status, headers, json)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, method, path, params=None, json_body=None, headers=None):
+        client = self.app.test_client()
+        response = client.open(path, method=method, query_string=params, json=json_body, headers=headers)
+        body = response.get_json(silent=True)
+        return response.status_code, response.headers, body
+
+
+class HttpTransport:
+    def __init__(self, base_url, pool_size):
+        from http_client import HttpClient
+        self.base_url = base_url
+        self.http = HttpClient(pool_size=pool_size, read_timeout=30)
+
+    def request(self, method, path, params=None, json_body=None, headers=None):
+        response = self.http.request(method, self.base_url + path, params=params, json=json_body, headers=headers)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, response.headers, body
+
+    def close(self):
+        self.http.close()
+
+
+class Device(threading.Thread):
+    def __init__(self, index, transport, recorder, payloads, mix, deadline, think, rng):
+        super().__init__(daemon=True)
+        self.device_id = f"bench-{index:03d}"
+        self.peer = self.device_id  # 轮询哪台设备的最新内容，启动前设置
+        self.transport = transport
+        self.recorder = recorder
+        self.payloads = payloads
+        self.mix = mix
+        self.deadline = deadline
+        self.think = think
+        self.rng = rng
+        self.etag = None
+        self.uploads = 0
+        self.uploaded_bytes = 0
+
+    def _call(self, endpoint, method, path, expected, **kwargs):
+        start = time.perf_counter()
+        try:
+            status, headers, body = self.transport.request(method, path, **kwargs)
+        except Exception:
+            self.recorder.record(endpoint, time.perf_counter() - start, "exception", True)
+            return None, None, None
+        self.recorder.record(endpoint, time.perf_counter() - start, status, status not in expected)
+        return status, headers, body
+
+    def upload(self):
+        content = self.payloads.next()
+        status, _, _ = self._call("upload", "POST", "/clipboard", (200, 202), json_body={
+            "content": content, "device_id": self.device_id, "client_id": uuid.uuid4().hex,
+        })
+        if status in (200, 202):
+            self.uploads += 1
+            self.uploaded_bytes += len(content.encode("utf-8"))
+
+    def latest(self):
+        # 轮询的是另一台设备的内容（和真实客户端一样）
+        headers = {"If-None-Match": self.etag} if self.etag else None
+        status, response_headers, _ = self._call(
+            "latest", "GET", "/clipboard/latest", (200, 304, 404),
+            params={"device_id": self.peer}, headers=headers)
+        if status == 200:
+            self.etag = response_headers.get("ETag")
+
+    def history(self):
+        self._call("history", "GET", "/clipboard/history", (200,), params={"limit": 20})
+
+    def run(self):
+        actions = list(self.mix)
+        weights = [self.mix[a] for a in actions]
+        while time.monotonic() < self.deadline:
+            getattr(self, self.rng.choices(actions, weights=weights)[0])()
+            if self.think:
+                time.sleep(self.rng.expovariate(1 / self.think))
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("upload", "latest", "history"):
+            raise argparse.ArgumentTypeError(f"Unknown action: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+def db_size(instance_path, checkpoint=False):
+    """返回 (数据库文件大小, WAL 文件大小)；checkpoint 为 True 时先把 WAL 合并回数据库"""
+    path = os.path.join(instance_path, "clipboard.db")
+    if not os.path.exists(path):
+        return 0, 0
+    if checkpoint:
+        import sqlite3
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+    wal = path + "-wal"
+    return os.path.getsize(path), os.path.getsize(wal) if os.path.exists(wal) else 0
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(instance_path, workers, threads, port, extra_env):
+    env = dict(os.environ, CLIPBOARD_INSTANCE_PATH=instance_path, **extra_env)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", "gthread", "--threads", str(threads),
+         "-b", f"127.0.0.1:{port}", "server:app"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited: {process.stderr.read().decode(errors='replace')[-2000:]}")
+        # 端口由 master 进程先打开，等 worker 能响应请求（数据库迁移完成）才算启动好
+        try:
+            requests.get(f"http://127.0.0.1:{port}/clipboard/latest", params={"device_id": "bench-ready"}, timeout=2)
+            return process
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start in 30 seconds")
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    corpus = load_corpus(args.seed_file)
+    instance_path = tempfile.mkdtemp(prefix="clipboard-bench-")
+    # 压测的是服务器的处理能力，写入限流保持关闭，需要时用 --env RATE_LIMIT_PER_DEVICE=... 打开
+    extra_env = dict([("RATE_LIMIT_PER_DEVICE", "0")] + [item.split("=", 1) for item in args.env])
+    process = None
+    try:
+        if args.mode == "inprocess":
+            os.environ["CLIPBOARD_INSTANCE_PATH"] = instance_path
+            os.environ.update(extra_env)
+            sys.path.insert(0, HERE)
+            from app import app
+            transport = TestClientTransport(app)
+        else:
+            port = args.port or free_port()
+            process = start_gunicorn(instance_path, args.workers, args.threads, port, extra_env)
+            transport = HttpTransport(f"http://127.0.0.1:{port}", pool_size=args.devices)
+
+        size_before = sum(db_size(instance_path, checkpoint=True))
+        recorder = Recorder()
+        deadline = time.monotonic() + args.duration
+        devices = []
+        for i in range(args.devices):
+            device_rng = random.Random(rng.random())
+            devices.append(Device(i, transport, recorder, PayloadGenerator(corpus, device_rng, args.repeat_ratio),
+                                  args.mix, deadline, args.think / 1000, device_rng))
+        for i, device in enumerate(devices):
+            device.peer = devices[(i + 1) % len(devices)].device_id
+
+        started = time.monotonic()
+        for device in devices:
+            device.start()
+        for device in devices:
+            device.join()
+        elapsed = time.monotonic() - started
+
+        if process:
+            process.terminate()
+            process.wait(10)
+            process = None
+        _, wal_size = db_size(instance_path)
+        size_after = sum(db_size(instance_path, checkpoint=True))
+        uploads = sum(d.uploads for d in devices)
+
+        result = {
+            "config": {
+                "mode": args.mode,
+                "devices": args.devices,
+                "duration_s": args.duration,
+                "mix": args.mix,
+                "think_ms": args.think,
+                "workers": args.workers if args.mode == "gunicorn" else None,
+                "threads": args.threads if args.mode == "gunicorn" else None,
+                "seed": args.seed,
+                "seed_file": os.path.basename(args.seed_file),
+                "env": extra_env,
+            },
+            "elapsed_s": round(elapsed, 3),
+            **recorder.summary(elapsed),
+            "db": {
+                "size_before": size_before,
+                "size_after": size_after,
+                "growth_bytes": size_after - size_before,
+                "wal_bytes_before_checkpoint": wal_size,
+                "uploads": uploads,
+                "uploaded_bytes": sum(d.uploaded_bytes for d in devices),
+                "bytes_per_upload": round((size_after - size_before) / uploads, 1) if uploads else None,
+            },
+            "git_commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        return result
+    finally:
+        if process:
+            process.terminate()
+        shutil.rmtree(instance_path, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(result, baseline):
+    """打印和之前结果的对比：吞吐量和 p95 延迟的变化"""
+    print(f"\n=== 与 {baseline.get('git_commit')} ({baseline.get('timestamp')}) 对比 ===")
+    for endpoint, current in result["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+        rps = (current["throughput_rps"] - before["throughput_rps"]) / before["throughput_rps"] * 100
+        p95 = (current["latency_ms"]["p95"] - before["latency_ms"]["p95"]) / before["latency_ms"]["p95"] * 100
+        print(f"{endpoint:8s} 吞吐量 {before['throughput_rps']:>9.1f} -> {current['throughput_rps']:>9.1f} rps ({rps:+.1f}%)  "
+              f"p95 {before['latency_ms']['p95']:>8.2f} -> {current['latency_ms']['p95']:>8.2f} ms ({p95:+.1f}%)  "
+              f"错误率 {before['error_rate']:.2%} -> {current['error_rate']:.2%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="剪贴板服务器压测")
+    parser.add_argument("--mode", choices=("inprocess", "gunicorn"), default="inprocess", help="运行方式")
+    parser.add_argument("--devices", type=int, default=10, help="模拟的设备数（并发线程数）")
+    parser.add_argument("--duration", type=float, default=10, help="压测时长（秒）")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("upload=2,latest=7,history=1"),
+                        help="请求比例，例如 upload=2,latest=7,history=1")
+    parser.add_argument("--think", type=float, default=0, help="每台设备两次请求之间的平均间隔（毫秒），0 为不间断")
+    parser.add_argument("--seed-file", default=os.path.join(HERE, "requests.jsonl"), help="上传内容的语料（JSONL）")
+    parser.add_argument("--repeat-ratio", type=float, default=0.1, help="重复上传之前内容的比例")
+    parser.add_argument("--seed", type=int, default=1, help="随机数种子")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn worker 数")
+    parser.add_argument("--threads", type=int, default=32, help="每个 gunicorn worker 的线程数")
+    parser.add_argument("--port", type=int, help="gunicorn 端口（默认随机）")
+    parser.add_argument("--env", action="append", default=[], help="传给服务器的环境变量，例如 --env GROUP_COMMIT=1")
+    parser.add_argument("--output", help="把结果写入 JSON 文件")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+    args = parser.parse_args()
+
+    result = run(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"✅ 结果已保存到 {args.output}")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
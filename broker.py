@@ -0,0 +1,158 @@
+"""本地进程间消息广播
+
+每个 worker 进程在一个共享目录下绑定自己的 Unix 数据报 socket，publish 时把消息
+发给目录里的所有 socket，这样 gunicorn 的多个 worker 之间不需要任何外部服务
+（Redis 等）就能互相通知。不支持 AF_UNIX 的平台（Windows）退化为仅进程内广播，
+本地开发时只有一个进程，这已经足够。
+"""
+import hashlib
+import json
+import os
+import socket
+import tempfile
+import threading
+
+MAX_MESSAGE_SIZE = 8192
+
+
+class Subscription:
+    """一次订阅：匹配的消息到达时唤醒等待方"""
+
+    def __init__(self, broker, predicate):
+        self.broker = broker
+        self.predicate = predicate
+        self.event = threading.Event()
+        self.message = None
+
+    def notify(self, message):
+        if self.predicate is None or self.predicate(message):
+            self.message = message
+            self.event.set()
+
+    def wait(self, timeout):
+        return self.event.wait(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    def __init__(self, name):
+        # Unix socket 路径长度有限（约 108 字节），所以放在临时目录下并用短哈希区分实例
+        digest = hashlib.md5(name.encode()).hexdigest()[:8]
+        self.directory = os.path.join(tempfile.gettempdir(), f"clipboard-broker-{digest}")
+        self._subscriptions = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._sock = None
+        self._sender = None
+        self._pid = None
+
+    def subscribe(self, predicate=None):
+        """订阅消息，返回可用 with 语句自动注销的 Subscription"""
+        self._ensure_started()
+        sub = Subscription(self, predicate)
+        with self._lock:
+            self._subscriptions.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscriptions.discard(sub)
+
+    def add_listener(self, callback):
+        """注册常驻回调，每条消息（包括本进程发出的）都会调用一次"""
+        self._ensure_started()
+        with self._lock:
+            self._listeners.append(callback)
+
+    def publish(self, message):
+        """先在本进程内分发，再发送给其他 worker"""
+        self._ensure_started()
+        self._dispatch(message)
+        if self._sender is None:
+            return
+
+        payload = json.dumps(message).encode()
+        if len(payload) > MAX_MESSAGE_SIZE:
+            raise ValueError("broker message too large")
+
+        own_path = self._socket_path(os.getpid())
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(".sock"):
+                continue
+            path = os.path.join(self.directory, name)
+            if path == own_path:
+                continue
+            try:
+                self._sender.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 对应的 worker 已经退出，清理残留的 socket 文件
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError:
+                # 对方接收缓冲区已满：丢弃这条通知，等待方会在超时后重新查询
+                pass
+
+    def _dispatch(self, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(message)
+            except Exception as e:
+                print(f"❌ 广播回调出错: {str(e)}")
+        for sub in subscriptions:
+            sub.notify(message)
+
+    def _socket_path(self, pid):
+        return os.path.join(self.directory, f"{pid}.sock")
+
+    def _ensure_started(self):
+        # gunicorn 在 fork 之后才会用到 broker，按进程号惰性初始化
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._subscriptions = set()
+            self._sock = None
+            self._sender = None
+            if not hasattr(socket, "AF_UNIX"):
+                return
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                path = self._socket_path(pid)
+                if os.path.exists(path):
+                    os.unlink(path)
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                sock.bind(path)
+                sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                sender.setblocking(False)
+            except OSError as e:
+                print(f"❌ 无法启动进程间广播，仅在本进程内通知: {str(e)}")
+                return
+            self._sock = sock
+            self._sender = sender
+        threading.Thread(target=self._receive_loop, args=(sock,), daemon=True).start()
+
+    def _receive_loop(self, sock):
+        while True:
+            try:
+                data = sock.recv(MAX_MESSAGE_SIZE)
+                message = json.loads(data)
+            except (OSError, ValueError):
+                continue
+            self._dispatch(message)
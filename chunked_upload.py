@@ -0,0 +1,164 @@
+"""分块、可续传的大内容上传
+
+流程：创建上传会话 -> 按顺序上传编号的分块 -> 提交。
+分块直接从请求流追加写入磁盘上的 .part 文件，不在内存中拼出完整内容；
+会话状态保存在同目录的 .json 文件里，所以任何一个 gunicorn worker
+都能接着处理，连接中断后客户端查询会话状态，从最后确认的分块继续上传。
+"""
+import codecs
+import hashlib
+import json
+import os
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows：本地只有一个进程
+    fcntl = None
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class UploadStore:
+    def __init__(self, directory, chunk_size, max_size, expire_after=24 * 3600):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.expire_after = expire_after
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, upload_id, suffix):
+        # upload_id 来自 URL，只接受我们自己生成的十六进制格式，防止路径穿越
+        if len(upload_id) != 32 or any(c not in "0123456789abcdef" for c in upload_id):
+            raise UploadError("Unknown upload", 404)
+        return os.path.join(self.directory, upload_id + suffix)
+
+    def _load(self, upload_id):
+        try:
+            with open(self._path(upload_id, ".json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise UploadError("Unknown upload", 404)
+
+    def _save(self, meta):
+        path = self._path(meta["upload_id"], ".json")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, path)
+
+    def create(self, device_id, size, digest, client_id=None, group=None):
+        if size <= 0:
+            raise UploadError("Invalid size")
+        if size > self.max_size:
+            raise UploadError(f"Payload too large (max {self.max_size} bytes)", 413)
+        self.cleanup()
+        meta = {
+            "upload_id": uuid.uuid4().hex,
+            "device_id": device_id,
+            "client_id": client_id,
+            "group": group,
+            "size": size,
+            "content_hash": digest,
+            "chunk_size": self.chunk_size,
+            "next_chunk": 0,
+            "received": 0,
+            "created_at": time.time(),
+        }
+        open(self._path(meta["upload_id"], ".part"), "wb").close()
+        self._save(meta)
+        return meta
+
+    def status(self, upload_id):
+        return self._load(upload_id)
+
+    def write_chunk(self, upload_id, index, stream):
+        """把一个分块从请求流写入磁盘，返回更新后的会话状态
+
+        已经确认过的分块再次上传（客户端没收到确认而重试）直接返回当前状态。
+        """
+        try:
+            f = open(self._path(upload_id, ".part"), "r+b")
+        except FileNotFoundError:
+            # 会话不存在或已经过期被清理
+            raise UploadError("Unknown upload", 404)
+        with f:
+            # 同一会话的并发请求（客户端超时重试）按顺序处理
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            meta = self._load(upload_id)
+            if index < meta["next_chunk"]:
+                return meta
+            if index > meta["next_chunk"]:
+                raise UploadError(f"Expected chunk {meta['next_chunk']}", 409)
+
+            # 上次写到一半中断时文件里可能有未确认的数据，从确认过的位置重新写
+            f.truncate(meta["received"])
+            f.seek(meta["received"])
+            written = 0
+            while True:
+                block = stream.read(READ_BLOCK_SIZE)
+                if not block:
+                    break
+                written += len(block)
+                if written > self.chunk_size or meta["received"] + written > meta["size"]:
+                    f.truncate(meta["received"])
+                    raise UploadError("Chunk exceeds declared size", 413)
+                f.write(block)
+
+            if written == 0:
+                raise UploadError("Empty chunk")
+            meta["received"] += written
+            meta["next_chunk"] += 1
+            self._save(meta)
+            return meta
+
+    def verify(self, upload_id):
+        """校验大小、哈希和 UTF-8 编码，返回 (.part 文件路径, 会话状态)
+
+        只顺序读一遍文件，内存里每次只有一个块；提交时文件直接转成内容文件（见 storage.acquire_blob_file）。
+        """
+        meta = self._load(upload_id)
+        if meta["received"] != meta["size"]:
+            raise UploadError(f"Upload incomplete ({meta['received']}/{meta['size']} bytes)", 409)
+
+        path = self._path(upload_id, ".part")
+        sha = hashlib.sha256()
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        try:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(READ_BLOCK_SIZE), b""):
+                    sha.update(block)
+                    decoder.decode(block)
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            raise UploadError("Content is not valid UTF-8")
+        if sha.hexdigest() != meta["content_hash"]:
+            raise UploadError("content_hash does not match uploaded data")
+        return path, meta
+
+    def discard(self, upload_id):
+        for suffix in (".part", ".json"):
+            try:
+                os.unlink(self._path(upload_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def cleanup(self):
+        """删除长时间没有完成的上传会话"""
+        deadline = time.time() - self.expire_after
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.unlink(path)
+            except OSError:
+                pass
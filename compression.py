@@ -0,0 +1,79 @@
+"""HTTP 压缩传输
+
+请求：Content-Encoding: gzip 的请求体在进入 Flask 之前解压，解压后的大小有上限，
+防止压缩炸弹。
+响应：客户端声明 Accept-Encoding: gzip 且响应体足够大时压缩 JSON/文本响应。
+"""
+import gzip
+import io
+import zlib
+
+from flask import request
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "text/html", "text/plain")
+
+
+class GzipRequestMiddleware:
+    def __init__(self, wsgi_app, max_size):
+        self.wsgi_app = wsgi_app
+        self.max_size = max_size
+
+    def __call__(self, environ, start_response):
+        if environ.get("HTTP_CONTENT_ENCODING", "").lower() != "gzip":
+            return self.wsgi_app(environ, start_response)
+
+        try:
+            body = self._decompress(environ["wsgi.input"])
+        except ValueError:
+            start_response("413 Request Entity Too Large", [("Content-Type", "application/json")])
+            return [b'{"error": "Decompressed payload too large"}']
+        except (OSError, EOFError, zlib.error):
+            start_response("400 Bad Request", [("Content-Type", "application/json")])
+            return [b'{"error": "Invalid gzip body"}']
+
+        environ["wsgi.input"] = io.BytesIO(body)
+        environ["CONTENT_LENGTH"] = str(len(body))
+        del environ["HTTP_CONTENT_ENCODING"]
+        return self.wsgi_app(environ, start_response)
+
+    def _decompress(self, stream):
+        # 分块解压，超过上限立即停止，而不是先解压完再检查
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        out = io.BytesIO()
+        while True:
+            chunk = stream.read(64 * 1024)
+            if not chunk:
+                break
+            out.write(decompressor.decompress(chunk, self.max_size + 1 - out.tell()))
+            if out.tell() > self.max_size or decompressor.unconsumed_tail:
+                raise ValueError("payload too large")
+        out.write(decompressor.flush())
+        if out.tell() > self.max_size:
+            raise ValueError("payload too large")
+        if not decompressor.eof:
+            raise EOFError("truncated gzip body")
+        return out.getvalue()
+
+
+def compress_response(response, min_size=1024, level=6):
+    """after_request 钩子：按 Accept-Encoding 压缩响应"""
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or "gzip" not in request.accept_encodings):
+        return response
+
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=level))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    # 压缩后的表示和原始表示字节不同，强 ETag 需要降为弱 ETag
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
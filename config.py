@@ -0,0 +1,107 @@
+"""服务器配置
+
+load_config 把默认值写入 app.config，每一项都可以用同名环境变量覆盖，
+调用方（压测、本地调试）还可以再传入覆盖项。数据库相关的配置：
+
+- DATABASE_URL：主库地址，没有设置时使用 instance 目录下的 clipboard.db；
+  Railway 等平台给出的 postgres:// 会改写为 SQLAlchemy 认识的 postgresql://
+- DATABASE_REPLICA_URL：只读副本地址，设置后只读接口从副本读取（见 routing.py）
+- DB_POOL_SIZE / DB_MAX_OVERFLOW：每个 gunicorn worker 各自的连接池大小，
+  数据库上的总连接数约为 worker 数 ×（DB_POOL_SIZE + DB_MAX_OVERFLOW）
+- DB_POOL_TIMEOUT：连接池用完时等待空闲连接的秒数
+- DB_POOL_RECYCLE / DB_POOL_PRE_PING：连接用了多少秒后重建、取出连接时先检查是否可用
+  （只对 PostgreSQL 等网络数据库生效）
+- DB_STATEMENT_TIMEOUT_MS：单条 SQL 的最长执行时间，0 表示不限制（只对 PostgreSQL 生效）
+- REPLICA_MAX_LAG：副本最多落后主库的秒数，设备写入后这段时间内它的读取仍然走主库
+"""
+import os
+
+from sqlalchemy.engine import make_url
+
+REPLICA_BIND = "replica"  # 副本在 SQLALCHEMY_BINDS 中的名字
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def env_flag(name, default):
+    return os.environ.get(name, "1" if default else "0").lower() in ("1", "true", "yes")
+
+
+def normalize_url(url):
+    if not url:
+        return None
+    return url.replace("postgres://", "postgresql://", 1) if url.startswith("postgres://") else url
+
+
+def engine_options(url, config):
+    """按数据库类型给出 create_engine 的参数"""
+    url = make_url(url)
+    options = {}
+    if url.get_backend_name() == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            # 内存数据库使用单连接的 StaticPool，没有连接池参数
+            return options
+        options.update(pool_size=config["DB_POOL_SIZE"], max_overflow=config["DB_MAX_OVERFLOW"],
+                       pool_timeout=config["DB_POOL_TIMEOUT"])
+        return options
+
+    options.update(pool_size=config["DB_POOL_SIZE"], max_overflow=config["DB_MAX_OVERFLOW"],
+                   pool_timeout=config["DB_POOL_TIMEOUT"], pool_recycle=config["DB_POOL_RECYCLE"],
+                   pool_pre_ping=config["DB_POOL_PRE_PING"])
+    if url.get_backend_name() == "postgresql" and config["DB_STATEMENT_TIMEOUT_MS"]:
+        options["connect_args"] = {"options": f"-c statement_timeout={int(config['DB_STATEMENT_TIMEOUT_MS'])}"}
+    return options
+
+
+def load_config(app, overrides=None):
+    """写入默认配置和环境变量，再应用 overrides，最后生成数据库引擎的参数"""
+    config = app.config
+    config.update(
+        SQLALCHEMY_DATABASE_URI=normalize_url(os.environ.get("DATABASE_URL")) or "sqlite:///clipboard.db",
+        DATABASE_REPLICA_URL=normalize_url(os.environ.get("DATABASE_REPLICA_URL")),
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        DB_POOL_SIZE=env_int("DB_POOL_SIZE", 5),
+        DB_MAX_OVERFLOW=env_int("DB_MAX_OVERFLOW", 10),
+        DB_POOL_TIMEOUT=env_int("DB_POOL_TIMEOUT", 10),
+        DB_POOL_RECYCLE=env_int("DB_POOL_RECYCLE", 1800),
+        DB_POOL_PRE_PING=env_flag("DB_POOL_PRE_PING", True),
+        DB_STATEMENT_TIMEOUT_MS=env_int("DB_STATEMENT_TIMEOUT_MS", 30000),
+        REPLICA_MAX_LAG=float(os.environ.get("REPLICA_MAX_LAG", 5)),
+        # 等待其他 worker 释放写锁的最长时间（毫秒），超时才报 database is locked
+        SQLITE_BUSY_TIMEOUT_MS=env_int("SQLITE_BUSY_TIMEOUT_MS", 5000),
+        # WAL 模式下 NORMAL 只在检查点时 fsync，断电可能丢失最后几个事务但不会损坏数据库；FULL 每次提交都 fsync
+        SQLITE_SYNCHRONOUS=os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL").upper(),
+        # 历史记录每页最多返回的条数
+        HISTORY_MAX_LIMIT=env_int("HISTORY_MAX_LIMIT", 100),
+        # 批量上传每次最多包含的条数
+        BATCH_MAX_ITEMS=env_int("BATCH_MAX_ITEMS", 500),
+        # gzip 请求体解压后的大小上限（字节）
+        MAX_DECOMPRESSED_BYTES=env_int("MAX_DECOMPRESSED_BYTES", 32 * 1024 * 1024),
+        # 一次导入的请求体（gzip 时为解压后）的总大小上限（字节）
+        IMPORT_MAX_BYTES=env_int("IMPORT_MAX_BYTES", 256 * 1024 * 1024),
+        # 单条剪贴板内容的大小上限（字节）
+        MAX_CLIPBOARD_BYTES=env_int("MAX_CLIPBOARD_BYTES", 16 * 1024 * 1024),
+        # 分块上传时每块的大小（字节）
+        UPLOAD_CHUNK_SIZE=env_int("UPLOAD_CHUNK_SIZE", 1024 * 1024),
+        # 超过该大小（字节）的内容存为 instance/blobs 下的文件，数据库里只保存预览
+        OUT_OF_LINE_THRESHOLD=env_int("OUT_OF_LINE_THRESHOLD", 64 * 1024),
+        BLOB_DIR=os.environ.get("BLOB_DIR") or os.path.join(app.instance_path, "blobs"),
+        # /clipboard/latest 和 /clipboard/history 使用投影查询直接拼出 JSON（见 projection.py），
+        # 关闭时走原来的 ORM 路径，bench_reads.py 用它对比两者
+        PROJECTION_READS=env_flag("PROJECTION_READS", True),
+    )
+    if overrides:
+        config.update(overrides)
+    # 原始请求体的大小上限，表单和文件解析时生效；Werkzeug 2.2 的 get_json 不检查它，
+    # 上传接口另外用 payload_too_large 检查（见 app.py）
+    config.setdefault("MAX_CONTENT_LENGTH", config["MAX_DECOMPRESSED_BYTES"])
+
+    config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(config["SQLALCHEMY_DATABASE_URI"], config))
+    replica = config["DATABASE_REPLICA_URL"]
+    if replica:
+        binds = dict(config.get("SQLALCHEMY_BINDS") or {})
+        binds.setdefault(REPLICA_BIND, dict(engine_options(replica, config), url=replica))
+        config["SQLALCHEMY_BINDS"] = binds
+    return config
@@ -1,9 +1,62 @@
 from flask import Flask
+from sqlalchemy import event
 from models import db
+from migrations import run_migrations
+import threading
 
 def init_db(app: Flask):
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///clipboard.db'
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    """初始化数据库（连接地址和引擎参数见 config.py），在主库上执行迁移"""
     db.init_app(app)
     with app.app_context():
-        db.create_all()
\ No newline at end of file
+        for engine in db.engines.values():
+            if engine.dialect.name == "sqlite":
+                tune_sqlite(engine, app.config['SQLITE_BUSY_TIMEOUT_MS'], app.config['SQLITE_SYNCHRONOUS'])
+        run_migrations(db, app.instance_path)
+
+def tune_sqlite(engine, busy_timeout, synchronous):
+    """多个 gunicorn worker 共用一个 SQLite 文件时的连接设置
+
+    WAL 模式下读不阻塞写、写不阻塞读，写锁冲突时等待 busy_timeout 而不是立即失败。
+    pysqlite 默认的事务是延迟获取写锁的：事务里先读后写时，如果中间有别的 worker
+    提交过，升级写锁会直接失败且不受 busy_timeout 保护。所以这里接管 BEGIN，
+    写请求通过 begin_write() 一开始就用 BEGIN IMMEDIATE 取得写锁，在锁上排队等待。
+    提交或回滚时释放进程内的写锁。
+    """
+    if synchronous not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+        raise ValueError(f"Invalid SQLITE_SYNCHRONOUS: {synchronous}")
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        # 由下面的 begin 事件发出 BEGIN，pysqlite 自己不再隐式开启事务
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.execute(f"PRAGMA synchronous = {synchronous}")
+        cursor.close()
+
+    # SQLite 等待写锁时是按递增的间隔轮询，不排队，大量线程同时等待时有的会一直抢不到锁。
+    # 同一进程内的写事务先在这里排队，每个进程只有一个线程去竞争数据库的写锁
+    write_lock = threading.Lock()
+
+    @event.listens_for(engine, "begin")
+    def on_begin(conn):
+        if not conn.get_execution_options().get("sqlite_write"):
+            conn.exec_driver_sql("BEGIN")
+            return
+        conn.info["write_locked"] = write_lock.acquire(timeout=busy_timeout / 1000)
+        try:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        except Exception:
+            release_write_lock(conn)
+            raise
+
+    @event.listens_for(engine, "commit")
+    @event.listens_for(engine, "rollback")
+    def release_write_lock(conn):
+        if conn.info.pop("write_locked", False):
+            write_lock.release()
+
+def begin_write():
+    """在请求的第一条 SQL 之前调用，表示这个事务要写数据库（只对 SQLite 有影响）"""
+    db.session.connection(execution_options={"sqlite_write": True})
@@ -0,0 +1,55 @@
+"""剪贴板内容的增量编码
+
+剪贴板里的大段内容通常是在上一版的基础上追加或局部修改（日志、代码），
+所以只记录公共前缀、公共后缀的长度和中间被替换的部分，计算是线性的，
+不像通用 diff 那样在几 MB 的文本上耗时过长。服务器和客户端共用这个模块。
+"""
+
+
+def _match_length(n, same):
+    """same(i, j) 判断第 i 到 j 个字符是否相同，返回从头开始相同的长度（不超过 n）
+
+    先按 64、128、256… 倍增的块比较，遇到不同的块后在这一块里二分。
+    字符串切片比较在 C 层完成，比逐字符循环快得多；比较的总长度不超过结果的常数倍，
+    所以是线性的。
+    """
+    matched, step, growing = 0, 64, True
+    while step and matched < n:
+        end = min(matched + step, n)
+        if same(matched, end):
+            matched = end
+            if growing:
+                step *= 2
+        else:
+            growing = False
+            step //= 2
+    return matched
+
+
+def _common_prefix(a, b):
+    return _match_length(min(len(a), len(b)), lambda i, j: a[i:j] == b[i:j])
+
+
+def _common_suffix(a, b, limit):
+    return _match_length(min(len(a), len(b), limit),
+                         lambda i, j: a[len(a) - j:len(a) - i] == b[len(b) - j:len(b) - i])
+
+
+def make_delta(base, target):
+    """返回把 base 变为 target 的增量 {prefix, suffix, insert}"""
+    prefix = _common_prefix(base, target)
+    # 后缀不能和前缀重叠
+    suffix = _common_suffix(base, target, min(len(base), len(target)) - prefix)
+    return {
+        "prefix": prefix,
+        "suffix": suffix,
+        "insert": target[prefix:len(target) - suffix],
+    }
+
+
+def apply_delta(base, delta):
+    prefix = delta["prefix"]
+    suffix = delta["suffix"]
+    if prefix + suffix > len(base):
+        raise ValueError("delta does not match base")
+    return base[:prefix] + delta["insert"] + base[len(base) - suffix:]
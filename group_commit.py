@@ -0,0 +1,149 @@
+"""组提交：把几毫秒内到达的写入合并到一个事务里
+
+每个 worker 进程有一个写线程。请求把写入操作（在事务里执行、不提交的函数）放进队列，
+写线程收集 window 秒内到达的操作，在同一个事务里依次执行后只提交一次，
+多个请求分摊一次写锁和一次 fsync。合并的事务失败时（例如并发重试撞上唯一索引），
+回滚后把这批操作逐个单独执行，一个操作出错不影响其他操作。
+
+持久性有两种：
+- wait：请求等到事务提交后才返回，返回时数据已经写入数据库
+- enqueue：放进队列就返回，进程崩溃时队列里还没提交的写入会丢失
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from models import db
+from db import begin_write
+
+DURABILITY_MODES = ("wait", "enqueue")
+
+
+class _Operation:
+    def __init__(self, func, args, after_commit):
+        self.func = func
+        self.args = args
+        self.after_commit = after_commit
+        self.future = Future()
+        self.result = None
+
+
+class GroupCommitter:
+    def __init__(self, app, enabled=False, window=0.005, max_batch=100, durability="wait"):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Invalid durability mode: {durability}")
+        self.app = app
+        self.enabled = enabled
+        self.window = window
+        self.max_batch = max_batch
+        self.durability = durability
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+
+    @classmethod
+    def from_env(cls, app):
+        return cls(
+            app,
+            enabled=os.environ.get("GROUP_COMMIT", "").lower() in ("1", "true", "yes"),
+            window=float(os.environ.get("GROUP_COMMIT_WINDOW_MS", 5)) / 1000,
+            max_batch=int(os.environ.get("GROUP_COMMIT_MAX_BATCH", 100)),
+            durability=os.environ.get("WRITE_DURABILITY", "wait").lower(),
+        )
+
+    def _ensure_thread(self):
+        # 写线程在 gunicorn fork 出 worker 之后才启动，每个进程一个
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def submit(self, func, *args, after_commit=None):
+        """提交一个写入操作，返回 Future，结果为 func 的返回值
+
+        func 在写线程的应用上下文中执行，只修改 db.session、不提交；
+        after_commit(result) 在事务提交后调用（用于广播通知等）。
+        """
+        self._ensure_thread()
+        op = _Operation(func, args, after_commit)
+        self._queue.put(op)
+        return op.future
+
+    def _loop(self):
+        while True:
+            op = self._queue.get()
+            if op is None:
+                return
+            batch = [op]
+            # 第一个操作到达后再等 window 秒，收集同一时间段内的其他写入
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    op = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if op is None:
+                    self._queue.put(None)
+                    break
+                batch.append(op)
+            with self.app.app_context():
+                try:
+                    self._commit(batch)
+                finally:
+                    db.session.remove()
+
+    def _commit(self, batch):
+        try:
+            begin_write()
+            for op in batch:
+                op.result = op.func(*op.args)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            for op in batch:
+                self._run_single(op)
+            return
+        for op in batch:
+            self._finish(op)
+
+    def _run_single(self, op):
+        try:
+            begin_write()
+            op.result = op.func(*op.args)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if not op.future.set_running_or_notify_cancel():
+                return
+            op.future.set_exception(e)
+            if self.durability == "enqueue":
+                print(f"❌ 写入数据库失败: {str(e)}")
+            return
+        self._finish(op)
+
+    def _finish(self, op):
+        if op.after_commit:
+            try:
+                op.after_commit(op.result)
+            except Exception as e:
+                print(f"❌ 提交后处理出错: {str(e)}")
+        if op.future.set_running_or_notify_cancel():
+            op.future.set_result(op.result)
+
+    def stop(self, timeout=5):
+        """写完队列中剩余的操作后停止写线程（进程退出时调用）"""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        self._queue.put(None)
+        thread.join(timeout)
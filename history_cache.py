@@ -0,0 +1,185 @@
+"""客户端的本地历史记录副本
+
+view_history.py 直接从本地 SQLite 文件查询，按设备筛选和大 limit 都不需要访问服务器，
+离线时也能查看。副本只保存每条记录的预览、大小和哈希，完整内容仍然从服务器获取。
+
+同步是增量的：按记录ID从旧到新获取已同步的最大ID之后写入的记录（since_id），
+每一页和同步位置在一个事务里保存，中断后下次接着同步。按ID而不是按时间，
+导入的时间戳较旧的记录也会同步下来。
+服务器上删除的记录（清理任务）不会从副本中消失，需要时用 --resync 重建。
+upload.py 运行时在后台定期同步，view_history.py 先显示本地结果再同步一次。
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urljoin
+
+PREVIEW_CHARS = 200  # 旧版服务器返回完整内容时，本地截取的预览长度
+
+
+def default_history_path(server_url=None):
+    """每个服务器一个副本文件（history-<URL 哈希>.db），同时同步不同服务器的进程不会互相清空对方的副本"""
+    if os.environ.get("CLIPBOARD_HISTORY_PATH"):
+        return os.environ["CLIPBOARD_HISTORY_PATH"]
+    name = "history.db"
+    if server_url:
+        name = f"history-{hashlib.sha1(server_url.encode()).hexdigest()[:8]}.db"
+    return os.path.join(os.path.expanduser("~"), ".clipboard_sync", name)
+
+
+def summarize(item):
+    """服务器返回的记录 -> 副本中的一行；兼容还在返回完整内容的旧版服务器"""
+    preview = item.get("preview")
+    if preview is None:
+        content = item.get("content") or ""
+        preview = content[:PREVIEW_CHARS]
+        size = len(content.encode("utf-8"))
+    else:
+        size = item["size"]
+    return (item["id"], item["device_id"], item["timestamp"], item.get("content_hash"),
+            preview, size, int(size > len(preview.encode("utf-8"))))
+
+
+class HistoryCache:
+    def __init__(self, path=None, server_url=None):
+        """没有指定 path 时按 server_url 选择副本文件"""
+        self.path = path or default_history_path(server_url)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # upload.py 和 view_history.py 可能同时写，等待对方的写锁而不是立即报错
+        self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "id INTEGER PRIMARY KEY, "
+            "device_id TEXT NOT NULL, "
+            "timestamp TEXT NOT NULL, "
+            "content_hash TEXT, "
+            "preview TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "truncated INTEGER NOT NULL)"
+        )
+        # 和服务器一样按 (timestamp, id) 倒序查询，按设备筛选时也走索引
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_items_device_timestamp ON items (device_id, timestamp DESC, id DESC)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_items_timestamp ON items (timestamp DESC, id DESC)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    # ---- 查询 ----
+
+    def query(self, device_id=None, limit=10):
+        """按时间从新到旧返回最多 limit 条记录（字典，字段与服务器的历史记录一致）"""
+        sql = "SELECT id, device_id, timestamp, content_hash, preview, size, truncated FROM items"
+        params = []
+        if device_id:
+            sql += " WHERE device_id = ?"
+            params.append(device_id)
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [{
+            "id": row[0],
+            "device_id": row[1],
+            "timestamp": row[2],
+            "content_hash": row[3],
+            "preview": row[4],
+            "size": row[5],
+            "truncated": bool(row[6]),
+        } for row in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    @property
+    def last_synced(self):
+        """上次同步成功的时间（datetime），从未同步过时为 None"""
+        value = self._get_state("last_synced")
+        return datetime.fromtimestamp(float(value)) if value else None
+
+    # ---- 同步 ----
+
+    def sync(self, http, server_url, page_size=100, timeout=10):
+        """从服务器获取新记录，返回新增的条数；网络错误时抛出 requests 的异常"""
+        if self._get_state("server_url") not in (None, server_url):
+            # 指定的副本文件换了服务器，记录ID不再对应，重建副本
+            self.clear()
+        self._set_states({"server_url": server_url})
+
+        url = urljoin(server_url, "/clipboard/history")
+        added = 0
+        since = int(self._get_state("since_id") or 0)
+        while True:
+            page = self._fetch(http, url, {"limit": page_size, "since_id": since}, timeout)
+            if "next_since_id" not in page:
+                # 旧版本服务器不认识 since_id，返回的是最新的一页
+                added += self._store(page["items"], {})
+                break
+            since = page["next_since_id"]
+            added += self._store(page["items"], {"since_id": since})
+            if len(page["items"]) < page_size:
+                break
+
+        self._set_states({"last_synced": time.time()})
+        return added
+
+    @staticmethod
+    def _fetch(http, url, params, timeout):
+        response = http.get(url, params=params, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _store(self, items, states):
+        """在一个事务里写入一页记录和同步位置，中断时两者保持一致"""
+        rows = [summarize(item) for item in items if not item.get("archived")]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO items "
+                    "(id, device_id, timestamp, content_hash, preview, size, truncated) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                )
+                added = self._conn.total_changes - before
+                self._write_states(states)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("DELETE FROM items")
+            self._conn.execute("DELETE FROM state")
+            self._conn.execute("COMMIT")
+
+    # ---- 同步状态 ----
+
+    def _get_state(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_states(self, states):
+        with self._lock:
+            self._write_states(states)
+
+    def _write_states(self, states):
+        self._conn.executemany(
+            "INSERT INTO state (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            [(key, str(value)) for key, value in states.items()]
+        )
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,60 @@
+"""客户端共用的 HTTP 连接池
+
+上传线程、同步线程和历史查看都通过同一个 HttpClient 发请求，连接保持 keep-alive
+并在线程间复用，不再每个请求都重新建立 TCP 连接。urllib3 的连接池本身是线程安全的，
+这里只使用不修改会话状态（cookie、headers）的请求，所以可以放心在多个线程间共享。
+"""
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpClient:
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None):
+        self.pool_size = pool_size or int(os.environ.get("CLIPBOARD_HTTP_POOL_SIZE", 4))
+        self.connect_timeout = connect_timeout or float(os.environ.get("CLIPBOARD_HTTP_CONNECT_TIMEOUT", 5))
+        self.read_timeout = read_timeout or float(os.environ.get("CLIPBOARD_HTTP_READ_TIMEOUT", 10))
+        self._lock = threading.Lock()
+        self._requests = 0
+
+        self.session = requests.Session()
+        # 重试由上传队列自己负责，连接池这一层不重试；pool_block 为 False 时池满会临时多开连接
+        self.adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """timeout 为本次请求的读取超时，连接超时使用统一配置"""
+        with self._lock:
+            self._requests += 1
+        return self.session.request(method, url, timeout=(self.connect_timeout, timeout or self.read_timeout), **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def stats(self):
+        """连接复用统计：请求数、新建的连接数和复用连接的请求数"""
+        pools = self.adapter.poolmanager.pools
+        opened = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+        with self._lock:
+            total = self._requests
+        return {
+            "requests": total,
+            "connections_opened": opened,
+            "connections_reused": max(total - opened, 0),
+        }
+
+    def close(self):
+        self.session.close()
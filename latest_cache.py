@@ -0,0 +1,60 @@
+"""每个设备最新记录的进程内缓存
+
+版本号就是设备最新记录的 id。上传成功后通过 broker 广播新版本，所有 worker
+收到后更新版本号、丢弃旧的响应体，所以 /clipboard/latest 可以只凭内存判断
+If-None-Match 是否仍然有效，不必查询数据库。广播可能丢失（接收缓冲区满），
+因此每条缓存只在 ttl 秒内被信任，过期后回数据库确认一次。
+"""
+import threading
+import time
+
+
+class LatestCache:
+    def __init__(self, broker, ttl=60):
+        self.ttl = ttl
+        self._entries = {}  # device_id -> {"id", "body", "checked"}
+        self._lock = threading.Lock()
+        broker.add_listener(self._on_message)
+
+    def _on_message(self, message):
+        device_id = message.get("device_id")
+        if not device_id:
+            return
+        if message.get("invalidate"):
+            # 记录被删除后最新记录可能变旧，只能整条丢弃
+            with self._lock:
+                self._entries.pop(device_id, None)
+            return
+        if "id" in message:
+            self.set_version(device_id, message["id"])
+
+    def set_version(self, device_id, item_id):
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry and entry["id"] >= item_id:
+                return
+            self._entries[device_id] = {"id": item_id, "body": None, "checked": time.monotonic()}
+
+    def version(self, device_id):
+        """返回仍然可信的最新记录 id，不确定时返回 None"""
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry and time.monotonic() - entry["checked"] < self.ttl:
+                return entry["id"]
+            return None
+
+    def get(self, device_id):
+        """返回 (id, 序列化好的响应体)，没有可信缓存时返回 None"""
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry and entry["body"] is not None and time.monotonic() - entry["checked"] < self.ttl:
+                return entry["id"], entry["body"]
+            return None
+
+    def store(self, device_id, item_id, body):
+        """缓存从数据库读到的最新记录；比已知版本旧的结果直接忽略"""
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry and entry["id"] > item_id:
+                return
+            self._entries[device_id] = {"id": item_id, "body": body, "checked": time.monotonic()}
@@ -0,0 +1,118 @@
+"""进程内的传输层
+
+LocalTransport 和 HttpClient 的接口相同（request/get/post/put/stats/close），
+ClipboardSync、HistoryCache 和 view_history 不用改动就能换用：请求不经过回环网络，
+而是构造 WSGI environ 直接调用同一进程里的 Flask 应用，省掉建立连接、
+HTTP 报文的序列化和解析。start.py 的嵌入模式使用它。
+
+Flask、SQLAlchemy 的导入要几百毫秒，所以应用由 loader 在后台线程里加载，
+这段时间里客户端已经可以开始监控剪贴板，请求到来时才等待应用就绪；
+加载失败时请求抛出 requests 的 ConnectionError，客户端按连不上服务器处理。
+"""
+import json
+import threading
+from urllib.parse import urlencode, urlsplit
+
+from requests.exceptions import ConnectionError, HTTPError
+
+
+class LocalResponse:
+    """requests.Response 中客户端用到的部分"""
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+class LocalTransport:
+    def __init__(self, loader):
+        """loader 返回 WSGI 应用，例如 lambda: importlib.import_module("app").app"""
+        self.loader = loader
+        self.app = None
+        self.error = None
+        self._ready = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+        self._requests = 0
+
+    def preload(self):
+        """在后台线程里开始加载应用，可以重复调用"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._load, daemon=True).start()
+
+    def _load(self):
+        try:
+            # werkzeug 随 Flask 一起导入，放在这里同样不占用调用方的启动时间
+            from werkzeug.test import EnvironBuilder, run_wsgi_app
+            self._environ_builder = EnvironBuilder
+            self._run_wsgi_app = run_wsgi_app
+            self.app = self.loader()
+        except Exception as e:
+            self.error = e
+        finally:
+            self._ready.set()
+
+    def wait_ready(self, timeout=None):
+        """等待应用加载完成，返回应用；加载失败时抛出 ConnectionError"""
+        self.preload()
+        if not self._ready.wait(timeout):
+            raise ConnectionError("local app is still loading")
+        if self.error is not None:
+            raise ConnectionError(f"local app failed to load: {self.error}")
+        return self.app
+
+    def request(self, method, url, timeout=None, params=None, data=None, headers=None, **kwargs):
+        """timeout、stream 等只对网络请求有意义的参数会被忽略"""
+        app = self.wait_ready()
+        with self._lock:
+            self._requests += 1
+
+        parts = urlsplit(url)
+        query = parts.query
+        if params:
+            # 和 requests 一样忽略值为 None 的参数
+            extra = urlencode({k: v for k, v in params.items() if v is not None}, doseq=True)
+            query = "&".join(q for q in (query, extra) if q)
+        builder = self._environ_builder(path=parts.path or "/", base_url=f"{parts.scheme}://{parts.netloc}",
+                                        query_string=query, method=method, data=data, headers=headers)
+        try:
+            environ = builder.get_environ()
+        finally:
+            builder.close()
+        # buffered 时响应体被读完、close 已经调用（请求的 teardown 在这里执行）
+        app_iter, status, response_headers = self._run_wsgi_app(app, environ, buffered=True)
+        return LocalResponse(url, int(status.split(None, 1)[0]), response_headers, b"".join(app_iter))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def stats(self):
+        """和 HttpClient.stats 的字段相同；进程内调用不建立连接"""
+        with self._lock:
+            total = self._requests
+        return {"requests": total, "connections_opened": 0, "connections_reused": 0}
+
+    def close(self):
+        pass
@@ -0,0 +1,315 @@
+"""请求和数据库的运行指标，以 Prometheus 文本格式输出
+
+记录的内容：
+- 每个路由的请求数（按状态码）、延迟直方图、响应大小直方图
+- 每个请求执行的 SQL 条数和耗时（SQLAlchemy 引擎事件）
+- 请求内各阶段的耗时：数据库、JSON 序列化、模板渲染
+- 和最新记录相同、没有写入的上传次数
+
+每个 worker 进程只在内存里累加（一次加锁的字典更新），后台线程每隔 flush_interval 秒
+把快照写到共享目录下的 <pid>.json。/metrics 把所有快照相加，所以结果覆盖全部
+gunicorn worker，其他 worker 的数据最多滞后 flush_interval 秒。已退出的 worker 的快照
+并入 dead.json 后删除，计数器在 worker 重启后也不会变小。
+"""
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import fcntl
+except ImportError:  # Windows：本地只有一个进程
+    fcntl = None
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# 名称 -> (类型, 说明, 直方图分桶)
+DEFINITIONS = {
+    "clipboard_http_requests_total": ("counter", "HTTP requests by route, method and status", None),
+    "clipboard_http_request_duration_seconds": ("histogram", "HTTP request latency", LATENCY_BUCKETS),
+    "clipboard_http_response_size_bytes": ("histogram", "HTTP response body size (after compression)", SIZE_BUCKETS),
+    "clipboard_db_queries_per_request": ("histogram", "SQL statements executed per request", COUNT_BUCKETS),
+    "clipboard_db_queries_total": ("counter", "SQL statements executed", None),
+    "clipboard_db_query_seconds_total": ("counter", "Time spent executing SQL statements", None),
+    "clipboard_phase_seconds_total": ("counter", "Time spent per request phase (db, json, render)", None),
+    "clipboard_collapsed_uploads_total": ("counter", "Uploads collapsed into an identical latest item instead of stored", None),
+}
+
+BACKGROUND_ROUTE = "background"  # 请求之外执行的 SQL（清理任务、组提交线程等）
+
+
+def _key(labels):
+    return json.dumps(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 9))
+    return str(value)
+
+
+def merge_into(total, snapshot):
+    for name, series in snapshot.get("series", {}).items():
+        target = total.setdefault(name, {})
+        for key, value in series.items():
+            if isinstance(value, list):
+                current = target.get(key)
+                target[key] = value[:] if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                target[key] = target.get(key, 0) + value
+    return total
+
+
+class Metrics:
+    def __init__(self, directory, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._series = {}  # 名称 -> {labels key: 数值 或 [各分桶计数..., sum, count]}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = None
+        self._token = None
+        os.makedirs(directory, exist_ok=True)
+
+    # ---- 记录 ----
+
+    def inc(self, name, labels, value=1):
+        key = _key(labels)
+        with self._lock:
+            series = self._series.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = DEFINITIONS[name][2]
+        key = _key(labels)
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            series = self._series.setdefault(name, {})
+            entry = series.get(key)
+            if entry is None:
+                entry = series[key] = [0] * (len(buckets) + 3)
+            entry[index] += 1  # 各分桶（最后一格为 +Inf）之后依次是 sum 和 count
+            entry[-2] += value
+            entry[-1] += 1
+
+    @property
+    def current(self):
+        """当前线程正在处理的请求的统计，请求之外为 None"""
+        return getattr(self._local, "request", None)
+
+    @contextmanager
+    def phase(self, name):
+        """统计一段代码的耗时，计入当前请求的某个阶段"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            state = self.current
+            if state is not None:
+                state["phases"][name] = state["phases"].get(name, 0) + time.perf_counter() - start
+
+    # ---- 接入 Flask 和 SQLAlchemy ----
+
+    def init_app(self, app, *engines):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.json = TimedJSONProvider(app, self)
+
+        from sqlalchemy import event
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_request(self):
+        self._ensure_flusher()
+        self._local.request = {"start": time.perf_counter(), "queries": 0, "phases": {}}
+
+    def _after_request(self, response):
+        # 在其他 after_request 钩子（压缩）之后执行，记录的是实际发送的大小
+        state = self.current
+        if state is None:
+            return response
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        self.inc("clipboard_http_requests_total",
+                 {"route": route, "method": request.method, "status": str(response.status_code)})
+        self.observe("clipboard_http_request_duration_seconds",
+                     {"route": route, "method": request.method}, time.perf_counter() - state["start"])
+        if response.content_length is not None:
+            self.observe("clipboard_http_response_size_bytes", {"route": route}, response.content_length)
+        self.observe("clipboard_db_queries_per_request", {"route": route}, state["queries"])
+        for phase, seconds in state["phases"].items():
+            self.inc("clipboard_phase_seconds_total", {"route": route, "phase": phase}, seconds)
+        return response
+
+    def _teardown_request(self, exc):
+        self._local.request = None
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        state = self.current
+        if state is not None:
+            state["queries"] += 1
+            state["phases"]["db"] = state["phases"].get("db", 0) + elapsed
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+        else:
+            route = BACKGROUND_ROUTE
+        self.inc("clipboard_db_queries_total", {"route": route})
+        self.inc("clipboard_db_query_seconds_total", {"route": route}, elapsed)
+
+    # ---- 跨进程汇总 ----
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _ensure_flusher(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # fork 出来的 worker 不继承父进程的计数
+            self._pid = os.getpid()
+            self._token = uuid.uuid4().hex
+            self._series = {}
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ 写入监控指标出错: {str(e)}")
+
+    @contextmanager
+    def _dir_lock(self):
+        with open(self._path(".lock"), "w") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _read(self, name):
+        try:
+            with open(self._path(name)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, name, data):
+        tmp = self._path(f"{name}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self._path(name))
+
+    def _retire(self, name, snapshot):
+        """把已退出进程的快照并入 dead.json（调用方持有目录锁）"""
+        dead = self._read("dead.json") or {"series": {}}
+        merge_into(dead["series"], snapshot)
+        self._write("dead.json", dead)
+        os.unlink(self._path(name))
+
+    def flush(self):
+        """把本进程的计数写入共享目录"""
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            snapshot = {"pid": self._pid, "token": self._token,
+                        "series": json.loads(json.dumps(self._series))}
+        name = f"{self._pid}.json"
+        with self._dir_lock():
+            previous = self._read(name)
+            if previous and previous.get("token") != self._token:
+                # 之前同 pid 的进程留下的快照
+                self._retire(name, previous)
+            self._write(name, snapshot)
+
+    def collect(self):
+        """汇总所有 worker 的快照，返回 {名称: {labels key: 数值}}"""
+        self._ensure_flusher()
+        self.flush()
+        total = {}
+        with self._dir_lock():
+            for name in sorted(os.listdir(self.directory)):
+                if not name.endswith(".json"):
+                    continue
+                snapshot = self._read(name)
+                if snapshot is None:
+                    continue
+                if name != "dead.json" and not _alive(snapshot.get("pid")):
+                    self._retire(name, snapshot)
+                merge_into(total, snapshot)
+        return total
+
+    def render(self):
+        """Prometheus 文本格式"""
+        total = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in DEFINITIONS.items():
+            series = total.get(name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key in sorted(series):
+                pairs = [tuple(pair) for pair in json.loads(key)]
+                value = series[key]
+                if kind != "histogram":
+                    lines.append(f"{name}{_format_labels(pairs)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ["+Inf"], value[:-2]):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(pairs + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(pairs)} {_format_value(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(pairs)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """统计 jsonify 序列化 JSON 的耗时"""
+
+    def __init__(self, app, metrics):
+        super().__init__(app)
+        self.metrics = metrics
+
+    def dumps(self, obj, **kwargs):
+        with self.metrics.phase("json"):
+            return super().dumps(obj, **kwargs)
@@ -0,0 +1,303 @@
+"""数据库结构迁移
+
+db.create_all() 只会创建缺失的表，不会修改已有的表或给已有的表加索引，
+所以已部署数据库的结构变更放在这里，按版本号顺序执行一次。
+迁移里只使用当时的表结构快照（原始 SQL 或局部定义的 Table），不要引用 models.py，
+否则模型以后再加字段时，旧数据库升级到一半就会出错。
+"""
+import os
+import hashlib
+from contextlib import contextmanager
+from sqlalchemy.exc import OperationalError
+from sqlalchemy import inspect, text, MetaData, Table, Column, Integer, String, Text, DateTime, ForeignKey
+
+MIGRATIONS = []
+
+def migration(version, on_fresh=False):
+    """注册迁移；on_fresh 的迁移创建的是模型之外的对象（虚拟表、触发器等），新数据库也要执行"""
+    def decorator(func):
+        MIGRATIONS.append((version, func, on_fresh))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+@contextmanager
+def migration_lock(lock_dir):
+    """gunicorn 的多个 worker 会同时启动，用文件锁保证迁移只执行一次"""
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, ".migrate.lock"), "w") as f:
+        try:
+            import fcntl
+        except ImportError:  # Windows：本地只有一个进程，不需要加锁
+            yield
+            return
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def head_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+def current_version(conn):
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    row = conn.execute(text("SELECT MAX(version) FROM schema_version")).first()
+    return row[0] or 0
+
+def run_migrations(db, lock_dir):
+    """新数据库直接按当前模型建表；已有数据库先执行未完成的迁移，再补建新增的表"""
+    with migration_lock(lock_dir):
+        fresh = not inspect(db.engine).has_table("clipboard_item")
+        with db.engine.begin() as conn:
+            version = current_version(conn)
+            if fresh:
+                db.metadata.create_all(conn)
+                for _, func, on_fresh in MIGRATIONS:
+                    if on_fresh:
+                        func(conn)
+                conn.execute(text("INSERT INTO schema_version (version) VALUES (:v)"), {"v": head_version()})
+                return
+            for target, func, _ in MIGRATIONS:
+                if target <= version:
+                    continue
+                print(f"🛠️ 执行数据库迁移 {target}: {func.__doc__}")
+                func(conn)
+                conn.execute(text("INSERT INTO schema_version (version) VALUES (:v)"), {"v": target})
+            db.metadata.create_all(conn)
+
+def create_timestamp_indexes(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_clipboard_item_device_id_timestamp "
+        "ON clipboard_item (device_id, timestamp DESC, id DESC)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_clipboard_item_timestamp "
+        "ON clipboard_item (timestamp DESC, id DESC)"
+    ))
+
+@migration(1)
+def add_timestamp_indexes(conn):
+    """为 clipboard_item 添加 (device_id, timestamp) 和 timestamp 索引"""
+    create_timestamp_indexes(conn)
+
+@migration(2)
+def move_content_to_blobs(conn):
+    """把 clipboard_item.content 移到按内容哈希去重的 clipboard_blob 表"""
+    from storage import upsert_blob_refs
+
+    meta = MetaData()
+    blob_table = Table(
+        "clipboard_blob", meta,
+        Column("hash", String(64), primary_key=True),
+        Column("content", Text, nullable=False),
+        Column("size", Integer, nullable=False),
+        Column("refcount", Integer, nullable=False, default=0),
+    )
+    Table(
+        "clipboard_item_new", meta,
+        Column("id", Integer, primary_key=True),
+        Column("content_hash", String(64), ForeignKey("clipboard_blob.hash"), nullable=False),
+        Column("device_id", String(100), nullable=False),
+        Column("timestamp", DateTime),
+    )
+    meta.create_all(conn)
+    conn.execute(text("ALTER TABLE clipboard_item ADD COLUMN content_hash VARCHAR(64)"))
+
+    # 分批计算哈希，避免一次把整张表读进内存
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            text("SELECT id, content FROM clipboard_item WHERE id > :last ORDER BY id LIMIT 1000"),
+            {"last": last_id}
+        ).all()
+        if not rows:
+            break
+        blobs = {}
+        hashes = []
+        for item_id, content in rows:
+            digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+            blob = blobs.setdefault(digest, {
+                "hash": digest,
+                "content": content,
+                "size": len(content.encode("utf-8")),
+                "refcount": 0
+            })
+            blob["refcount"] += 1
+            hashes.append({"id": item_id, "digest": digest})
+        upsert_blob_refs(conn, list(blobs.values()), blob_table)
+        conn.execute(text("UPDATE clipboard_item SET content_hash = :digest WHERE id = :id"), hashes)
+        last_id = rows[-1][0]
+
+    # SQLite 不能直接删除带约束的列，统一用新表替换旧表
+    conn.execute(text(
+        "INSERT INTO clipboard_item_new (id, content_hash, device_id, timestamp) "
+        "SELECT id, content_hash, device_id, timestamp FROM clipboard_item"
+    ))
+    conn.execute(text("DROP TABLE clipboard_item"))
+    conn.execute(text("ALTER TABLE clipboard_item_new RENAME TO clipboard_item"))
+    create_timestamp_indexes(conn)
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            "SELECT setval(pg_get_serial_sequence('clipboard_item', 'id'), "
+            "COALESCE((SELECT MAX(id) FROM clipboard_item), 0) + 1, false)"
+        ))
+
+@migration(3)
+def add_client_id(conn):
+    """为 clipboard_item 添加用于幂等重试的 client_id 列"""
+    conn.execute(text("ALTER TABLE clipboard_item ADD COLUMN client_id VARCHAR(64)"))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_clipboard_item_device_id_client_id "
+        "ON clipboard_item (device_id, client_id)"
+    ))
+
+@migration(4, on_fresh=True)
+def add_full_text_index(conn):
+    """创建剪贴板内容的全文索引（SQLite 用 FTS5，PostgreSQL 用 GIN）"""
+    if conn.dialect.name == "postgresql":
+        # 表达式索引随 clipboard_blob 的增删自动更新
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_clipboard_blob_fts "
+            "ON clipboard_blob USING GIN (to_tsvector('simple', content))"
+        ))
+        return
+
+    # FTS5 外部内容表：索引本身不再保存一份内容，需要时从视图按 id 读取
+    conn.execute(text(
+        "CREATE VIEW IF NOT EXISTS clipboard_fts_source AS "
+        "SELECT clipboard_item.id AS id, clipboard_blob.content AS content "
+        "FROM clipboard_item JOIN clipboard_blob ON clipboard_blob.hash = clipboard_item.content_hash"
+    ))
+    # trigram 分词支持中文等不以空格分词的文字做子串搜索（SQLite 3.34+），旧版本退回 unicode61
+    try:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS clipboard_fts USING fts5("
+            "content, content='clipboard_fts_source', content_rowid='id', tokenize='trigram')"
+        ))
+    except OperationalError:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS clipboard_fts USING fts5("
+            "content, content='clipboard_fts_source', content_rowid='id', tokenize='unicode61')"
+        ))
+    # 新增和删除记录（包括批量写入和清理任务）时由触发器同步索引；
+    # 删除记录时内容还在 clipboard_blob 中（storage.delete_items 先删记录再释放内容）
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS clipboard_item_fts_insert AFTER INSERT ON clipboard_item BEGIN "
+        "INSERT INTO clipboard_fts (rowid, content) "
+        "SELECT new.id, content FROM clipboard_blob WHERE hash = new.content_hash; "
+        "END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS clipboard_item_fts_delete AFTER DELETE ON clipboard_item BEGIN "
+        "INSERT INTO clipboard_fts (clipboard_fts, rowid, content) "
+        "SELECT 'delete', old.id, content FROM clipboard_blob WHERE hash = old.content_hash; "
+        "END"
+    ))
+    conn.execute(text("INSERT INTO clipboard_fts (clipboard_fts) VALUES ('rebuild')"))
+
+@migration(5)
+def add_sync_groups(conn):
+    """为 clipboard_item 添加同步组和组内序号（sync_group 表由 create_all 创建）"""
+    conn.execute(text("ALTER TABLE clipboard_item ADD COLUMN sync_group VARCHAR(100)"))
+    conn.execute(text("ALTER TABLE clipboard_item ADD COLUMN seq INTEGER"))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_clipboard_item_sync_group_seq "
+        "ON clipboard_item (sync_group, seq)"
+    ))
+
+@migration(6)
+def add_blob_preview(conn):
+    """为 clipboard_blob 添加预览和文件路径列，并为已有内容生成预览"""
+    # 已有的大内容仍然保存在数据库里，只有之后上传的内容才会按大小阈值存为文件
+    conn.execute(text("ALTER TABLE clipboard_blob ADD COLUMN preview TEXT"))
+    conn.execute(text("ALTER TABLE clipboard_blob ADD COLUMN location VARCHAR(255)"))
+    conn.execute(text("UPDATE clipboard_blob SET preview = substr(content, 1, 200)"))
+
+def index_blob_content_postgresql(conn, searchable):
+    conn.execute(text("DROP INDEX IF EXISTS ix_clipboard_blob_fts"))
+    conn.execute(text(
+        "CREATE INDEX ix_clipboard_blob_fts "
+        f"ON clipboard_blob USING GIN (to_tsvector('simple', {searchable}))"
+    ))
+
+def sync_item_fts_sqlite(conn, searchable):
+    """让 clipboard_fts 的视图和触发器改为索引 searchable 表达式（需要调用方重建或保持索引一致）"""
+    conn.execute(text("DROP TRIGGER IF EXISTS clipboard_item_fts_insert"))
+    conn.execute(text("DROP TRIGGER IF EXISTS clipboard_item_fts_delete"))
+    conn.execute(text("DROP VIEW IF EXISTS clipboard_fts_source"))
+    conn.execute(text(
+        "CREATE VIEW clipboard_fts_source AS "
+        f"SELECT clipboard_item.id AS id, {searchable} AS content "
+        "FROM clipboard_item JOIN clipboard_blob ON clipboard_blob.hash = clipboard_item.content_hash"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER clipboard_item_fts_insert AFTER INSERT ON clipboard_item BEGIN "
+        "INSERT INTO clipboard_fts (rowid, content) "
+        f"SELECT new.id, {searchable} FROM clipboard_blob WHERE hash = new.content_hash; "
+        "END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER clipboard_item_fts_delete AFTER DELETE ON clipboard_item BEGIN "
+        "INSERT INTO clipboard_fts (clipboard_fts, rowid, content) "
+        f"SELECT 'delete', old.id, {searchable} FROM clipboard_blob WHERE hash = old.content_hash; "
+        "END"
+    ))
+
+@migration(7, on_fresh=True)
+def index_blob_file_previews(conn):
+    """存为文件的内容在数据库中 content 为空，全文索引改为索引它的预览"""
+    from search import SEARCHABLE_CONTENT
+
+    if conn.dialect.name == "postgresql":
+        index_blob_content_postgresql(conn, SEARCHABLE_CONTENT)
+    elif conn.dialect.name == "sqlite":
+        sync_item_fts_sqlite(conn, SEARCHABLE_CONTENT)
+
+@migration(8)
+def reindex_blob_previews_postgresql(conn):
+    """PostgreSQL 的全文索引同样改为索引存为文件的内容的预览（之前的迁移 7 在 PostgreSQL 上没有执行）"""
+    from search import SEARCHABLE_CONTENT
+
+    if conn.dialect.name == "postgresql":
+        index_blob_content_postgresql(conn, SEARCHABLE_CONTENT)
+
+@migration(9, on_fresh=True)
+def index_blob_files_full_text(conn):
+    """存为文件的内容按段索引全文（clipboard_blob_fts），不再只索引预览"""
+    from models import blob_file_path
+    from search import INDEXED_CONTENT, index_blob_file
+
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS clipboard_blob_fts ("
+            "hash VARCHAR(64) NOT NULL, document TSVECTOR NOT NULL)"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_clipboard_blob_fts_hash ON clipboard_blob_fts (hash)"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_clipboard_blob_fts_document "
+            "ON clipboard_blob_fts USING GIN (document)"
+        ))
+        index_blob_content_postgresql(conn, INDEXED_CONTENT)
+    elif conn.dialect.name == "sqlite":
+        # 分词器和 clipboard_fts 一致；普通 FTS5 表，删除内容时可以按 hash 删除它的分段
+        tokenizer = "trigram" if "trigram" in (conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE name = 'clipboard_fts'")
+        ).scalar() or "") else "unicode61"
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS clipboard_blob_fts USING fts5("
+            f"content, hash UNINDEXED, tokenize='{tokenizer}')"
+        ))
+        # 存为文件的内容 content 为空，不再在 clipboard_fts 中留下预览；改了视图后重建索引
+        sync_item_fts_sqlite(conn, INDEXED_CONTENT)
+        conn.execute(text("INSERT INTO clipboard_fts (clipboard_fts) VALUES ('rebuild')"))
+    else:
+        return
+
+    for digest, location in conn.execute(
+        text("SELECT hash, location FROM clipboard_blob WHERE location IS NOT NULL")
+    ).all():
+        try:
+            index_blob_file(conn, digest, blob_file_path(location))
+        except FileNotFoundError:
+            print(f"⚠️ 内容文件不存在，跳过索引: {location}")
@@ -1,10 +1,71 @@
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import deferred, joinedload
+from routing import RoutingSession
 from datetime import datetime
+import os
 
-db = SQLAlchemy()
+# 只读接口可以把 session 切到副本（见 routing.py）
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+def blob_file_path(location):
+    return os.path.join(current_app.config['BLOB_DIR'], location)
+
+class ClipboardBlob(db.Model):
+    """按内容哈希去重存储的剪贴板内容，refcount 为引用它的 ClipboardItem 数量
+
+    超过大小阈值的内容存为 instance/blobs 下的文件，location 为文件的相对路径，
+    此时 content 为空字符串。content 默认不随记录加载，列表只需要 preview 和 size。
+    """
+    hash = db.Column(db.String(64), primary_key=True)  # 内容的 SHA-256
+    content = deferred(db.Column(db.Text, nullable=False))
+    size = db.Column(db.Integer, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    preview = db.Column(db.Text)  # 内容开头的一小段
+    location = db.Column(db.String(255))  # 存在文件里时的相对路径
+
+    def read(self):
+        """返回完整内容"""
+        if self.location:
+            with open(blob_file_path(self.location), encoding="utf-8") as f:
+                return f.read()
+        return self.content
+
+class SyncGroup(db.Model):
+    """同步组：使用同一个组名的设备互相同步，last_seq 为组内已分配的最大序号"""
+    name = db.Column(db.String(100), primary_key=True)
+    last_seq = db.Column(db.Integer, nullable=False, default=0)
 
 class ClipboardItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    content = db.Column(db.Text, nullable=False)
+    content_hash = db.Column(db.String(64), db.ForeignKey('clipboard_blob.hash'), nullable=False)
     device_id = db.Column(db.String(100), nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    client_id = db.Column(db.String(64))  # 客户端生成的唯一ID，重试上传时用来去重
+    sync_group = db.Column(db.String(100))  # 所属同步组，不属于任何组时为空
+    seq = db.Column(db.Integer)  # 组内由服务器分配的单调递增序号
+
+    blob = db.relationship(ClipboardBlob, lazy='joined')
+
+    @property
+    def content(self):
+        return self.blob.read()
+
+class CollapsedUpload(db.Model):
+    """和最新一条内容相同、没有新增记录的上传：client_id 对应到它被折叠到的记录，重试时据此去重"""
+    device_id = db.Column(db.String(100), primary_key=True)
+    client_id = db.Column(db.String(64), primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('clipboard_item.id'), nullable=False, index=True)
+
+def with_content():
+    """查询选项：需要读取多条记录的完整内容时，和记录一起加载内容列，而不是逐条再查询"""
+    return joinedload(ClipboardItem.blob).undefer(ClipboardBlob.content)
+
+# 按设备查询最新/历史记录，以及不区分设备的全局时间线，都走索引而不是全表排序
+# 索引中带上 id，保证同一时间戳下的翻页顺序稳定，ORDER BY timestamp, id 也能直接走索引
+db.Index('ix_clipboard_item_device_id_timestamp',
+         ClipboardItem.device_id, ClipboardItem.timestamp.desc(), ClipboardItem.id.desc())
+db.Index('ix_clipboard_item_timestamp', ClipboardItem.timestamp.desc(), ClipboardItem.id.desc())
+db.Index('ux_clipboard_item_device_id_client_id', ClipboardItem.device_id, ClipboardItem.client_id, unique=True)
+# 变更流：按 (sync_group, seq) 做一次范围扫描取出组内的新记录
+db.Index('ux_clipboard_item_sync_group_seq', ClipboardItem.sync_group, ClipboardItem.seq, unique=True)
@@ -0,0 +1,57 @@
+"""历史页面（/）渲染结果的进程内缓存
+
+缓存渲染好的 HTML 和对应的 ETag。任何写入（新记录的广播或删除的 invalidate 消息）
+都会清空缓存，同一 worker 和其他 worker 都一样。渲染期间如果收到了写入通知，
+这次的结果可能已经过时，不放进缓存。广播可能丢失，所以缓存只在 ttl 秒内有效。
+"""
+import hashlib
+import threading
+import time
+
+
+def make_etag(body):
+    # 由内容计算，所有 worker 对同样的数据给出同样的 ETag
+    return hashlib.md5(body.encode("utf-8")).hexdigest()
+
+
+class PageCache:
+    def __init__(self, broker, ttl=60, max_entries=64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}  # key -> (etag, body, stored_at)
+        self._generation = 0
+        self._lock = threading.Lock()
+        broker.add_listener(self._on_message)
+
+    def _on_message(self, message):
+        if message.get("device_id"):
+            self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    @property
+    def generation(self):
+        """渲染前记下当前代数，存入缓存时用来判断期间是否有写入"""
+        with self._lock:
+            return self._generation
+
+    def get(self, key):
+        """返回 (etag, body)，没有有效缓存时返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[2] < self.ttl:
+                return entry[0], entry[1]
+            return None
+
+    def store(self, key, body, generation):
+        """缓存渲染结果并返回 ETag；渲染期间有写入时只计算 ETag 不缓存"""
+        etag = make_etag(body)
+        with self._lock:
+            if generation == self._generation:
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+                self._entries[key] = (etag, body, time.monotonic())
+        return etag
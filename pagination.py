@@ -0,0 +1,53 @@
+"""基于游标（keyset）的分页
+
+按 (timestamp, id) 倒序翻页，每页只扫描索引中的 limit 行，
+翻到多深都不需要 OFFSET。游标对客户端是不透明的字符串。
+"""
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+def encode_key(timestamp, item_id):
+    return encode_iso_key(timestamp.isoformat(), item_id)
+
+def encode_iso_key(timestamp, item_id):
+    """timestamp 为已经格式化好的 isoformat 字符串"""
+    raw = json.dumps([timestamp, item_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def encode_cursor(item):
+    return encode_key(item.timestamp, item.id)
+
+def decode_cursor(cursor):
+    """解析游标，格式错误时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, item_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(item_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+def paginate(query, model, limit, before=None, after=None):
+    """返回 (items, next_cursor)，items 总是按时间从新到旧排列
+
+    before: 取比游标更旧的一页，next_cursor 继续向更旧的方向翻页
+    after:  取紧接在游标之后更新的一页，next_cursor 继续向更新的方向翻页
+    两者都没有时返回最新的一页
+    """
+    key = tuple_(model.timestamp, model.id)
+    if after:
+        items = query.filter(key > decode_cursor(after))\
+            .order_by(model.timestamp.asc(), model.id.asc()).limit(limit).all()
+        items.reverse()
+        next_item = items[0] if items else None
+    else:
+        if before:
+            query = query.filter(key < decode_cursor(before))
+        items = query.order_by(model.timestamp.desc(), model.id.desc()).limit(limit).all()
+        next_item = items[-1] if len(items) == limit else None
+
+    if after and next_item is None:
+        # 没有更新的内容时原样返回游标，方便客户端下次继续增量获取
+        return items, after
+    return items, encode_cursor(next_item) if next_item else None
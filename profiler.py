@@ -0,0 +1,312 @@
+"""按需开启的请求剖析（cProfile）和慢请求记录
+
+默认关闭，关闭时不注册任何钩子，没有额外开销。开启的方式（环境变量）：
+- PROFILE_SAMPLE_RATE：随机剖析的请求比例，例如 0.01 表示百分之一
+- PROFILE_TOKEN：设置后，请求头 X-Clipboard-Profile 等于这个值的请求一定会被剖析，
+  它的记录（带耗时最多的函数）总是写入慢请求日志，响应头 X-Profile-Trace 给出记录的 id；
+  下载剖析结果的接口也要求带上这个请求头
+- PROFILE_SLOW_MS：耗时超过这么多毫秒的请求写入慢请求日志，附带执行过的 SQL 和各自的耗时
+  （只记录语句，不记录参数，避免剪贴板内容进入日志）
+
+同一个进程同一时间只剖析一个请求（cProfile 的钩子不能叠加），其他同时到达的请求不剖析。
+每个路由的剖析结果在 worker 内存里累加，后台线程每隔 flush_interval 秒写到
+instance/profiles/<pid>-<随机串>/ 下；下载时把所有 worker（包括已退出的）的文件合并成
+一个 pstats 格式的 .prof 文件，可以用 python -m pstats 或 snakeviz 查看。
+慢请求日志是 instance/profiles/slow.jsonl，每行一条 JSON，超过 max_log_bytes 时轮转为 slow.jsonl.1。
+"""
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+
+from flask import request
+
+PROFILE_HEADER = "X-Clipboard-Profile"
+TRACE_HEADER = "X-Profile-Trace"
+SLOW_LOG = "slow.jsonl"
+MAX_STATEMENTS = 100  # 每条慢请求记录最多附带的 SQL 条数
+MAX_STATEMENT_CHARS = 1000
+TOP_FUNCTIONS = 20  # 慢请求记录里附带的函数条数（按累计耗时）
+
+
+def route_slug(method, route):
+    """路由 -> 剖析文件名，例如 GET /clipboard/history -> GET_clipboard_history"""
+    return method + "_" + (re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root")
+
+
+def top_functions(profile, limit=TOP_FUNCTIONS):
+    """一次剖析里累计耗时最多的函数"""
+    stats = pstats.Stats(profile, stream=io.StringIO())
+    rows = []
+    for (filename, line, name), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({"function": f"{filename}:{line}({name})", "calls": calls,
+                     "own_ms": round(own * 1000, 3), "cumulative_ms": round(cumulative * 1000, 3)})
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return rows[:limit]
+
+
+class Profiler:
+    def __init__(self, directory, sample_rate=0.0, token=None, slow_ms=0, flush_interval=10,
+                 max_log_bytes=16 * 1024 * 1024):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token or None
+        self.slow_ms = slow_ms
+        self.flush_interval = flush_interval
+        self.max_log_bytes = max_log_bytes
+        self._routes = {}  # slug -> {"route", "method", "requests", "seconds", "stats": pstats.Stats}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._busy = threading.Lock()  # 正在剖析的请求持有
+        self._local = threading.local()
+        self._pid = None
+        self._worker_dir = None
+
+    @classmethod
+    def from_env(cls, directory):
+        return cls(
+            directory,
+            sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+            token=os.environ.get("PROFILE_TOKEN"),
+            slow_ms=float(os.environ.get("PROFILE_SLOW_MS", 0)),
+            flush_interval=float(os.environ.get("PROFILE_FLUSH_INTERVAL", 10)),
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.sample_rate or self.token or self.slow_ms)
+
+    def authorized(self):
+        """当前请求是否带着正确的 PROFILE_TOKEN"""
+        return self.token is not None and request.headers.get(PROFILE_HEADER) == self.token
+
+    # ---- 接入 Flask 和 SQLAlchemy ----
+
+    def init_app(self, app, *engines):
+        """在其他钩子之前注册，剖析和计时覆盖它们（after_request、teardown 按注册的逆序执行）"""
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        if self.slow_ms or self.token:
+            from sqlalchemy import event
+            for engine in engines:
+                event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+                event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_request(self):
+        forced = self.authorized()
+        sampled = forced or (self.sample_rate and random.random() < self.sample_rate)
+        if not (sampled or self.slow_ms):
+            self._local.request = None
+            return
+        state = {"start": time.perf_counter(), "forced": forced, "statements": [], "queries": 0,
+                 "status": None, "profile": None, "trace_id": uuid.uuid4().hex[:16] if forced else None}
+        self._local.request = state
+        if sampled and self._busy.acquire(blocking=False):
+            state["profile"] = cProfile.Profile()
+            state["profile"].enable()
+
+    def _after_request(self, response):
+        state = getattr(self._local, "request", None)
+        if state is not None:
+            state["status"] = response.status_code
+            if state["trace_id"]:
+                response.headers[TRACE_HEADER] = state["trace_id"]
+        return response
+
+    def _teardown_request(self, exc):
+        state = getattr(self._local, "request", None)
+        if state is None:
+            return
+        self._local.request = None
+        profile = state["profile"]
+        if profile is not None:
+            profile.disable()
+            self._busy.release()
+        elapsed = time.perf_counter() - state["start"]
+        method = request.method
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        if profile is not None:
+            self._add_profile(method, route, profile, elapsed)
+        if state["forced"] or (self.slow_ms and elapsed * 1000 >= self.slow_ms):
+            trace = {
+                "id": state["trace_id"] or uuid.uuid4().hex[:16],
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+                "pid": os.getpid(),
+                "method": method,
+                "route": route,
+                "path": request.full_path.rstrip("?")[:500],
+                "status": state["status"] if exc is None else 500,
+                "duration_ms": round(elapsed * 1000, 3),
+                "queries": state["queries"],
+                "sql_ms": round(sum(s["ms"] for s in state["statements"]), 3),
+                "statements": state["statements"],
+            }
+            if profile is not None:
+                trace["functions"] = top_functions(profile)
+            self._log_slow(trace)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("profile_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        state = getattr(self._local, "request", None)
+        if state is None:
+            return
+        state["queries"] += 1
+        if len(state["statements"]) < MAX_STATEMENTS:
+            state["statements"].append({"sql": statement[:MAX_STATEMENT_CHARS], "ms": round(elapsed * 1000, 3),
+                                        "executemany": executemany})
+
+    # ---- 累加和写入 ----
+
+    def _add_profile(self, method, route, profile, elapsed):
+        slug = route_slug(method, route)
+        self._ensure_flusher()
+        with self._lock:
+            entry = self._routes.get(slug)
+            if entry is None:
+                entry = self._routes[slug] = {"route": route, "method": method, "requests": 0, "seconds": 0,
+                                              "stats": pstats.Stats(profile, stream=io.StringIO())}
+            else:
+                entry["stats"].add(profile)
+            entry["requests"] += 1
+            entry["seconds"] += elapsed
+            self._dirty = True
+
+    def _ensure_flusher(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # fork 出来的 worker 不继承父进程的结果，目录名带随机串，pid 被复用时也不会覆盖旧文件
+            self._pid = os.getpid()
+            self._worker_dir = os.path.join(self.directory, f"{self._pid}-{uuid.uuid4().hex[:8]}")
+            self._routes = {}
+            self._dirty = False
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ 写入剖析结果出错: {str(e)}")
+
+    def flush(self):
+        """把本进程每个路由的剖析结果写入 worker 目录"""
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            index = {}
+            data = {}
+            for slug, entry in self._routes.items():
+                index[slug] = {k: entry[k] for k in ("route", "method", "requests", "seconds")}
+                data[slug] = marshal.dumps(entry["stats"].stats)
+        os.makedirs(self._worker_dir, exist_ok=True)
+        for slug, raw in data.items():
+            self._write(os.path.join(self._worker_dir, f"{slug}.prof"), raw)
+        self._write(os.path.join(self._worker_dir, "index.json"), json.dumps(index).encode())
+
+    @staticmethod
+    def _write(path, raw):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(raw)
+        os.replace(tmp, path)
+
+    def _log_slow(self, trace):
+        path = os.path.join(self.directory, SLOW_LOG)
+        line = (json.dumps(trace, ensure_ascii=False) + "\n").encode("utf-8")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if os.path.exists(path) and os.path.getsize(path) + len(line) > self.max_log_bytes:
+                os.replace(path, path + ".1")
+            # O_APPEND 的单次 write，多个 worker 同时追加时行不会交错
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print(f"❌ 写入慢请求记录出错: {str(e)}")
+
+    # ---- 汇总和下载 ----
+
+    def _worker_dirs(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, name) for name in sorted(names)
+                if os.path.isdir(os.path.join(self.directory, name))]
+
+    def summary(self):
+        """所有 worker 的剖析结果，按路由汇总：[{file, route, method, requests, seconds}]"""
+        self.flush()
+        routes = {}
+        for worker_dir in self._worker_dirs():
+            try:
+                with open(os.path.join(worker_dir, "index.json")) as f:
+                    index = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            for slug, entry in index.items():
+                total = routes.setdefault(slug, {"file": f"{slug}.prof", "route": entry["route"],
+                                                 "method": entry["method"], "requests": 0, "seconds": 0})
+                total["requests"] += entry["requests"]
+                total["seconds"] += entry["seconds"]
+        for total in routes.values():
+            total["seconds"] = round(total["seconds"], 6)
+        return sorted(routes.values(), key=lambda entry: entry["seconds"], reverse=True)
+
+    def merged(self, slug):
+        """合并所有 worker 中某个路由的剖析结果，返回 .prof 文件内容，没有时返回 None"""
+        if not re.fullmatch(r"[A-Za-z0-9_]+", slug):
+            return None
+        self.flush()
+        paths = [os.path.join(d, f"{slug}.prof") for d in self._worker_dirs()]
+        paths = [path for path in paths if os.path.exists(path)]
+        if not paths:
+            return None
+        stats = pstats.Stats(*paths, stream=io.StringIO())
+        return marshal.dumps(stats.stats)
+
+    def recent_traces(self, limit=50, trace_id=None):
+        """慢请求日志里最近的 limit 条记录（从新到旧），trace_id 不为空时只返回这一条"""
+        path = os.path.join(self.directory, SLOW_LOG)
+        try:
+            with open(path, "rb") as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return []
+        traces = []
+        for line in reversed(lines):
+            try:
+                trace = json.loads(line)
+            except ValueError:
+                continue
+            if trace_id and trace.get("id") != trace_id:
+                continue
+            traces.append(trace)
+            if len(traces) >= limit:
+                break
+        return traces
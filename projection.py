@@ -0,0 +1,142 @@
+"""热点读接口（/clipboard/latest、/clipboard/history）的投影查询
+
+查询是 Core 层的 select，只取响应需要的列，每种形状（是否按设备筛选、翻页方向、
+是否带完整内容）只构建一次，之后只换绑定参数；结果是普通的行，不创建 ClipboardItem
+对象、不进入 session 的 identity map。响应体直接由这些行拼成 JSON 字符串，
+字符串字段用 json 模块的 C 实现转义，输出和 jsonify 逐字节相同
+（键按字母排序、紧凑分隔符、非 ASCII 字符转义、末尾换行）。
+
+SQLite 的时间列按字符串取出，由 format_timestamp 改写成 isoformat 的格式，
+省去 SQLAlchemy 把字符串解析为 datetime 再格式化回来的开销。
+查询通过 db.session.connection() 执行，只读副本的路由（routing.py）同样生效。
+"""
+from datetime import datetime
+from json.encoder import encode_basestring_ascii as _quote
+from sqlalchemy import String, bindparam, select, tuple_, type_coerce
+
+from models import db, ClipboardItem, ClipboardBlob, blob_file_path
+from pagination import decode_cursor, encode_iso_key
+
+_items = ClipboardItem.__table__
+_blobs = ClipboardBlob.__table__
+_statements = {}  # (数据库类型, 按设备筛选, 翻页方向, 带完整内容) -> select
+
+
+def format_timestamp(value):
+    """数据库里的时间 -> 和 datetime.isoformat() 相同的字符串"""
+    if not isinstance(value, str):
+        return value.isoformat()
+    # SQLite 里存的是 'YYYY-MM-DD HH:MM:SS.ffffff'
+    if len(value) == 26 and value[10] == " ":
+        if value.endswith(".000000"):
+            return value[:10] + "T" + value[11:19]
+        return value[:10] + "T" + value[11:]
+    return datetime.fromisoformat(value).isoformat()
+
+
+def _statement(dialect, by_device, direction, include_content):
+    """direction 为 None（最新一页）、"before" 或 "after"；limit、device_id 和游标都是绑定参数"""
+    key = (dialect, by_device, direction, include_content)
+    stmt = _statements.get(key)
+    if stmt is not None:
+        return stmt
+
+    timestamp = _items.c.timestamp
+    if dialect == "sqlite":
+        timestamp = type_coerce(timestamp, String)
+    columns = [_items.c.id, _items.c.device_id, timestamp.label("timestamp"), _items.c.content_hash]
+    if include_content:
+        columns += [_blobs.c.content, _blobs.c.location]
+    else:
+        columns += [_blobs.c.preview, _blobs.c.size]
+    stmt = select(*columns).select_from(_items.join(_blobs, _blobs.c.hash == _items.c.content_hash))
+    if by_device:
+        stmt = stmt.where(_items.c.device_id == bindparam("device_id"))
+
+    key_columns = tuple_(_items.c.timestamp, _items.c.id)
+    cursor = tuple_(bindparam("cursor_timestamp", type_=_items.c.timestamp.type), bindparam("cursor_id"))
+    if direction == "after":
+        stmt = stmt.where(key_columns > cursor).order_by(_items.c.timestamp.asc(), _items.c.id.asc())
+    else:
+        if direction == "before":
+            stmt = stmt.where(key_columns < cursor)
+        stmt = stmt.order_by(_items.c.timestamp.desc(), _items.c.id.desc())
+    stmt = stmt.limit(bindparam("limit"))
+    _statements[key] = stmt
+    return stmt
+
+
+def _fetch(device_id, limit, direction=None, cursor=None, include_content=False):
+    conn = db.session.connection()
+    stmt = _statement(conn.dialect.name, bool(device_id), direction, include_content)
+    params = {"limit": limit}
+    if device_id:
+        params["device_id"] = device_id
+    if cursor is not None:
+        params["cursor_timestamp"], params["cursor_id"] = cursor
+    return conn.execute(stmt, params).all()
+
+
+def row_cursor(row):
+    return encode_iso_key(format_timestamp(row.timestamp), row.id)
+
+
+def _json_value(value):
+    return "null" if value is None else _quote(value)
+
+
+def _read_content(row):
+    if row.location:
+        with open(blob_file_path(row.location), encoding="utf-8") as f:
+            return f.read()
+    return row.content
+
+
+def item_json(row):
+    """一条完整记录，字段与 item_to_dict 相同"""
+    return '{"content":%s,"content_hash":%s,"device_id":%s,"id":%d,"timestamp":%s}' % (
+        _quote(_read_content(row)), _quote(row.content_hash), _quote(row.device_id),
+        row.id, _quote(format_timestamp(row.timestamp)))
+
+
+def summary_json(row):
+    """一条记录的摘要，字段与 summary_dict 相同"""
+    preview = row.preview or ""
+    truncated = "true" if row.size > len(preview.encode("utf-8")) else "false"
+    return '{"content_hash":%s,"device_id":%s,"id":%d,"preview":%s,"size":%d,"timestamp":%s,"truncated":%s}' % (
+        _quote(row.content_hash), _quote(row.device_id), row.id, _quote(preview), row.size,
+        _quote(format_timestamp(row.timestamp)), truncated)
+
+
+def latest_json(device_id):
+    """返回设备最新一条记录的 (id, 响应体 bytes)，没有记录时返回 None"""
+    rows = _fetch(device_id, 1, include_content=True)
+    if not rows:
+        return None
+    return rows[0].id, (item_json(rows[0]) + "\n").encode("utf-8")
+
+
+def history_json(device_id, limit, before=None, after=None, include_content=False):
+    """历史记录一页的响应体（bytes），游标格式错误时抛出 ValueError
+
+    翻页规则和 pagination.paginate 相同：items 总是从新到旧，after 时 next_cursor
+    继续向更新的方向，没有更新的记录时原样返回 after。
+    """
+    if after:
+        rows = _fetch(device_id, limit, "after", decode_cursor(after), include_content)
+        rows.reverse()
+        next_row = rows[0] if rows else None
+    else:
+        cursor = decode_cursor(before) if before else None
+        rows = _fetch(device_id, limit, "before" if before else None, cursor, include_content)
+        next_row = rows[-1] if len(rows) == limit else None
+    if after and next_row is None:
+        next_cursor = after
+    else:
+        next_cursor = row_cursor(next_row) if next_row else None
+
+    encode = item_json if include_content else summary_json
+    newest_cursor = row_cursor(rows[0]) if rows else after
+    return ('{"items":[%s],"newest_cursor":%s,"next_cursor":%s}\n' % (
+        ",".join(encode(row) for row in rows), _json_value(newest_cursor), _json_value(next_cursor)
+    )).encode("utf-8")
@@ -0,0 +1,131 @@
+"""令牌桶限流，所有 gunicorn worker 共享同一组桶
+
+桶的状态放在 instance 目录下的一个定长文件里，每个 worker 把它 mmap 到内存，
+检查时对文件加 flock 互斥，一次检查只是几次内存读写，不访问数据库。
+第一个槽位固定给全局的桶，设备的桶按哈希做开放寻址；槽位用完时覆盖附近最久没有用过的桶
+（相当于这个设备重新开始计数）。
+
+每个桶以 rate 个/秒的速度补充令牌，最多攒 burst 个；请求消耗一个令牌。
+被拒绝的请求不消耗令牌，返回还要等待多少秒才会有令牌（用作 Retry-After）。
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows：本地只有一个进程，进程内的锁就够了
+    fcntl = None
+
+SLOT = struct.Struct("<16sdd")  # 键的哈希、剩余令牌、上次更新时间
+PROBE = 32  # 开放寻址时最多向后查找的槽位数
+
+GLOBAL_KEY = "__global__"
+
+
+class RateLimiter:
+    def __init__(self, path, rate=0, burst=0, global_rate=0, global_burst=0, slots=4096):
+        """rate/global_rate 为 0 时不限制对应的桶"""
+        self.path = path
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.global_rate = global_rate
+        self.global_burst = max(global_burst, 1)
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._map = None
+
+    @classmethod
+    def from_env(cls, path):
+        return cls(
+            path,
+            # 默认不限流，和保留策略、剖析等其他按环境变量开启的功能一样需要显式打开
+            rate=float(os.environ.get("RATE_LIMIT_PER_DEVICE", 0)),
+            burst=int(os.environ.get("RATE_LIMIT_DEVICE_BURST", 20)),
+            global_rate=float(os.environ.get("RATE_LIMIT_GLOBAL", 0)),
+            global_burst=int(os.environ.get("RATE_LIMIT_GLOBAL_BURST", 200)),
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.rate or self.global_rate)
+
+    def _open(self):
+        # flock 属于打开的文件，fork 出来的 worker 共用父进程打开的文件时互相不排斥，每个进程自己打开
+        if self._pid == os.getpid():
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        size = SLOT.size * self.slots
+        self._file = open(self.path, "a+b")
+        if os.fstat(self._file.fileno()).st_size < size:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._pid = os.getpid()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            self._open()
+            if fcntl:
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def _find(self, key):
+        """返回 (槽位偏移, 键的哈希, 令牌, 更新时间)；新键返回空槽或要覆盖的旧槽，令牌为 None"""
+        digest = hashlib.md5(key.encode("utf-8")).digest()
+        if key == GLOBAL_KEY:
+            _, tokens, updated = SLOT.unpack_from(self._map, 0)
+            return 0, digest, (tokens if updated else None), updated
+        start = int.from_bytes(digest[:8], "little") % (self.slots - 1)
+        oldest = None
+        for i in range(PROBE):
+            offset = ((start + i) % (self.slots - 1) + 1) * SLOT.size
+            slot_key, tokens, updated = SLOT.unpack_from(self._map, offset)
+            if slot_key == digest:
+                return offset, digest, tokens, updated
+            if updated == 0:
+                return offset, digest, None, 0
+            if oldest is None or updated < oldest[1]:
+                oldest = (offset, updated)
+        return oldest[0], digest, None, 0
+
+    def acquire(self, device_id):
+        """为 device_id 的一个请求取令牌；成功返回 0，否则返回需要等待的秒数"""
+        buckets = []
+        if self.global_rate:
+            buckets.append((GLOBAL_KEY, self.global_rate, self.global_burst))
+        if self.rate:
+            buckets.append((f"device:{device_id}", self.rate, self.burst))
+        if not buckets:
+            return 0
+
+        with self._locked():
+            now = time.time()
+            states = []
+            wait = 0
+            for key, rate, burst in buckets:
+                offset, digest, tokens, updated = self._find(key)
+                if tokens is None:
+                    tokens = burst
+                else:
+                    tokens = min(burst, tokens + max(now - updated, 0) * rate)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+                states.append((offset, digest, tokens))
+            if wait:
+                return wait
+            for offset, digest, tokens in states:
+                SLOT.pack_into(self._map, offset, digest, tokens - 1, now)
+            return 0
@@ -0,0 +1,209 @@
+"""历史记录保留策略和后台清理任务
+
+支持三种限制（为 0 表示不限制）：
+- 每个设备最多保留的条数
+- 记录的最长保留时间
+- 所有内容的总大小
+
+清理任务在后台线程中分批执行，每批删除一小部分记录并单独提交事务，
+批次之间让出时间，不会长时间占住数据库锁而拖慢请求。多个 gunicorn worker
+各自启动清理线程，但用文件锁保证同一时刻只有一个在工作。
+开启归档时，被删除的记录先写入归档分段文件，历史接口仍可查到。
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from models import db, ClipboardBlob, ClipboardItem, with_content
+from storage import delete_items
+from db import begin_write
+
+try:
+    import fcntl
+except ImportError:  # Windows：本地只有一个进程
+    fcntl = None
+
+
+class RetentionPolicy:
+    def __init__(self, max_items_per_device=0, max_age_days=0, max_total_bytes=0,
+                 batch_size=500, interval=300, max_batches_per_run=20):
+        self.max_items_per_device = max_items_per_device
+        self.max_age_days = max_age_days
+        self.max_total_bytes = max_total_bytes
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_batches_per_run = max_batches_per_run
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_items_per_device=int(os.environ.get("RETENTION_MAX_ITEMS_PER_DEVICE", 0)),
+            max_age_days=float(os.environ.get("RETENTION_MAX_AGE_DAYS", 0)),
+            max_total_bytes=int(os.environ.get("RETENTION_MAX_TOTAL_BYTES", 0)),
+            batch_size=int(os.environ.get("RETENTION_BATCH_SIZE", 500)),
+            interval=float(os.environ.get("RETENTION_INTERVAL", 300)),
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.max_items_per_device or self.max_age_days or self.max_total_bytes)
+
+
+def archive_record(item):
+    return {
+        "id": item.id,
+        "content": item.content,
+        "content_hash": item.content_hash,
+        "device_id": item.device_id,
+        "timestamp": item.timestamp.isoformat(timespec="microseconds"),
+    }
+
+
+class Pruner:
+    def __init__(self, app, policy, archive=None, on_deleted=None, pause=0.05):
+        self.app = app
+        self.policy = policy
+        self.archive = archive
+        self.on_deleted = on_deleted  # 回调，参数为受影响的设备ID集合
+        self.pause = pause  # 批次之间的间隔（秒）
+        self._lock_path = os.path.join(app.instance_path, ".retention.lock")
+        self._thread = None
+
+    def start(self):
+        if not self.policy.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.policy.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ 清理历史记录出错: {str(e)}")
+
+    def run_once(self):
+        """执行一轮清理，返回删除的记录数；其他进程正在清理时直接返回 0"""
+        os.makedirs(self.app.instance_path, exist_ok=True)
+        with open(self._lock_path, "w") as lock_file:
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return 0
+            with self.app.app_context():
+                try:
+                    return self._prune()
+                finally:
+                    db.session.remove()
+
+    def _prune(self):
+        deleted = 0
+        for _ in range(self.policy.max_batches_per_run):
+            begin_write()
+            ids = self._next_batch()
+            if not ids:
+                break
+            deleted += self._delete(ids)
+            time.sleep(self.pause)
+        return deleted
+
+    def _next_batch(self):
+        """按优先级找出下一批应删除的记录ID"""
+        policy = self.policy
+        limit = policy.batch_size
+
+        if policy.max_age_days:
+            cutoff = datetime.utcnow() - timedelta(days=policy.max_age_days)
+            ids = db.session.execute(
+                db.select(ClipboardItem.id)
+                .where(ClipboardItem.timestamp < cutoff)
+                .order_by(ClipboardItem.timestamp, ClipboardItem.id)
+                .limit(limit)
+            ).scalars().all()
+            if ids:
+                return ids
+
+        if policy.max_items_per_device:
+            devices = db.session.execute(
+                db.select(ClipboardItem.device_id)
+                .group_by(ClipboardItem.device_id)
+                .having(func.count() > policy.max_items_per_device)
+                .limit(limit)
+            ).scalars().all()
+            ids = []
+            for device_id in devices:
+                # 走 (device_id, timestamp, id) 索引，跳过最新的 N 条
+                ids += db.session.execute(
+                    db.select(ClipboardItem.id)
+                    .where(ClipboardItem.device_id == device_id)
+                    .order_by(ClipboardItem.timestamp.desc(), ClipboardItem.id.desc())
+                    .offset(policy.max_items_per_device)
+                    .limit(limit - len(ids))
+                ).scalars().all()
+                if len(ids) >= limit:
+                    break
+            if ids:
+                return ids
+
+        if policy.max_total_bytes:
+            total = db.session.execute(db.select(func.coalesce(func.sum(ClipboardBlob.size), 0))).scalar()
+            if total > policy.max_total_bytes:
+                return self._bytes_batch(total - policy.max_total_bytes, limit)
+
+        return []
+
+    def _bytes_batch(self, excess, limit):
+        """总大小超出 excess 字节时要删除的记录：只删除能释放内容的记录，够用即止
+
+        内容被多条记录共享时，删除其中一条不会释放任何空间，所以优先删除独占内容
+        （refcount 为 1）的最旧记录，累计释放的大小达到 excess 就停止。
+        """
+        rows = db.session.execute(
+            db.select(ClipboardItem.id, ClipboardBlob.size)
+            .join(ClipboardBlob, ClipboardBlob.hash == ClipboardItem.content_hash)
+            .where(ClipboardBlob.refcount == 1)
+            .order_by(ClipboardItem.timestamp, ClipboardItem.id)
+            .limit(limit)
+        ).all()
+        ids = []
+        freed = 0
+        for item_id, size in rows:
+            ids.append(item_id)
+            freed += size
+            if freed >= excess:
+                break
+        if ids:
+            return ids
+
+        # 剩下的内容都被多条记录共享：删除最旧记录的内容的所有引用，这份内容才会释放
+        digest = db.session.execute(
+            db.select(ClipboardItem.content_hash)
+            .order_by(ClipboardItem.timestamp, ClipboardItem.id)
+            .limit(1)
+        ).scalar()
+        if digest is None:
+            return []
+        return db.session.execute(
+            db.select(ClipboardItem.id)
+            .where(ClipboardItem.content_hash == digest)
+            .order_by(ClipboardItem.timestamp, ClipboardItem.id)
+            .limit(limit)
+        ).scalars().all()
+
+    def _delete(self, ids):
+        query = ClipboardItem.query.filter(ClipboardItem.id.in_(ids))
+        items = (query.options(with_content()) if self.archive else query).all()
+        if self.archive:
+            # 先写归档再删除：中途失败最多在归档里留下重复记录，不会丢数据
+            self.archive.append([archive_record(item) for item in items])
+        devices = {item.device_id for item in items}
+        delete_items(items)
+        db.session.commit()
+        if self.on_deleted:
+            self.on_deleted(devices)
+        return len(items)
@@ -0,0 +1,66 @@
+"""只读接口的读写分离
+
+配置了 DATABASE_REPLICA_URL 时，页面、最新内容和历史记录这几个只读接口在请求开始时
+调用 ReadRouter.route，之后这个请求里的查询都发往副本；写入和其他接口始终使用主库。
+
+副本会落后主库一点，为了让设备总能读到自己刚上传的内容，ReadRouter 监听 broker
+的新记录和删除通知（所有 worker 都会收到），某个设备写入后 max_lag 秒内，
+带这个 device_id 的读取仍然走主库；不区分设备的读取（页面、全局历史）在任何设备
+写入后的 max_lag 秒内都走主库，页面缓存也就不会存下副本上的旧结果。
+"""
+import threading
+import time
+
+from flask_sqlalchemy.session import Session
+
+from config import REPLICA_BIND
+
+MAX_TRACKED_DEVICES = 10000  # 超过后清理已经过了 max_lag 的设备
+
+
+class RoutingSession(Session):
+    """session.info["replica"] 为真时，查询使用副本的引擎；flush 总是写主库"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get("replica") and not self._flushing:
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReadRouter:
+    def __init__(self, db, broker, max_lag=5, enabled=False):
+        self.db = db
+        self.max_lag = max_lag
+        self.enabled = enabled
+        self._writes = {}  # device_id -> 最近一次写入的时间
+        self._last_write = 0
+        self._lock = threading.Lock()
+        if enabled:
+            broker.add_listener(self._on_message)
+
+    def _on_message(self, message):
+        device_id = message.get("device_id")
+        if not device_id:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._writes[device_id] = now
+            self._last_write = now
+            if len(self._writes) > MAX_TRACKED_DEVICES:
+                self._writes = {d: t for d, t in self._writes.items() if now - t < self.max_lag}
+
+    def needs_primary(self, device_id=None):
+        """副本可能还没有 device_id（为空时为任意设备）最近写入的内容"""
+        now = time.monotonic()
+        with self._lock:
+            written = self._writes.get(device_id, 0) if device_id else self._last_write
+        return now - written < self.max_lag
+
+    def route(self, device_id=None):
+        """在请求的第一条 SQL 之前调用，返回这个请求是否读副本"""
+        if not self.enabled or self.needs_primary(device_id):
+            return False
+        self.db.session.info["replica"] = True
+        return True
@@ -0,0 +1,277 @@
+"""剪贴板历史的全文搜索
+
+SQLite 使用 FTS5 外部内容表 clipboard_fts（由迁移 4 创建，触发器在新增和删除记录时同步），
+PostgreSQL 使用 tsvector GIN 表达式索引。存为文件的内容在数据库里 content 为空，
+写入文件时按段读出全文写入 clipboard_blob_fts（迁移 9），每个内容只索引一次。
+结果按相关度排序，只返回高亮的片段而不是完整内容。
+
+trigram 分词要求每个词至少 3 个字符，更短的查询退回到 LIKE 子串匹配，
+按时间从新到旧排列。翻页用不透明的偏移量游标，深度有上限。
+"""
+import base64
+import codecs
+import json
+from sqlalchemy import text, Integer, String, Text, DateTime
+
+from models import db
+
+HIGHLIGHT_START = "【"
+HIGHLIGHT_END = "】"
+ELLIPSIS = "…"
+SNIPPET_TOKENS = 24  # SQLite snippet() 片段的最大词数（trigram 下约为字符数）
+SNIPPET_CHARS = 80   # LIKE 回退时片段的字符数
+MAX_OFFSET = 1000    # 相关度排序无法用键集翻页，限制最大翻页深度
+BLOB_CHUNK_BYTES = 1 << 20  # 存为文件的内容按段建索引，每段从文件读取的字节数
+BLOB_CHUNK_OVERLAP = 256    # 相邻两段重叠的字符数，跨越分段处的短语也能匹配
+
+# clipboard_fts 和 PostgreSQL 表达式索引索引的内容（迁移中使用同一个表达式）
+INDEXED_CONTENT = "clipboard_blob.content"
+# 没有全文索引可用时（LIKE 回退、PostgreSQL 的高亮片段），存为文件的内容用预览代替
+SEARCHABLE_CONTENT = ("CASE WHEN clipboard_blob.location IS NULL "
+                      "THEN clipboard_blob.content ELSE clipboard_blob.preview END")
+
+RESULT_COLUMNS = dict(id=Integer, device_id=String, timestamp=DateTime, snippet=Text)
+
+
+def encode_offset(offset):
+    return base64.urlsafe_b64encode(json.dumps({"o": offset}).encode()).decode().rstrip("=")
+
+
+def decode_offset(cursor):
+    """解析搜索游标，格式错误时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        offset = int(json.loads(raw)["o"])
+    except (TypeError, ValueError, KeyError) as e:
+        raise ValueError("Invalid cursor") from e
+    if offset < 0 or offset > MAX_OFFSET:
+        raise ValueError("Invalid cursor")
+    return offset
+
+
+_tokenizer = None
+
+
+def sqlite_tokenizer():
+    """返回 clipboard_fts 使用的分词器（trigram 或 unicode61）"""
+    global _tokenizer
+    if _tokenizer is None:
+        sql = db.session.execute(
+            text("SELECT sql FROM sqlite_master WHERE name = 'clipboard_fts'")
+        ).scalar() or ""
+        _tokenizer = "trigram" if "trigram" in sql else "unicode61"
+    return _tokenizer
+
+
+def fts_query(terms):
+    """把用户输入的词转成 FTS5 查询：每个词作为短语加引号，多个词之间为 AND"""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def file_chunks(path):
+    """按段读出文件内容，相邻两段重叠 BLOB_CHUNK_OVERLAP 个字符，不把整个文件读进内存"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    tail = ""
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(BLOB_CHUNK_BYTES)
+            chunk = decoder.decode(block, final=not block)
+            if chunk:
+                yield tail + chunk
+                tail = (tail + chunk)[-BLOB_CHUNK_OVERLAP:]
+            if not block:
+                return
+
+
+def index_blob_file(conn, digest, path):
+    """把存为文件的内容按段写入 clipboard_blob_fts（和写入内容行在同一个事务里）"""
+    if conn.dialect.name == "postgresql":
+        sql = text("INSERT INTO clipboard_blob_fts (hash, document) VALUES (:hash, to_tsvector('simple', :chunk))")
+    elif conn.dialect.name == "sqlite":
+        sql = text("INSERT INTO clipboard_blob_fts (hash, content) VALUES (:hash, :chunk)")
+    else:
+        return
+    for chunk in file_chunks(path):
+        conn.execute(sql, {"hash": digest, "chunk": chunk})
+
+
+def unindex_blobs(conn, digests):
+    """删除内容时一并删除它们的分段索引"""
+    if digests and conn.dialect.name in ("postgresql", "sqlite"):
+        conn.execute(text("DELETE FROM clipboard_blob_fts WHERE hash = :hash"),
+                     [{"hash": digest} for digest in digests])
+
+
+def search_items(query, device_id=None, limit=20, offset=0):
+    """返回 (results, has_more)，results 为包含 id、device_id、timestamp、snippet 的字典列表"""
+    terms = query.split()
+    if not terms:
+        return [], False
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        rows = _search_postgresql(query, device_id, limit + 1, offset)
+    elif dialect == "sqlite" and not (sqlite_tokenizer() == "trigram" and min(map(len, terms)) < 3):
+        rows = _search_sqlite(terms, device_id, limit + 1, offset)
+    else:
+        rows = _search_like(terms, device_id, limit + 1, offset)
+
+    results = [{
+        "id": row.id,
+        "device_id": row.device_id,
+        "timestamp": row.timestamp.isoformat(),
+        "snippet": row.snippet,
+    } for row in rows[:limit]]
+    return results, len(rows) > limit
+
+
+def _search_sqlite(terms, device_id, limit, offset):
+    # 数据库里的内容按记录索引在 clipboard_fts 中，存为文件的内容按段索引在 clipboard_blob_fts 中，
+    # 同一内容的多段都匹配时取相关度最高的一段，两部分合在一起按相关度排序；
+    # snippet() 不能用在聚合查询里，分段的片段在取出这一页之后按 rowid 计算
+    device_filter = "AND clipboard_item.device_id = :device_id" if device_id else ""
+    sql = text(f"""
+        SELECT page.id, page.device_id, page.timestamp,
+               COALESCE(page.snippet, (
+                   SELECT snippet(clipboard_blob_fts, 0, :start, :end, :ellipsis, :tokens)
+                   FROM clipboard_blob_fts
+                   WHERE clipboard_blob_fts MATCH :query AND clipboard_blob_fts.rowid = page.chunk
+               )) AS snippet
+        FROM (
+            SELECT clipboard_item.id, clipboard_item.device_id, clipboard_item.timestamp,
+                   snippet(clipboard_fts, 0, :start, :end, :ellipsis, :tokens) AS snippet,
+                   NULL AS chunk, clipboard_fts.rank AS rank
+            FROM clipboard_fts
+            JOIN clipboard_item ON clipboard_item.id = clipboard_fts.rowid
+            WHERE clipboard_fts MATCH :query {device_filter}
+            UNION ALL
+            SELECT clipboard_item.id, clipboard_item.device_id, clipboard_item.timestamp,
+                   NULL, blob_match.chunk, blob_match.rank
+            FROM (
+                SELECT hash, rowid AS chunk, MIN(rank) AS rank
+                FROM clipboard_blob_fts
+                WHERE clipboard_blob_fts MATCH :query
+                GROUP BY hash
+            ) AS blob_match
+            JOIN clipboard_item ON clipboard_item.content_hash = blob_match.hash {device_filter}
+            ORDER BY rank, id DESC
+            LIMIT :limit OFFSET :offset
+        ) AS page
+        ORDER BY page.rank, page.id DESC
+    """).columns(**RESULT_COLUMNS)
+    return db.session.execute(sql, {
+        "query": fts_query(terms), "device_id": device_id,
+        "start": HIGHLIGHT_START, "end": HIGHLIGHT_END, "ellipsis": ELLIPSIS, "tokens": SNIPPET_TOKENS,
+        "limit": limit, "offset": offset,
+    }).all()
+
+
+def _search_postgresql(query, device_id, limit, offset):
+    # 先在内层按相关度取出这一页，ts_headline 只对这一页的内容计算；
+    # 存为文件的内容匹配的是 clipboard_blob_fts 中的分段，片段从预览中截取
+    device_filter = "AND clipboard_item.device_id = :device_id" if device_id else ""
+    sql = text(f"""
+        SELECT page.id, page.device_id, page.timestamp,
+               ts_headline('simple', {SEARCHABLE_CONTENT}, plainto_tsquery('simple', :query), :options) AS snippet
+        FROM (
+            SELECT clipboard_item.id, clipboard_item.device_id, clipboard_item.timestamp,
+                   clipboard_item.content_hash,
+                   GREATEST(
+                       ts_rank(to_tsvector('simple', {INDEXED_CONTENT}), plainto_tsquery('simple', :query)),
+                       COALESCE((SELECT MAX(ts_rank(document, plainto_tsquery('simple', :query)))
+                                 FROM clipboard_blob_fts
+                                 WHERE clipboard_blob_fts.hash = clipboard_blob.hash), 0)
+                   ) AS rank
+            FROM clipboard_item
+            JOIN clipboard_blob ON clipboard_blob.hash = clipboard_item.content_hash
+            WHERE (to_tsvector('simple', {INDEXED_CONTENT}) @@ plainto_tsquery('simple', :query)
+                   OR clipboard_blob.hash IN (SELECT hash FROM clipboard_blob_fts
+                                              WHERE document @@ plainto_tsquery('simple', :query)))
+                  {device_filter}
+            ORDER BY rank DESC, clipboard_item.id DESC
+            LIMIT :limit OFFSET :offset
+        ) AS page
+        JOIN clipboard_blob ON clipboard_blob.hash = page.content_hash
+        ORDER BY page.rank DESC, page.id DESC
+    """).columns(**RESULT_COLUMNS)
+    options = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, MaxWords=20, MinWords=5"
+    return db.session.execute(sql, {
+        "query": query, "device_id": device_id, "options": options,
+        "limit": limit, "offset": offset,
+    }).all()
+
+
+def _escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class _Row:
+    def __init__(self, id, device_id, timestamp, snippet):
+        self.id = id
+        self.device_id = device_id
+        self.timestamp = timestamp
+        self.snippet = snippet
+
+
+def _search_like(terms, device_id, limit, offset):
+    """短查询的回退：子串匹配，按时间从新到旧，片段在 Python 里截取
+
+    SQLite 上存为文件的内容在 clipboard_blob_fts 的分段中匹配，片段取自第一个匹配的分段；
+    其他数据库只匹配它的预览。
+    """
+    searchable = SEARCHABLE_CONTENT
+    conditions = [f"{SEARCHABLE_CONTENT} LIKE :term{i} ESCAPE '\\'" for i in range(len(terms))]
+    if db.session.get_bind().dialect.name == "sqlite":
+        conditions = [
+            f"({condition} OR clipboard_blob.hash IN (SELECT hash FROM clipboard_blob_fts "
+            f"WHERE content LIKE :term{i} ESCAPE '\\'))"
+            for i, condition in enumerate(conditions)
+        ]
+        searchable = (f"COALESCE((SELECT content FROM clipboard_blob_fts WHERE hash = clipboard_blob.hash "
+                      f"AND content LIKE :term0 ESCAPE '\\' LIMIT 1), {SEARCHABLE_CONTENT})")
+    device_filter = "AND clipboard_item.device_id = :device_id" if device_id else ""
+    sql = text(f"""
+        SELECT clipboard_item.id, clipboard_item.device_id, clipboard_item.timestamp,
+               {searchable} AS snippet
+        FROM clipboard_item
+        JOIN clipboard_blob ON clipboard_blob.hash = clipboard_item.content_hash
+        WHERE {" AND ".join(conditions)} {device_filter}
+        ORDER BY clipboard_item.timestamp DESC, clipboard_item.id DESC
+        LIMIT :limit OFFSET :offset
+    """).columns(**RESULT_COLUMNS)
+    params = {f"term{i}": f"%{_escape_like(term)}%" for i, term in enumerate(terms)}
+    params.update(device_id=device_id, limit=limit, offset=offset)
+    return [_Row(row.id, row.device_id, row.timestamp, make_snippet(row.snippet, terms))
+            for row in db.session.execute(sql, params)]
+
+
+def make_snippet(content, terms):
+    """截取第一个匹配词附近的一段内容，并高亮其中出现的所有查询词"""
+    lowered = content.lower()
+    positions = [p for p in (lowered.find(term.lower()) for term in terms) if p >= 0]
+    first = min(positions) if positions else 0
+    start = max(0, first - SNIPPET_CHARS // 4)
+    end = min(len(content), start + SNIPPET_CHARS)
+    window = content[start:end]
+
+    lowered_window = window.lower()
+    marks = []
+    for term in terms:
+        term = term.lower()
+        pos = lowered_window.find(term)
+        while pos >= 0:
+            marks.append((pos, pos + len(term)))
+            pos = lowered_window.find(term, pos + len(term))
+    marks.sort()
+
+    parts = [ELLIPSIS] if start > 0 else []
+    cursor = 0
+    for mark_start, mark_end in marks:
+        if mark_start < cursor:
+            continue
+        parts += [window[cursor:mark_start], HIGHLIGHT_START, window[mark_start:mark_end], HIGHLIGHT_END]
+        cursor = mark_end
+    parts.append(window[cursor:])
+    if end < len(content):
+        parts.append(ELLIPSIS)
+    return "".join(parts)
@@ -0,0 +1,90 @@
+"""客户端的本地待上传队列
+
+复制的内容先写入本地 SQLite 文件，再由上传线程按顺序发送到服务器。
+服务器不可达时内容留在队列里，恢复后批量补传；程序重启也不会丢失。
+每条内容带一个 client_id，服务器据此识别重试，避免重复写入。
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+def default_spool_path():
+    return os.environ.get(
+        "CLIPBOARD_SPOOL_PATH",
+        os.path.join(os.path.expanduser("~"), ".clipboard_sync", "spool.db")
+    )
+
+
+class Spool:
+    def __init__(self, path=None):
+        self.path = path or default_spool_path()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "client_id TEXT NOT NULL, "
+            "content TEXT NOT NULL, "
+            "created_at REAL NOT NULL)"
+        )
+        # 客户端的其他持久状态（例如变更流的游标），和队列放在同一个文件里
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def enqueue(self, content):
+        """加入队列，返回分配的 client_id"""
+        client_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO spool (client_id, content, created_at) VALUES (?, ?, ?)",
+                (client_id, content, time.time())
+            )
+        return client_id
+
+    def peek(self, limit):
+        """按入队顺序返回最早的 limit 条 (seq, client_id, content)"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT seq, client_id, content FROM spool ORDER BY seq LIMIT ?", (limit,)
+            ).fetchall()
+
+    def remove(self, seqs):
+        if not seqs:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("DELETE FROM spool WHERE seq = ?", [(seq,) for seq in seqs])
+            self._conn.execute("COMMIT")
+
+    def coalesce(self, since):
+        """把 since（time.time()）之后入队的内容合并为其中最新的一条，返回删除的条数"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM spool WHERE created_at >= ? "
+                "AND seq < (SELECT MAX(seq) FROM spool WHERE created_at >= ?)",
+                (since, since)
+            )
+            return cursor.rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def get_state(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_state(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO state (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, str(value))
+            )
@@ -1,3 +1,16 @@
+"""一键启动服务器、剪贴板监控和历史记录查看
+
+默认使用嵌入模式：服务器和 ClipboardSync 客户端运行在同一个进程里，查看历史记录
+也在本进程内完成，和客户端共用服务器地址、连接和本地历史副本。浏览器和局域网里的
+其他设备仍然通过 HTTP 端口访问本地服务器。
+
+客户端和原来一样同步到云服务器（SERVER_HOST 等环境变量，见 upload.py 的 ServerConfig），
+通过 HTTP 跨设备同步。加上 --local，或者 SERVER_HOST 指向本机的这个端口时，客户端同步到
+本进程里的服务器，改用 LocalTransport 直接调用 Flask 应用，不经过回环网络。
+Flask、SQLAlchemy 在后台线程里导入，和客户端的导入（requests 等）同时进行。
+
+加上 --subprocess 时使用原来的方式：服务器、客户端和历史查看各自是一个子进程。
+"""
 import subprocess
 import sys
 import time
@@ -5,22 +18,26 @@ import os
 import signal
 import threading
 import webbrowser
+import argparse
+from urllib.parse import urlsplit
+
+PORT = int(os.environ.get('PORT', 5001))
 
 def run_server():
     """运行服务器"""
     print("🚀 启动服务器...")
     return subprocess.Popen([sys.executable, "app.py"])
 
-def run_client():
+def run_client(local=False):
     """运行客户端"""
     print("📋 启动剪贴板监控...")
-    return subprocess.Popen([sys.executable, "upload.py"])
+    return subprocess.Popen([sys.executable, "upload.py"] + (["--local"] if local else []))
 
-def open_browser():
+def open_browser(delay=2):
     """打开浏览器查看历史记录"""
-    time.sleep(2)  # 等待服务器启动
+    time.sleep(delay)  # 等待服务器启动
     print("🌐 打开历史记录查看器...")
-    webbrowser.open("http://127.0.0.1:5001")
+    webbrowser.open(f"http://127.0.0.1:{PORT}")
 
 def show_menu():
     """显示菜单"""
@@ -29,37 +46,106 @@ def show_menu():
     print("2. 退出程序")
     print("提示: 按Ctrl+C退出程序")
 
-def view_clipboard_history():
-    """查看剪贴板历史"""
-    subprocess.run([sys.executable, "view_history.py"])
+def view_clipboard_history(local=False):
+    """查看剪贴板历史，和客户端连接同一个服务器"""
+    subprocess.run([sys.executable, "view_history.py"] + (["--local"] if local else []))
 
-def main():
+def load_app():
+    from app import app
+    return app
+
+def serve_http(app):
+    """在后台线程里提供 HTTP 端口，端口被占用时返回 None"""
+    from werkzeug.serving import make_server
+    try:
+        server = make_server("0.0.0.0", PORT, app, threaded=True)
+    except OSError as e:
+        print(f"⚠️ 无法监听端口 {PORT}（{e}），浏览器和其他设备暂时无法访问")
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def is_local_url(url):
+    """url 是否指向本机上这个进程提供的端口"""
+    parts = urlsplit(url)
+    return parts.hostname in ("127.0.0.1", "localhost", "::1") and (parts.port or 80) == PORT
+
+def start_embedded(browser=True, local=False):
+    """在本进程内启动服务器和客户端，返回 (客户端, 进程内传输层, HTTP 服务器)
+
+    local 为真或云服务器地址指向本机时客户端同步到本进程里的服务器，否则通过 HTTP 同步到云服务器
+    """
+    started = time.perf_counter()
+    print("🚀 启动服务器和剪贴板监控（单进程）...")
+    from local_transport import LocalTransport
+    transport = LocalTransport(load_app)
+    transport.preload()
+
+    from upload import ClipboardSync, ServerConfig
+    if local or is_local_url(ServerConfig.get_server_url('cloud')):
+        client = ClipboardSync('local', http=transport)
+    else:
+        client = ClipboardSync('cloud')
+    threading.Thread(target=client.start, daemon=True).start()
+
+    # 客户端的第一个请求也在等应用加载完成，这里只是为了提示启动用时和提供 HTTP 端口
+    transport.wait_ready()
+    print(f"✅ 服务器已就绪，用时 {time.perf_counter() - started:.2f} 秒")
+    server = serve_http(transport.app)
+    if server and browser:
+        threading.Thread(target=open_browser, args=(0,), daemon=True).start()
+    return client, transport, server
+
+def menu_loop(view):
+    while True:
+        show_menu()
+        try:
+            choice = input("\n请选择操作 (1-2): ").strip()
+            if choice == "1":
+                view()
+            elif choice == "2":
+                raise KeyboardInterrupt
+            else:
+                print("❌ 无效的选择，请重试")
+        except ValueError:
+            print("❌ 请输入有效的数字")
+
+        time.sleep(0.5)
+
+def main_embedded(browser=True, local=False):
+    try:
+        client, transport, server = start_embedded(browser, local)
+    except Exception as e:
+        print(f"❌ 启动失败: {str(e)}")
+        return
+
+    from view_history import view_history
+    try:
+        # 和客户端用同一个服务器地址和连接，读的是客户端在后台同步的那个历史副本
+        menu_loop(lambda: view_history(http=client.http, server_url=client.server_url))
+    except (KeyboardInterrupt, EOFError):
+        print("\n\n正在关闭程序...")
+        if server:
+            server.shutdown()
+        stats = client.http.stats()
+        print(f"📊 客户端共发送 {stats['requests']} 个请求，"
+              f"跳过回传同步来的内容 {client.watcher.suppressed} 次")
+        print("👋 程序已退出")
+
+def main_subprocess(browser=True, local=False):
     # 启动服务器
     server_process = run_server()
     time.sleep(1)  # 等待服务器启动
-    
+
     # 启动客户端
-    client_process = run_client()
-    
+    client_process = run_client(local)
+
     # 打开浏览器
-    threading.Thread(target=open_browser).start()
-    
+    if browser:
+        threading.Thread(target=open_browser).start()
+
     try:
-        while True:
-            show_menu()
-            try:
-                choice = input("\n请选择操作 (1-2): ").strip()
-                if choice == "1":
-                    view_clipboard_history()
-                elif choice == "2":
-                    raise KeyboardInterrupt
-                else:
-                    print("❌ 无效的选择，请重试")
-            except ValueError:
-                print("❌ 请输入有效的数字")
-            
-            time.sleep(0.5)
-    
+        menu_loop(lambda: view_clipboard_history(local))
     except KeyboardInterrupt:
         print("\n\n正在关闭程序...")
         # 关闭所有子进程
@@ -71,8 +157,22 @@ def main():
                     os.killpg(os.getpgid(process.pid), signal.SIGTERM)
         print("👋 程序已退出")
 
+def main():
+    parser = argparse.ArgumentParser(description="启动剪贴板同步工具")
+    parser.add_argument("--subprocess", action="store_true",
+                        help="服务器、客户端和历史查看分别运行在独立的子进程里（原来的启动方式）")
+    parser.add_argument("--local", action="store_true",
+                        help="客户端同步到本地启动的服务器（嵌入模式下不经过网络），默认同步到云服务器")
+    parser.add_argument("--no-browser", action="store_true", help="启动后不自动打开浏览器")
+    args = parser.parse_args()
+
+    if args.subprocess:
+        # 在非Windows系统上创建新的进程组
+        if sys.platform != "win32":
+            os.setpgrp()
+        main_subprocess(not args.no_browser, args.local)
+    else:
+        main_embedded(not args.no_browser, args.local)
+
 if __name__ == "__main__":
-    # 在非Windows系统上创建新的进程组
-    if sys.platform != "win32":
-        os.setpgrp()
-    main() 
\ No newline at end of file
+    main()
@@ -4,4 +4,13 @@
 # source venv/bin/activate
 
 # 使用gunicorn启动服务器
-gunicorn -w 4 -b 0.0.0.0:5001 server:app 
\ No newline at end of file
+# 多个 worker 共用一个 SQLite 文件（WAL 模式）；上传很密集时可以开启组提交：
+#   GROUP_COMMIT=1 GROUP_COMMIT_WINDOW_MS=5 WRITE_DURABILITY=wait|enqueue
+# 长轮询请求会挂起一段时间，使用 gthread worker 避免少量客户端占满所有 worker
+# 数据库地址、每个 worker 的连接池大小和只读副本见 config.py：
+#   DATABASE_URL DATABASE_REPLICA_URL DB_POOL_SIZE DB_MAX_OVERFLOW DB_STATEMENT_TIMEOUT_MS
+# 排查慢请求时可以开启剖析（见 profiler.py），结果在 /debug/profiles：
+#   PROFILE_SAMPLE_RATE=0.01 PROFILE_SLOW_MS=500 PROFILE_TOKEN=...
+# 写入限流默认关闭，需要时打开（见 ratelimit.py）：
+#   RATE_LIMIT_PER_DEVICE=2 RATE_LIMIT_DEVICE_BURST=20 RATE_LIMIT_GLOBAL=...
+gunicorn -w 4 -k gthread --threads 32 -b 0.0.0.0:5001 server:app 
\ No newline at end of file
@@ -0,0 +1,346 @@
+"""按内容哈希去重的剪贴板内容存储
+
+相同的内容只在 clipboard_blob 中存一份，ClipboardItem 通过 content_hash 引用它，
+refcount 记录引用次数，降到 0 时删除内容。
+
+超过 OUT_OF_LINE_THRESHOLD 字节的内容写成 BLOB_DIR 下的文件，数据库里只留预览和路径，
+全文在写入时按段读出加入 clipboard_blob_fts 索引（见 search.py）。
+文件名带随机后缀：同一内容被删除后又立即重新上传时，新旧两行各自对应不同的文件，
+删除旧文件（在事务提交之后）不会误删新文件。
+"""
+import codecs
+import hashlib
+import os
+import shutil
+import uuid
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event
+from models import db, ClipboardBlob, ClipboardItem, CollapsedUpload, SyncGroup, blob_file_path
+from search import index_blob_file, unindex_blobs
+
+PREVIEW_CHARS = 200  # 列表中显示的内容预览长度
+
+def content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def _insert(dialect_name):
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+def upsert_blob_refs(conn, rows, table=None):
+    """批量写入内容并增加引用计数；rows 为 {hash, content, size, refcount} 字典列表"""
+    if not rows:
+        return
+    table = ClipboardBlob.__table__ if table is None else table
+    insert = _insert(conn.dialect.name)
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["hash"],
+        set_={"refcount": table.c.refcount + stmt.excluded.refcount}
+    )
+    conn.execute(stmt, rows)
+
+def new_blob_location(digest):
+    """新内容文件的相对路径，创建好所在目录"""
+    location = os.path.join(digest[:2], f"{digest}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(os.path.dirname(blob_file_path(location)), exist_ok=True)
+    return location
+
+def write_blob_file(digest, encoded):
+    """把内容写入新文件，返回相对路径；写完并 fsync 后才改名，不会留下不完整的文件"""
+    location = new_blob_location(digest)
+    path = blob_file_path(location)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(encoded)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return location
+
+def link_blob_file(digest, source):
+    """把已经写好的文件（分块上传的 .part）作为内容文件，返回相对路径
+
+    同一个文件系统上建立硬链接，不复制数据；否则按块复制。源文件由调用方删除。
+    """
+    with open(source, "rb") as f:
+        os.fsync(f.fileno())
+    location = new_blob_location(digest)
+    path = blob_file_path(location)
+    try:
+        os.link(source, path)
+    except OSError:
+        tmp = f"{path}.tmp"
+        with open(source, "rb") as src, open(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp, path)
+    return location
+
+def read_preview(path):
+    """从文件开头读出内容预览，不读取整个文件"""
+    with open(path, "rb") as f:
+        head = f.read(PREVIEW_CHARS * 4)
+    # 截断处可能在一个多字节字符中间，未完成的字符不输出
+    return codecs.getincrementaldecoder("utf-8")().decode(head)[:PREVIEW_CHARS]
+
+def blob_row(content, refs=1):
+    """clipboard_blob 的一行（不含文件）"""
+    return {
+        "hash": content_hash(content),
+        "content": content,
+        "size": len(content.encode("utf-8")),
+        "refcount": refs,
+        "preview": content[:PREVIEW_CHARS],
+        "location": None
+    }
+
+def acquire_blob(content=None, digest=None, refs=1):
+    """为新记录取得内容的引用（refs 条记录），返回内容哈希
+
+    只给出 digest 时，服务器上已有该内容才会成功，否则返回 None，
+    客户端需要再带上完整内容重新上传。
+    """
+    if content is not None:
+        row = blob_row(content, refs)
+        digest = row["hash"]
+        if row["size"] > current_app.config['OUT_OF_LINE_THRESHOLD']:
+            row.update(content="", location=write_blob_file(digest, content.encode("utf-8")))
+        return _store_blob_row(row, refs)
+
+    updated = db.session.execute(
+        db.update(ClipboardBlob)
+        .where(ClipboardBlob.hash == digest)
+        .values(refcount=ClipboardBlob.refcount + refs)
+    )
+    return digest if updated.rowcount else None
+
+def acquire_blob_file(path, digest):
+    """和 acquire_blob 相同，内容是已经校验过哈希和编码的文件，返回内容哈希
+
+    超过阈值时文件直接成为内容文件，不把完整内容读进内存。
+    """
+    size = os.path.getsize(path)
+    if size <= current_app.config['OUT_OF_LINE_THRESHOLD']:
+        with open(path, encoding="utf-8") as f:
+            return acquire_blob(content=f.read())
+    row = {"hash": digest, "content": "", "size": size, "refcount": 1,
+           "preview": read_preview(path), "location": link_blob_file(digest, path)}
+    return _store_blob_row(row, 1)
+
+def _store_blob_row(row, refs):
+    """写入内容行或增加已有内容的引用计数，返回内容哈希"""
+    insert = _insert(db.session.get_bind().dialect.name)
+    stmt = insert(ClipboardBlob).values(**row)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["hash"],
+        set_={"refcount": ClipboardBlob.refcount + refs}
+    ).returning(ClipboardBlob.location)
+    stored = db.session.execute(stmt).scalar_one()
+    if row["location"] and stored != row["location"]:
+        # 内容已经存在，刚写的文件没有被引用
+        os.unlink(blob_file_path(row["location"]))
+    elif row["location"]:
+        # 事务没有提交（回滚、出错后关闭 session）时这一行不存在，文件由 _discard_unused_files 删除
+        db.session.info.setdefault("unlink_unless_committed", []).append(row["location"])
+        index_blob_file(db.session.connection(), row["hash"], blob_file_path(row["location"]))
+    return row["hash"]
+
+def next_seq(group):
+    """分配同步组内的下一个序号
+
+    计数器行在事务提交前一直被锁住，同一组的写入按序号顺序提交，
+    读取方按序号向后扫描时不会跳过还没提交的记录。
+    """
+    return reserve_seqs(group, 1)
+
+def reserve_seqs(group, count):
+    """一次分配 count 个连续序号，返回其中最大的一个"""
+    insert = _insert(db.session.get_bind().dialect.name)
+    stmt = insert(SyncGroup).values(name=group, last_seq=count)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["name"],
+        set_={"last_seq": SyncGroup.last_seq + count}
+    ).returning(SyncGroup.last_seq)
+    return db.session.execute(stmt).scalar_one()
+
+def create_item(device_id, content=None, digest=None, client_id=None, group=None, path=None):
+    """新增一条记录（调用方负责提交事务）
+
+    只给出 digest 而服务器上没有对应内容时返回 None。path 为内容文件（分块上传），
+    此时 digest 是它已经校验过的哈希。
+    """
+    if path:
+        digest = acquire_blob_file(path, digest)
+    else:
+        digest = acquire_blob(content=content, digest=digest)
+    if digest is None:
+        return None
+    item = ClipboardItem(content_hash=digest, device_id=device_id,
+                         client_id=client_id, timestamp=datetime.utcnow())
+    if group:
+        item.sync_group = group
+        item.seq = next_seq(group)
+    db.session.add(item)
+    return item
+
+def latest_duplicate(device_id, digest, group=None):
+    """同步组（不属于组时为该设备）里最新的一条记录内容哈希为 digest 时返回它，否则返回 None
+
+    其他设备同步过来的内容被原样传回时，不再新增一条相同的记录。
+    """
+    # 只取需要的列，返回的行有 id、content_hash、seq、sync_group 属性
+    query = db.select(ClipboardItem.id, ClipboardItem.content_hash, ClipboardItem.seq, ClipboardItem.sync_group)
+    if group:
+        query = query.where(ClipboardItem.sync_group == group).order_by(ClipboardItem.seq.desc())
+    else:
+        query = query.where(ClipboardItem.device_id == device_id)\
+            .order_by(ClipboardItem.timestamp.desc(), ClipboardItem.id.desc())
+    latest = db.session.execute(query.limit(1)).first()
+    return latest if latest is not None and latest.content_hash == digest else None
+
+def import_items(records):
+    """批量写入一批导入的记录（调用方负责提交事务），返回实际写入的记录字典列表
+
+    records 为 {device_id, content, timestamp, client_id, group} 字典。内容按哈希合并后
+    用一条多行语句写入，记录也一次插入；(device_id, client_id) 已经存在的记录跳过，
+    重复导入同一个文件不会产生重复记录。
+    """
+    seen = set()
+    for device_id in {r["device_id"] for r in records}:
+        existing = find_by_client_ids(device_id, [r["client_id"] for r in records if r["device_id"] == device_id])
+        seen.update((device_id, client_id) for client_id in existing)
+    fresh = []
+    for record in records:
+        key = (record["device_id"], record["client_id"])
+        if key not in seen:
+            seen.add(key)
+            fresh.append(record)
+    if not fresh:
+        return []
+
+    refs = {}
+    for record in fresh:
+        record["content_hash"] = content_hash(record["content"])
+        refs.setdefault(record["content_hash"], [record["content"], 0])[1] += 1
+    threshold = current_app.config['OUT_OF_LINE_THRESHOLD']
+    inline = []
+    for content, count in refs.values():
+        row = blob_row(content, count)
+        if row["size"] > threshold:
+            acquire_blob(content=content, refs=count)
+        else:
+            inline.append(row)
+    upsert_blob_refs(db.session.connection(), inline)
+
+    groups = {}
+    for record in fresh:
+        if record["group"]:
+            groups.setdefault(record["group"], []).append(record)
+    for group, members in groups.items():
+        last = reserve_seqs(group, len(members))
+        for offset, record in enumerate(members):
+            record["seq"] = last - len(members) + 1 + offset
+
+    db.session.execute(db.insert(ClipboardItem), [{
+        "content_hash": record["content_hash"],
+        "device_id": record["device_id"],
+        "timestamp": record["timestamp"],
+        "client_id": record["client_id"],
+        "sync_group": record["group"],
+        "seq": record.get("seq"),
+    } for record in fresh])
+    return fresh
+
+def find_by_client_ids(device_id, client_ids):
+    """按 client_id 查找已经上传过的记录，返回 {client_id: item}
+
+    被折叠到已有记录上的上传（见 record_collapsed）返回它被折叠到的那条记录。
+    """
+    client_ids = [c for c in client_ids if c]
+    if not client_ids:
+        return {}
+    items = ClipboardItem.query.filter(
+        ClipboardItem.device_id == device_id,
+        ClipboardItem.client_id.in_(client_ids)
+    ).all()
+    found = {item.client_id: item for item in items}
+    missing = [c for c in client_ids if c not in found]
+    if missing:
+        rows = db.session.execute(
+            db.select(CollapsedUpload.client_id, ClipboardItem)
+            .join(ClipboardItem, ClipboardItem.id == CollapsedUpload.item_id)
+            .where(CollapsedUpload.device_id == device_id, CollapsedUpload.client_id.in_(missing))
+        )
+        found.update({client_id: item for client_id, item in rows})
+    return found
+
+def record_collapsed(device_id, client_id, item_id):
+    """记住被折叠到 item_id 上的上传的 client_id（调用方负责提交事务）
+
+    折叠的上传不新增记录，client_id 不在 clipboard_item 里；响应丢失后的重试如果晚于
+    别的上传到达，最新一条已经变了，只能靠这里的记录识别出是重试。
+    """
+    if not client_id:
+        return
+    insert = _insert(db.session.get_bind().dialect.name)
+    db.session.execute(
+        insert(CollapsedUpload)
+        .values(device_id=device_id, client_id=client_id, item_id=item_id)
+        .on_conflict_do_nothing(index_elements=["device_id", "client_id"])
+    )
+
+def release_blobs(digests):
+    """减少引用计数，并删除不再被引用的内容；内容文件在事务提交后删除"""
+    for digest in digests:
+        db.session.execute(
+            db.update(ClipboardBlob)
+            .where(ClipboardBlob.hash == digest)
+            .values(refcount=ClipboardBlob.refcount - 1)
+        )
+    if digests:
+        unused = (ClipboardBlob.hash.in_(set(digests)), ClipboardBlob.refcount <= 0)
+        files = db.session.execute(
+            db.select(ClipboardBlob.hash, ClipboardBlob.location).where(*unused, ClipboardBlob.location.isnot(None))
+        ).all()
+        db.session.execute(db.delete(ClipboardBlob).where(*unused))
+        unindex_blobs(db.session.connection(), [digest for digest, _ in files])
+        db.session.info.setdefault("unlink_after_commit", []).extend(location for _, location in files)
+
+def _unlink_files(locations):
+    for location in locations:
+        try:
+            os.unlink(blob_file_path(location))
+        except FileNotFoundError:
+            pass
+
+@event.listens_for(db.session, "after_commit")
+def _unlink_released_files(session):
+    _unlink_files(session.info.pop("unlink_after_commit", []))
+    # 新写的文件已经被提交的行引用
+    session.info.pop("unlink_unless_committed", None)
+
+@event.listens_for(db.session, "after_transaction_end")
+def _discard_unused_files(session, transaction):
+    # 最外层事务没有提交就结束了（回滚或关闭），新写的文件没有行引用，重试时会重新写入
+    if transaction.parent is None:
+        _unlink_files(session.info.pop("unlink_unless_committed", []))
+
+@event.listens_for(db.session, "after_soft_rollback")
+def _keep_released_files(session, previous_transaction):
+    # 回滚后内容还在，文件不能删除
+    session.info.pop("unlink_after_commit", None)
+
+def delete_items(items):
+    """删除记录并释放它们引用的内容（调用方负责提交事务）"""
+    digests = [item.content_hash for item in items]
+    db.session.execute(db.delete(CollapsedUpload).where(CollapsedUpload.item_id.in_([item.id for item in items])))
+    for item in items:
+        db.session.delete(item)
+    db.session.flush()
+    release_blobs(digests)
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    """app 模块，数据放在临时目录，关闭限流和指标"""
+    overrides = {"CLIPBOARD_INSTANCE_PATH": str(tmp_path_factory.mktemp("instance")),
+                 "RATE_LIMIT_PER_DEVICE": "0", "METRICS_ENABLED": "0"}
+    saved = {name: os.environ.get(name) for name in overrides}
+    os.environ.update(overrides)
+    try:
+        import app
+        yield app
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+@pytest.fixture
+def empty_db(server):
+    """清空记录和内容"""
+    from sqlalchemy import text
+    from models import db, ClipboardBlob, ClipboardItem, CollapsedUpload
+    with server.app.app_context():
+        db.session.execute(db.delete(CollapsedUpload))
+        db.session.execute(db.delete(ClipboardItem))
+        db.session.execute(db.delete(ClipboardBlob))
+        db.session.execute(text("DELETE FROM clipboard_blob_fts"))
+        db.session.commit()
+    return server
@@ -0,0 +1,42 @@
+import random
+
+from archive import Archive, record_key
+
+
+def make_records(ids):
+    return [{"id": i, "device_id": f"d{i % 2}", "timestamp": f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}",
+             "content": f"item {i}", "content_hash": f"h{i}"} for i in ids]
+
+
+def test_latest_page_reads_only_the_newest_segments(tmp_path, monkeypatch):
+    archive = Archive(str(tmp_path), max_segment_bytes=1)
+    for start in range(0, 200, 10):
+        archive.append(make_records(range(start, start + 10)))
+    assert len(archive.segments()) == 20
+
+    read = []
+    original = archive._read_segment
+    monkeypatch.setattr(archive, "_read_segment", lambda name: read.append(name) or original(name))
+    records = archive.query(5)
+    assert [r["id"] for r in records] == [199, 198, 197, 196, 195]
+    assert len(read) == 1
+
+
+def test_query_matches_a_full_scan_with_overlapping_segments(tmp_path):
+    rng = random.Random(1)
+    ids = list(range(300))
+    rng.shuffle(ids)
+    archive = Archive(str(tmp_path), max_segment_bytes=1)
+    all_records = make_records(ids)
+    for start in range(0, 300, 25):
+        archive.append(all_records[start:start + 25])
+
+    ordered = sorted(all_records, key=record_key, reverse=True)
+    bound = record_key(ordered[100])
+    for kwargs in ({}, {"device_id": "d1"}, {"before": bound}, {"after": bound}):
+        expected = [r for r in ordered
+                    if (not kwargs.get("device_id") or r["device_id"] == kwargs["device_id"])
+                    and (not kwargs.get("before") or record_key(r) < bound)
+                    and (not kwargs.get("after") or record_key(r) > bound)]
+        expected = expected[-7:] if kwargs.get("after") else expected[:7]
+        assert [r["id"] for r in archive.query(7, **kwargs)] == [r["id"] for r in expected]
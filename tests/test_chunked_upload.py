@@ -0,0 +1,84 @@
+import hashlib
+import os
+
+import pytest
+
+from models import ClipboardBlob, blob_file_path
+
+
+@pytest.fixture
+def client(empty_db, monkeypatch):
+    monkeypatch.setattr(empty_db.upload_store, "chunk_size", 16 * 1024)
+    return empty_db.app.test_client()
+
+
+def start_upload(client, encoded, client_id="c1"):
+    response = client.post("/clipboard/uploads", json={
+        "device_id": "d1", "client_id": client_id, "size": len(encoded),
+        "content_hash": hashlib.sha256(encoded).hexdigest()})
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def put_chunks(client, meta, encoded, start=0):
+    size = meta["chunk_size"]
+    for index in range(start, (len(encoded) + size - 1) // size):
+        response = client.put(f"/clipboard/uploads/{meta['upload_id']}/chunks/{index}",
+                              data=encoded[index * size:(index + 1) * size])
+        assert response.status_code == 200
+
+
+def test_chunk_for_unknown_upload_is_404(client):
+    response = client.put(f"/clipboard/uploads/{'0' * 32}/chunks/0", data=b"abc")
+    assert response.status_code == 404
+
+
+def test_interrupted_upload_resumes_and_commits(client, empty_db):
+    content = "日志 line\n" * 8000  # 超过 OUT_OF_LINE_THRESHOLD，存为文件
+    encoded = content.encode("utf-8")
+    meta = start_upload(client, encoded)
+    put_chunks(client, meta, encoded[:meta["chunk_size"] * 2])
+
+    status = client.get(f"/clipboard/uploads/{meta['upload_id']}").get_json()
+    assert status["next_chunk"] == 2
+    # 重复上传已经确认过的分块不影响状态
+    response = client.put(f"/clipboard/uploads/{meta['upload_id']}/chunks/1",
+                          data=encoded[meta["chunk_size"]:meta["chunk_size"] * 2])
+    assert response.get_json()["next_chunk"] == 2
+    put_chunks(client, meta, encoded, start=2)
+
+    response = client.post(f"/clipboard/uploads/{meta['upload_id']}/commit")
+    assert response.status_code == 200
+    item_id = response.get_json()["id"]
+    assert client.get(f"/clipboard/{item_id}/content").get_data(as_text=True) == content
+    with empty_db.app.app_context():
+        blob = ClipboardBlob.query.one()
+        assert blob.location and blob.preview == content[:len(blob.preview)]
+        assert os.path.getsize(blob_file_path(blob.location)) == len(encoded)
+    assert not os.path.exists(os.path.join(empty_db.upload_store.directory, meta["upload_id"] + ".part"))
+
+
+def test_commit_rejects_wrong_hash_and_invalid_utf8(client):
+    encoded = b"abc\xff" * 10
+    meta = start_upload(client, encoded)
+    put_chunks(client, meta, encoded)
+    response = client.post(f"/clipboard/uploads/{meta['upload_id']}/commit")
+    assert response.status_code == 400
+    assert "UTF-8" in response.get_json()["error"]
+
+    response = client.post("/clipboard/uploads", json={
+        "device_id": "d1", "client_id": "c2", "size": 3, "content_hash": "0" * 64})
+    meta = response.get_json()
+    put_chunks(client, meta, b"abc")
+    response = client.post(f"/clipboard/uploads/{meta['upload_id']}/commit")
+    assert response.status_code == 400
+
+
+def test_small_upload_is_stored_inline(client, empty_db):
+    encoded = "short".encode("utf-8")
+    meta = start_upload(client, encoded)
+    put_chunks(client, meta, encoded)
+    item_id = client.post(f"/clipboard/uploads/{meta['upload_id']}/commit").get_json()["id"]
+    assert client.get(f"/clipboard/{item_id}/content").get_data(as_text=True) == "short"
+    with empty_db.app.app_context():
+        assert ClipboardBlob.query.one().location is None
@@ -0,0 +1,82 @@
+from models import ClipboardItem, CollapsedUpload
+
+
+def upload(client, content, client_id):
+    response = client.post("/clipboard", json={"content": content, "device_id": "d1", "client_id": client_id})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def upload_batch(client, entries):
+    response = client.post("/clipboard/batch", json={"device_id": "d1", "items": entries})
+    assert response.status_code == 200
+    return response.get_json()["results"]
+
+
+def item_count(server):
+    with server.app.app_context():
+        return ClipboardItem.query.count()
+
+
+def test_retry_of_collapsed_upload_is_not_duplicated(empty_db):
+    client = empty_db.app.test_client()
+    first = upload(client, "A", "c1")
+    collapsed = upload(client, "A", "c2")
+    assert collapsed["status"] == "collapsed" and collapsed["id"] == first["id"]
+    upload(client, "B", "c3")
+
+    # c2 的对应关系存在数据库里，重试落到任何一个 worker 上都能查到
+    with empty_db.app.app_context():
+        mapping = CollapsedUpload.query.one()
+        assert (mapping.device_id, mapping.client_id, mapping.item_id) == ("d1", "c2", first["id"])
+
+    # c2 的响应丢失后重试，最新一条已经是 B
+    retried = upload(client, "A", "c2")
+    assert retried["id"] == first["id"]
+    assert item_count(empty_db) == 2
+
+
+def test_retry_of_collapsed_batch_entry_is_not_duplicated(empty_db):
+    client = empty_db.app.test_client()
+    first = upload_batch(client, [{"content": "A", "client_id": "b1"}, {"content": "A", "client_id": "b2"}])
+    assert [r["status"] for r in first] == ["created", "collapsed"]
+    upload_batch(client, [{"content": "B", "client_id": "b3"}])
+
+    retried = upload_batch(client, [{"content": "A", "client_id": "b2"}])
+    assert retried[0]["status"] == "duplicate" and retried[0]["id"] == first[0]["id"]
+    assert item_count(empty_db) == 2
+
+
+def test_deleting_an_item_drops_its_collapsed_client_ids(empty_db):
+    from models import db
+    from storage import delete_items
+
+    client = empty_db.app.test_client()
+    first = upload(client, "A", "c1")
+    upload(client, "A", "c2")
+    with empty_db.app.app_context():
+        delete_items([db.session.get(ClipboardItem, first["id"])])
+        db.session.commit()
+        assert CollapsedUpload.query.count() == 0
+
+
+def test_collapse_is_counted_once_when_group_commit_reruns(empty_db, monkeypatch):
+    import pytest
+    from group_commit import GroupCommitter
+
+    counted = []
+    monkeypatch.setattr(empty_db, "count_collapsed", lambda route, count=1: counted.append(count))
+    upload(empty_db.app.test_client(), "A", "c1")
+
+    def fail():
+        raise ValueError("boom")
+
+    # 同一批里有一个操作失败，整批回滚后逐个重新执行
+    committer = GroupCommitter(empty_db.app, enabled=True, window=0.5)
+    saved = committer.submit(empty_db.save_item, "d1", "A", None, "c2", None, after_commit=empty_db.after_saved)
+    failed = committer.submit(fail)
+    assert saved.result(timeout=5)["collapsed"]
+    with pytest.raises(ValueError):
+        failed.result(timeout=5)
+    committer.stop()
+    assert counted == [1]
@@ -0,0 +1,19 @@
+import random
+
+from delta import apply_delta, make_delta
+
+
+def test_delta_round_trip():
+    rng = random.Random(0)
+    for _ in range(500):
+        base = "".join(rng.choice("ab") for _ in range(rng.randint(0, 600)))
+        start = rng.randint(0, len(base))
+        stop = rng.randint(start, len(base))
+        target = base[:start] + "".join(rng.choice("abc") for _ in range(rng.randint(0, 50))) + base[stop:]
+        assert apply_delta(base, make_delta(base, target)) == target
+
+
+def test_append_is_encoded_as_prefix():
+    base = "log line\n" * 10000
+    delta = make_delta(base, base + "new line\n")
+    assert delta == {"prefix": len(base), "suffix": 0, "insert": "new line\n"}
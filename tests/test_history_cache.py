@@ -0,0 +1,117 @@
+from history_cache import HistoryCache, default_history_path
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeServer:
+    """和 /clipboard/history 的翻页规则相同，时间游标就是记录ID"""
+
+    def __init__(self, device_id, count):
+        self.items = []
+        self.requests = []
+        for _ in range(count):
+            self.add(device_id)
+
+    def add(self, device_id, timestamp=None):
+        item_id = len(self.items) + 1
+        self.items.append({"id": item_id, "device_id": device_id,
+                           "timestamp": timestamp or f"2024-01-01T00:00:{item_id:02d}",
+                           "content_hash": f"h{item_id}", "preview": f"item {item_id}", "size": 6,
+                           "truncated": False})
+
+    def get(self, url, params=None, timeout=None):
+        self.requests.append(dict(params))
+        limit = params["limit"]
+        if "since_id" in params:
+            page = [item for item in self.items if item["id"] > params["since_id"]][:limit]
+            return FakeResponse({"items": page, "next_since_id": page[-1]["id"] if page else params["since_id"]})
+        if params.get("after"):
+            page = [item for item in self.items if item["id"] > int(params["after"])][:limit]
+            page.reverse()
+            next_cursor = str(page[0]["id"]) if page else params["after"]
+        else:
+            before = int(params.get("before") or 10 ** 9)
+            page = [item for item in reversed(self.items) if item["id"] < before][:limit]
+            next_cursor = str(page[-1]["id"]) if len(page) == limit else None
+        newest = str(page[0]["id"]) if page else params.get("after")
+        return FakeResponse({"items": page, "newest_cursor": newest, "next_cursor": next_cursor})
+
+
+def test_replicas_for_different_servers_do_not_clobber_each_other(tmp_path, monkeypatch):
+    monkeypatch.delenv("CLIPBOARD_HISTORY_PATH", raising=False)
+    monkeypatch.setenv("HOME", str(tmp_path))
+    cloud_url, local_url = "http://cloud.example:5001", "http://127.0.0.1:5001"
+    cloud, local = FakeServer("cloud-device", 3), FakeServer("local-device", 2)
+
+    cloud_cache = HistoryCache(server_url=cloud_url)
+    local_cache = HistoryCache(server_url=local_url)
+    assert cloud_cache.path != local_cache.path
+    assert cloud_cache.path == default_history_path(cloud_url)
+    assert cloud_cache.path.startswith(str(tmp_path))
+
+    assert cloud_cache.sync(cloud, cloud_url) == 3
+    assert local_cache.sync(local, local_url) == 2
+
+    # 交替同步：两边都只做增量同步，不会清空对方的副本
+    cloud.add("cloud-device")
+    assert cloud_cache.sync(cloud, cloud_url) == 1
+    assert cloud.requests[-1]["since_id"] == 3
+    assert local_cache.sync(local, local_url) == 0
+    assert local.requests[-1]["since_id"] == 2
+
+    assert {item["device_id"] for item in cloud_cache.query(limit=10)} == {"cloud-device"}
+    assert {item["device_id"] for item in local_cache.query(limit=10)} == {"local-device"}
+    assert len(cloud_cache) == 4 and len(local_cache) == 2
+
+
+def test_viewer_reads_the_replica_the_client_refreshes(tmp_path, monkeypatch, capsys):
+    from upload import ClipboardSync
+    from view_history import view_history
+    from watcher import MemoryBackend
+
+    monkeypatch.delenv("CLIPBOARD_HISTORY_PATH", raising=False)
+    monkeypatch.setenv("HOME", str(tmp_path))
+    client = ClipboardSync(spool_path=str(tmp_path / "spool.db"), backend=MemoryBackend())
+    assert client.history.sync(FakeServer("cloud-device", 3), client.server_url) == 3
+
+    view_history(offline=True)
+    assert "item 3" in capsys.readouterr().out
+
+
+def test_imported_items_with_older_timestamps_are_synced(empty_db, tmp_path):
+    import json
+
+    from local_transport import LocalTransport
+
+    client = empty_db.app.test_client()
+    for i in range(3):
+        client.post("/clipboard", json={"content": f"item {i}", "device_id": "d1"})
+    http = LocalTransport(lambda: empty_db.app)
+    cache = HistoryCache(str(tmp_path / "history.db"))
+    assert cache.sync(http, "http://server") == 3
+
+    # 导入的记录时间戳比已同步的都旧，但记录ID更大
+    body = json.dumps({"content": "imported", "device_id": "d2", "timestamp": "2020-01-01T00:00:00"})
+    assert client.post("/clipboard/import", data=body).status_code == 200
+    assert cache.sync(http, "http://server") == 1
+    assert "imported" in [item["preview"] for item in cache.query(limit=10)]
+
+
+def test_history_since_id_returns_items_in_id_order(empty_db):
+    client = empty_db.app.test_client()
+    ids = [client.post("/clipboard", json={"content": f"item {i}", "device_id": "d1"}).get_json()["id"]
+           for i in range(3)]
+    page = client.get("/clipboard/history", query_string={"since_id": ids[0], "limit": 1}).get_json()
+    assert [item["id"] for item in page["items"]] == [ids[1]]
+    assert page["next_since_id"] == ids[1]
+    page = client.get("/clipboard/history", query_string={"since_id": ids[1]}).get_json()
+    assert [item["id"] for item in page["items"]] == [ids[2]]
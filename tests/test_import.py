@@ -0,0 +1,50 @@
+import gzip
+import json
+
+from models import ClipboardItem
+
+
+def ndjson(records):
+    return "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")
+
+
+def item_count(server):
+    with server.app.app_context():
+        return ClipboardItem.query.count()
+
+
+def test_reimporting_a_file_skips_existing_records(empty_db):
+    client = empty_db.app.test_client()
+    body = ndjson([{"content": f"item {i}", "timestamp": f"2024-01-01T00:00:0{i}"} for i in range(3)]
+                  + [{"content": "with id", "client_id": "c1"}])
+    first = client.post("/clipboard/import?device_id=d1", data=body).get_json()
+    assert (first["imported"], first["skipped"]) == (4, 0)
+    second = client.post("/clipboard/import?device_id=d1", data=gzip.compress(body),
+                         content_type="application/gzip").get_json()
+    assert (second["imported"], second["skipped"]) == (0, 4)
+    assert item_count(empty_db) == 4
+
+
+def test_import_over_the_size_limit_is_rejected(empty_db, monkeypatch):
+    monkeypatch.setitem(empty_db.app.config, "IMPORT_MAX_BYTES", 1000)
+    client = empty_db.app.test_client()
+    body = ndjson([{"content": f"item {i}" * 10} for i in range(50)])
+    assert client.post("/clipboard/import?device_id=d1", data=body).status_code == 413
+
+    # gzip 时按解压后的大小计算
+    response = client.post("/clipboard/import?device_id=d1", data=gzip.compress(body),
+                           content_type="application/gzip")
+    assert response.status_code == 413
+    assert response.get_json()["imported"] == 0
+    assert item_count(empty_db) == 0
+
+
+def test_import_is_rate_limited(empty_db, monkeypatch):
+    monkeypatch.setattr(empty_db.rate_limiter, "rate", 0.001)
+    monkeypatch.setattr(empty_db.rate_limiter, "burst", 1)
+    client = empty_db.app.test_client()
+    body = ndjson([{"content": "x"}])
+    assert client.post("/clipboard/import?device_id=import-limited", data=body).status_code == 200
+    response = client.post("/clipboard/import?device_id=import-limited", data=body)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
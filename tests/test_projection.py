@@ -0,0 +1,59 @@
+import pytest
+
+
+@pytest.fixture
+def client(empty_db, monkeypatch):
+    # 两种读取方式都直接查库，不用缓存里的响应
+    monkeypatch.setattr(empty_db.latest_cache, "get", lambda device_id: None)
+    client = empty_db.app.test_client()
+    for content, device_id, group in [
+        ("plain text", "d1", None),
+        ("引号 \" 反斜杠 \\ 换行\n和 emoji 😀", "d1", None),
+        ("x" * 70000, "d1", None),  # 存为文件的内容
+        ("grouped", "d2", "g1"),
+        ("grouped again", "d2", "g1"),
+    ]:
+        body = {"content": content, "device_id": device_id}
+        if group:
+            body["group"] = group
+        assert client.post("/clipboard", json=body).status_code == 200
+    return client
+
+
+def both_ways(client, monkeypatch, path, **params):
+    """分别用投影查询和 ORM + jsonify 取同一个接口，返回两次解析后的响应"""
+    responses = []
+    for projection in (True, False):
+        monkeypatch.setitem(client.application.config, "PROJECTION_READS", projection)
+        response = client.get(path, query_string=params)
+        assert response.status_code == 200
+        responses.append(response.get_json())
+    return responses
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"device_id": "d1"},
+    {"device_id": "d2"},
+    {"include_content": "1"},
+    {"device_id": "d1", "include_content": "1", "limit": 2},
+])
+def test_history_projection_matches_orm(client, monkeypatch, params):
+    projected, orm = both_ways(client, monkeypatch, "/clipboard/history", **params)
+    assert projected["items"]
+    assert projected == orm
+
+
+def test_history_projection_pages_match_orm(client, monkeypatch):
+    projected, orm = both_ways(client, monkeypatch, "/clipboard/history", limit=2)
+    cursor = projected["next_cursor"]
+    assert cursor
+    for direction in ("before", "after"):
+        projected, orm = both_ways(client, monkeypatch, "/clipboard/history", limit=2, **{direction: cursor})
+        assert projected == orm
+
+
+@pytest.mark.parametrize("device_id", ["d1", "d2"])
+def test_latest_projection_matches_orm(client, monkeypatch, device_id):
+    projected, orm = both_ways(client, monkeypatch, "/clipboard/latest", device_id=device_id)
+    assert projected == orm
@@ -0,0 +1,41 @@
+import pytest
+
+from ratelimit import RateLimiter
+
+
+@pytest.fixture
+def client(empty_db, monkeypatch, tmp_path):
+    # 每个设备最多连续 2 次，之后约 1000 秒才补充一个令牌
+    limiter = RateLimiter(str(tmp_path / "ratelimit.bin"), rate=0.001, burst=2)
+    monkeypatch.setattr(empty_db, "rate_limiter", limiter)
+    return empty_db.app.test_client()
+
+
+def upload(client, device_id, content):
+    return client.post("/clipboard", json={"content": content, "device_id": device_id})
+
+
+def test_device_over_its_burst_gets_429_with_retry_after(client):
+    assert upload(client, "d1", "a").status_code == 200
+    assert upload(client, "d1", "b").status_code == 200
+
+    response = upload(client, "d1", "c")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.get_json()["retry_after"] > 0
+
+
+def test_rejected_requests_do_not_consume_tokens_of_other_devices(client):
+    for content in "abc":
+        upload(client, "d1", content)
+    assert upload(client, "d2", "x").status_code == 200
+
+
+def test_rejected_upload_is_not_stored(client):
+    from models import ClipboardItem
+
+    for content in "abc":
+        upload(client, "d1", content)
+    with client.application.app_context():
+        assert ClipboardItem.query.count() == 2
+
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from models import db, ClipboardBlob, ClipboardItem
+from retention import Pruner, RetentionPolicy
+from storage import import_items
+
+SIZE = 1000
+
+
+def seed(server, contents):
+    """按顺序写入记录，越靠前越旧"""
+    start = datetime.utcnow() - timedelta(hours=1)
+    records = [{"device_id": f"d{i % 3}", "content": content, "timestamp": start + timedelta(seconds=i),
+                "client_id": f"c{i}", "group": None} for i, content in enumerate(contents)]
+    with server.app.app_context():
+        import_items(records)
+        db.session.commit()
+
+
+def remaining(server):
+    with server.app.app_context():
+        contents = db.session.execute(
+            db.select(ClipboardBlob.preview)
+            .join(ClipboardItem, ClipboardItem.content_hash == ClipboardBlob.hash)
+            .order_by(ClipboardItem.timestamp)
+        ).scalars().all()
+        total = db.session.execute(db.select(func.coalesce(func.sum(ClipboardBlob.size), 0))).scalar()
+    return [content[0] for content in contents], total
+
+
+def prune(server, max_total_bytes, batch_size=2):
+    policy = RetentionPolicy(max_total_bytes=max_total_bytes, batch_size=batch_size)
+    return Pruner(server.app, policy, pause=0).run_once()
+
+
+def test_byte_cap_skips_items_whose_content_is_shared(empty_db):
+    # 最旧的 5 条是同一份内容，删除它们之中的任何几条都不会释放空间
+    seed(empty_db, ["d" * SIZE] * 5 + ["a" * SIZE, "b" * SIZE, "c" * SIZE])
+
+    assert prune(empty_db, max_total_bytes=3500) == 1
+    contents, total = remaining(empty_db)
+    assert contents == ["d"] * 5 + ["b", "c"]
+    assert total == 3 * SIZE
+
+
+def test_byte_cap_frees_shared_content_when_nothing_else_is_left(empty_db):
+    seed(empty_db, ["d" * SIZE] * 3 + ["e" * SIZE] * 2)
+
+    assert prune(empty_db, max_total_bytes=1500) == 3
+    contents, total = remaining(empty_db)
+    assert contents == ["e", "e"]
+    assert total == SIZE
@@ -0,0 +1,48 @@
+def upload(client, content, client_id):
+    response = client.post("/clipboard", json={"content": content, "device_id": "d1", "client_id": client_id})
+    assert response.status_code == 200
+    return response.get_json()["id"]
+
+
+def search(client, query):
+    response = client.get("/clipboard/search", query_string={"q": query})
+    assert response.status_code == 200
+    return response.get_json()["items"]
+
+
+def large_content(marker):
+    # 超过 OUT_OF_LINE_THRESHOLD（64 KB），标记词远在 200 字符的预览之后
+    filler = "lorem ipsum dolor sit amet " * 4000
+    return f"{filler} {marker} {filler}"
+
+
+def test_search_finds_text_past_the_preview_of_a_file_blob(empty_db):
+    client = empty_db.app.test_client()
+    item_id = upload(client, large_content("needlework"), "c1")
+    upload(client, "small needlework note", "c2")
+
+    results = search(client, "needlework")
+    assert item_id in [r["id"] for r in results]
+    snippet = next(r["snippet"] for r in results if r["id"] == item_id)
+    assert "【" in snippet and "needlework" in snippet
+
+
+def test_search_short_query_matches_inside_file_blob(empty_db):
+    client = empty_db.app.test_client()
+    item_id = upload(client, large_content("Zq"), "c1")
+
+    assert [r["id"] for r in search(client, "Zq")] == [item_id]
+
+
+def test_deleting_a_file_blob_removes_its_index(empty_db):
+    from sqlalchemy import text
+    from models import db, ClipboardItem
+    from storage import delete_items
+
+    client = empty_db.app.test_client()
+    item_id = upload(client, large_content("needlework"), "c1")
+    with empty_db.app.app_context():
+        delete_items([db.session.get(ClipboardItem, item_id)])
+        db.session.commit()
+        assert db.session.execute(text("SELECT COUNT(*) FROM clipboard_blob_fts")).scalar() == 0
+    assert search(client, "needlework") == []
@@ -0,0 +1,75 @@
+import json
+import os
+
+import pytest
+
+from local_transport import LocalTransport
+from models import ClipboardItem
+from upload import ClipboardSync
+from watcher import MemoryBackend
+
+
+class RecordingTransport(LocalTransport):
+    """记录发到批量接口的请求体"""
+
+    def __init__(self, app):
+        super().__init__(lambda: app)
+        self.batches = []
+
+    def request(self, method, url, timeout=None, data=None, headers=None, **kwargs):
+        if url.endswith("/clipboard/batch"):
+            self.batches.append(json.loads(data))
+        return super().request(method, url, timeout=timeout, data=data, headers=headers, **kwargs)
+
+
+@pytest.fixture
+def client(empty_db, tmp_path):
+    transport = RecordingTransport(empty_db.app)
+    sync = ClipboardSync(spool_path=str(tmp_path / "spool.db"), backend=MemoryBackend(),
+                         http=transport, history_path=str(tmp_path / "history.db"))
+    sync.gzip_supported = False
+    return sync
+
+
+def stored_contents(server):
+    with server.app.app_context():
+        return [item.content for item in ClipboardItem.query.order_by(ClipboardItem.id)]
+
+
+def test_backlog_is_sent_in_one_batch(client, empty_db):
+    for i in range(5):
+        client.upload_clipboard(f"item {i}")
+    assert client.flush_spool()
+    assert len(client.http.batches) == 1
+    assert len(client.spool) == 0
+    assert stored_contents(empty_db) == [f"item {i}" for i in range(5)]
+
+
+def test_oversized_batch_is_split_instead_of_dropped(client, empty_db, monkeypatch):
+    monkeypatch.setitem(empty_db.app.config, "MAX_DECOMPRESSED_BYTES", 1000)
+    contents = [os.urandom(100).hex() for _ in range(5)]
+    for content in contents:
+        client.upload_clipboard(content)
+    assert client.flush_spool()
+    assert len(client.spool) == 0
+    assert stored_contents(empty_db) == contents
+
+
+def test_large_items_are_not_sent_inline_in_a_batch(client, empty_db):
+    large = "x" * (client.hash_first_threshold + 1)
+    contents = ["a", "b", large, "c", "d"]
+    for content in contents:
+        client.upload_clipboard(content)
+    assert client.flush_spool()
+    assert len(client.spool) == 0
+    assert stored_contents(empty_db) == contents
+    sent = [entry["content"] for batch in client.http.batches for entry in batch["items"]]
+    assert sent == ["a", "b", "c", "d"]
+
+
+def test_rejected_batch_keeps_entries_for_single_upload(client, empty_db, monkeypatch):
+    monkeypatch.setitem(empty_db.app.config, "BATCH_MAX_ITEMS", 0)
+    for i in range(3):
+        client.upload_clipboard(f"item {i}")
+    assert client.flush_spool()
+    assert stored_contents(empty_db) == [f"item {i}" for i in range(3)]
@@ -0,0 +1,36 @@
+import gzip
+import json
+
+import pytest
+
+
+@pytest.fixture
+def client(server, monkeypatch):
+    monkeypatch.setitem(server.app.config, "MAX_DECOMPRESSED_BYTES", 1000)
+    return server.app.test_client()
+
+
+def test_oversized_json_upload_is_rejected(client):
+    body = json.dumps({"content": "x" * 5000, "device_id": "d1"})
+    response = client.post("/clipboard", data=body, content_type="application/json")
+    assert response.status_code == 413
+
+
+def test_oversized_json_batch_is_rejected(client):
+    body = json.dumps({"device_id": "d1", "items": [{"content": "x" * 5000}]})
+    response = client.post("/clipboard/batch", data=body, content_type="application/json")
+    assert response.status_code == 413
+
+
+def test_oversized_gzip_upload_is_rejected(client):
+    body = gzip.compress(json.dumps({"content": "x" * 5000, "device_id": "d1"}).encode())
+    assert len(body) < 1000
+    response = client.post("/clipboard", data=body, content_type="application/json",
+                           headers={"Content-Encoding": "gzip"})
+    assert response.status_code == 413
+
+
+def test_small_upload_is_accepted(client):
+    body = json.dumps({"content": "hello", "device_id": "d1"})
+    response = client.post("/clipboard", data=body, content_type="application/json")
+    assert response.status_code == 200
@@ -0,0 +1,108 @@
+import pytest
+
+from watcher import ClipboardWatcher, MemoryBackend
+
+
+class NoTokenBackend(MemoryBackend):
+    """没有变化计数的平台（Linux）"""
+
+    def change_token(self):
+        return None
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr("watcher.time.monotonic", clock)
+    return clock
+
+
+@pytest.mark.parametrize("backend_class", [MemoryBackend, NoTokenBackend])
+def test_applied_content_is_counted_as_suppressed(backend_class):
+    backend = backend_class("start")
+    watcher = ClipboardWatcher(backend, min_interval=0, debounce=0)
+    watcher.mark_reported()
+
+    assert watcher.apply("from another device")
+    assert watcher.poll() is None
+    assert watcher.suppressed == 1
+    assert watcher.poll() is None
+    assert watcher.suppressed == 1
+
+    # 本机复制的内容照常上报
+    backend.write("copied here")
+    assert watcher.poll() == "copied here"
+    assert watcher.suppressed == 1
+
+
+def test_unchanged_token_skips_reads_and_backs_off():
+    backend = MemoryBackend("start")
+    watcher = ClipboardWatcher(backend, min_interval=0.2, max_interval=1.0, backoff=2, debounce=0)
+    watcher.mark_reported()
+    reads = backend.reads
+
+    for _ in range(5):
+        assert watcher.poll() is None
+    assert backend.reads == reads
+    assert watcher.interval == 1.0
+
+    # 有变化后立即回到最短间隔
+    backend.write("changed")
+    assert watcher.poll() == "changed"
+    assert watcher.interval == 0.2
+
+
+def test_rapid_copies_report_only_the_settled_content(clock):
+    backend = MemoryBackend("start")
+    watcher = ClipboardWatcher(backend, min_interval=0, debounce=0.3)
+    watcher.mark_reported()
+
+    for content in ("a", "ab", "abc"):
+        backend.write(content)
+        assert watcher.poll() is None
+        clock.now += 0.1
+    clock.now += 0.3
+    assert watcher.poll() == "abc"
+    assert watcher.poll() is None
+
+
+def test_blank_content_is_not_reported():
+    backend = MemoryBackend("start")
+    watcher = ClipboardWatcher(backend, min_interval=0, debounce=0)
+    watcher.mark_reported()
+
+    backend.write("  \n")
+    assert watcher.poll() is None
+
+
+def test_upload_and_sync_share_one_read():
+    backend = MemoryBackend("start")
+    watcher = ClipboardWatcher(backend, min_interval=0, debounce=0)
+    watcher.mark_reported()
+    backend.write("copied")
+    assert watcher.poll() == "copied"
+    reads = backend.reads
+
+    assert watcher.current() == "copied"
+    assert backend.reads == reads
+
+
+def test_only_the_most_recent_applied_contents_are_suppressed():
+    backend = MemoryBackend("start")
+    watcher = ClipboardWatcher(backend, min_interval=0, debounce=0, applied_limit=2)
+    watcher.mark_reported()
+    for content in ("one", "two", "three"):
+        watcher.apply(content)
+        assert watcher.poll() is None
+
+    # "one" 已经被挤出集合，本机再复制它时照常上报
+    backend.write("one")
+    assert watcher.poll() == "one"
@@ -0,0 +1,220 @@
+"""剪贴板历史的批量导出和导入（NDJSON，每行一条记录）
+
+导出用 yield_per 分批从数据库游标读取（PostgreSQL 上是服务器端游标），边读边发送，
+内存占用和表的大小无关；可以选择 gzip 压缩，压缩同样是流式的。
+
+导入逐行读取请求体，攒够一批后用多行 INSERT 写入一个事务（见 storage.import_items）。
+每条记录至少要有内容，其余字段缺省时使用导入参数给出的设备ID和当前时间；
+content_field 可以指定内容所在的字段，用来导入其他格式的 NDJSON 文件。
+请求体（解压后）的总大小有上限，超过时停止读取，已经提交的批次保留。
+没有 client_id 的记录按 (设备, 时间, 内容) 生成一个（没有时间时按这一行的内容），
+重复导入同一个文件时会被跳过。
+"""
+import gzip
+import hashlib
+import json
+import zlib
+from datetime import datetime, timezone
+
+from models import db, ClipboardItem, ClipboardBlob, blob_file_path
+from db import begin_write
+from storage import import_items
+
+EXPORT_BATCH_SIZE = 500  # 导出时每次从游标取的行数
+IMPORT_BATCH_SIZE = 1000  # 导入时每个事务写入的记录数
+FLUSH_BYTES = 64 * 1024  # 导出时攒够这么多字节才发送一次
+MAX_REPORTED_ERRORS = 20
+
+
+def export_records(device_id=None, group=None):
+    """按 (timestamp, id) 从旧到新逐条产出记录字典"""
+    stmt = db.select(
+        ClipboardItem.id, ClipboardItem.device_id, ClipboardItem.timestamp, ClipboardItem.client_id,
+        ClipboardItem.sync_group, ClipboardItem.seq, ClipboardItem.content_hash,
+        ClipboardBlob.content, ClipboardBlob.location
+    ).join(ClipboardBlob, ClipboardBlob.hash == ClipboardItem.content_hash)
+    if device_id:
+        stmt = stmt.where(ClipboardItem.device_id == device_id)
+    if group:
+        stmt = stmt.where(ClipboardItem.sync_group == group)
+    stmt = stmt.order_by(ClipboardItem.timestamp, ClipboardItem.id)
+
+    for row in db.session.execute(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE)):
+        content = row.content
+        if row.location:
+            with open(blob_file_path(row.location), encoding="utf-8") as f:
+                content = f.read()
+        yield {
+            "id": row.id,
+            "device_id": row.device_id,
+            "timestamp": row.timestamp.isoformat(timespec="microseconds"),
+            "content": content,
+            "content_hash": row.content_hash,
+            "client_id": row.client_id,
+            "group": row.sync_group,
+            "seq": row.seq,
+        }
+
+
+def ndjson_chunks(records, compress=False):
+    """把记录编码为 NDJSON 字节块；compress 时输出一个完整的 gzip 流"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    buffer = []
+    size = 0
+    for record in records:
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        buffer.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            data = b"".join(buffer)
+            buffer, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b"".join(buffer)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+class ImportTooLarge(Exception):
+    pass
+
+
+class LimitedReader:
+    """读取超过 max_bytes 字节时抛出 ImportTooLarge；gzip 时数的是解压后的字节，压缩炸弹也会被拦下"""
+
+    def __init__(self, stream, max_bytes):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.consumed = 0
+
+    def readline(self, size=-1):
+        line = self.stream.readline(size)
+        self.consumed += len(line)
+        if self.consumed > self.max_bytes:
+            raise ImportTooLarge(f"Import too large (max {self.max_bytes} bytes)")
+        return line
+
+
+def open_import_stream(stream, compressed, max_bytes=None):
+    stream = gzip.GzipFile(fileobj=stream, mode="rb") if compressed else stream
+    return LimitedReader(stream, max_bytes) if max_bytes else stream
+
+
+def parse_record(line, device_id, content_field, max_bytes):
+    """解析一行，返回导入用的字典；格式不对时抛出 ValueError"""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        raise ValueError("Invalid JSON")
+    if not isinstance(data, dict):
+        raise ValueError("Record must be a JSON object")
+
+    content = data.get(content_field)
+    if not isinstance(content, str) or not content:
+        raise ValueError(f"Missing {content_field}")
+    if len(content.encode("utf-8")) > max_bytes:
+        raise ValueError("Content too large")
+
+    device = data.get("device_id") or device_id
+    if not isinstance(device, str) or not device or len(device) > 100:
+        raise ValueError("Missing device_id")
+
+    group = data.get("group")
+    if group is not None and (not isinstance(group, str) or not group or len(group) > 100):
+        raise ValueError("Invalid group")
+
+    timestamp = data.get("timestamp")
+    if timestamp:
+        try:
+            timestamp = datetime.fromisoformat(str(timestamp).replace("Z", "+00:00"))
+        except ValueError:
+            raise ValueError("Invalid timestamp")
+        if timestamp.tzinfo is not None:
+            # 数据库里存的是不带时区的 UTC 时间
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        identity = f"{device}\n{timestamp.isoformat()}\n{content}".encode("utf-8")
+    else:
+        timestamp = datetime.utcnow()
+        identity = device.encode("utf-8") + b"\n" + line.strip()
+
+    client_id = data.get("client_id")
+    if client_id is not None and (not isinstance(client_id, str) or len(client_id) > 64):
+        raise ValueError("Invalid client_id")
+    if not client_id:
+        client_id = "import-" + hashlib.sha256(identity).hexdigest()[:32]
+
+    return {
+        "device_id": device,
+        "content": content,
+        "timestamp": timestamp,
+        "client_id": client_id,
+        "group": group,
+    }
+
+
+def import_ndjson(stream, device_id=None, content_field="content", max_bytes=16 * 1024 * 1024,
+                  batch_size=IMPORT_BATCH_SIZE):
+    """从 NDJSON 流导入记录，每批一个事务
+
+    返回 (统计, 设备, 同步组)：统计为 {imported, skipped, invalid, errors}；
+    设备为写入了记录的设备ID集合，同步组为 {组名: (最大序号, 该记录的设备ID)}，供调用方发送通知。
+    流超过大小上限（ImportTooLarge）时停止，还没提交的一批丢弃，统计里带上 too_large；
+    重新导入同一个文件时已经导入的记录会被跳过。
+    """
+    summary = {"imported": 0, "skipped": 0, "invalid": 0, "errors": []}
+    devices = set()
+    groups = {}
+    batch = []
+
+    def flush():
+        begin_write()
+        try:
+            fresh = import_items(batch)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        summary["imported"] += len(fresh)
+        summary["skipped"] += len(batch) - len(fresh)
+        for record in fresh:
+            devices.add(record["device_id"])
+            if record["group"]:
+                groups[record["group"]] = (record["seq"], record["device_id"])
+        batch.clear()
+
+    # JSON 转义后一行可能比内容本身长，留出余量；超长的行不会被整个读进内存
+    max_line = max_bytes * 2 + 64 * 1024
+    line_number = 0
+    try:
+        while True:
+            line = stream.readline(max_line)
+            if not line:
+                break
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                if len(line) >= max_line and not line.endswith(b"\n"):
+                    # 跳过这一行剩下的部分
+                    while True:
+                        rest = stream.readline(max_line)
+                        if not rest or rest.endswith(b"\n"):
+                            break
+                    raise ValueError("Line too long")
+                batch.append(parse_record(line, device_id, content_field, max_bytes))
+            except ValueError as e:
+                summary["invalid"] += 1
+                if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                    summary["errors"].append({"line": line_number, "error": str(e)})
+                continue
+            if len(batch) >= batch_size:
+                flush()
+    except ImportTooLarge as e:
+        summary["too_large"] = str(e)
+        return summary, devices, groups
+    if batch:
+        flush()
+    return summary, devices, groups
@@ -1,13 +1,19 @@
 import requests
-import pyperclip
 import time
 import os
 import platform
 import json
+import gzip
 import hashlib
 import threading
 import argparse
+from email.utils import parsedate_to_datetime
 from urllib.parse import urljoin
+from spool import Spool
+from history_cache import HistoryCache
+from delta import apply_delta
+from watcher import ClipboardWatcher, PyperclipBackend
+from http_client import HttpClient
 
 # 服务器配置
 class ServerConfig:
@@ -35,13 +41,55 @@ class ServerConfig:
         return base_url
 
 class ClipboardSync:
-    def __init__(self, server_type='cloud'):
+    def __init__(self, server_type='cloud', spool_path=None, backend=None, http=None, group=None,
+                 history_path=None):
         self.device_id = self.get_device_id()
         self.server_url = ServerConfig.get_server_url(server_type)
-        self.last_error_time = 0
-        self.error_count = 0
+        self.http = http or HttpClient()  # 上传线程和同步线程共用的连接池
+        self._errors = threading.local()  # 上传线程和同步线程各自计算退避，互不影响
         self.max_retry_interval = 30  # 最大重试间隔（秒）
+        self.poll_interval = 2  # 服务器不支持长轮询时的轮询间隔（秒）
+        self.long_poll_timeout = 25  # 长轮询在服务器端的最长等待时间（秒）
+        self.long_poll_supported = True
+        self.last_seen_id = 0  # 已经收到的最新记录ID
+        self.hash_first_threshold = 1024  # 超过该长度的内容先只上传哈希
+        self.latest_etag = None  # 上次获取的最新内容的ETag，用于条件请求
+        self.latest_id = None  # 本地持有的最新内容对应的记录ID，服务器据此返回增量
+        self.latest_content = None
+        self.gzip_threshold = 4096  # 请求体超过该字节数时gzip压缩
+        self.gzip_supported = True
+        self.spool = Spool(spool_path)  # 本地待上传队列，离线时内容不会丢失
+        self.spool_event = threading.Event()
+        self.batch_size = 50  # 补传积压内容时每批的条数
+        self.batch_supported = True
+        self.chunked_threshold = 1024 * 1024  # 超过该字节数的内容分块上传
+        self.chunked_supported = True
+        self.pending_uploads = {}  # client_id -> 未完成的分块上传会话ID，重试时续传
+        # 上传暂停到 upload_resume_at；被服务器限流时从 upload_paused_since 起复制的内容恢复后合并为一条
+        self.upload_resume_at = 0
+        self.upload_paused_since = None
+        # 同步组：组名相同的设备互相同步，通过变更流按序号获取其他设备的新记录
+        self.sync_group = group or os.environ.get('CLIPBOARD_SYNC_GROUP') or None
+        self.changes_cursor = None  # 已经处理到的组内序号，保存在本地队列文件里
+        if self.sync_group:
+            cursor = self.spool.get_state(self.cursor_key)
+            self.changes_cursor = int(cursor) if cursor is not None else None
+        self.changes_batch_size = 50
+        # 本地历史记录副本，后台定期增量同步，view_history.py 直接查询它（0 表示不同步）
+        self.history = HistoryCache(history_path, self.server_url)
+        self.history_refresh_interval = float(os.environ.get('CLIPBOARD_HISTORY_REFRESH', 60))
+        # 剪贴板监控，backend 默认读写系统剪贴板，测试时可以换成 MemoryBackend
+        self.watcher = ClipboardWatcher(backend or PyperclipBackend())
         
+    @property
+    def cursor_key(self):
+        return f"changes_cursor:{self.sync_group}"
+    
+    def with_group(self, data):
+        if self.sync_group:
+            data["group"] = self.sync_group
+        return data
+    
     @staticmethod
     def get_device_id():
         system = platform.system()
@@ -50,102 +98,441 @@ class ClipboardSync:
         device_info = f"{system}_{machine}_{node}"
         return hashlib.md5(device_info.encode()).hexdigest()[:8]
     
-    def handle_request_error(self, e, operation):
-        """统一的错误处理"""
+    def backoff(self, e, operation, retry_after=None):
+        """记录一次失败，返回重试前应等待的秒数：服务器给出 Retry-After 时按它等待，否则指数退避"""
         current_time = time.time()
-        if current_time - self.last_error_time > 60:  # 重置计数器
-            self.error_count = 0
+        errors = self._errors
+        if current_time - getattr(errors, "last_time", 0) > 60:  # 重置计数器
+            errors.count = 0
         
-        self.error_count += 1
-        self.last_error_time = current_time
+        errors.count += 1
+        errors.last_time = current_time
         
         # 计算重试等待时间（指数退避）
-        wait_time = min(2 ** self.error_count, self.max_retry_interval)
+        wait_time = retry_after if retry_after is not None else min(2 ** errors.count, self.max_retry_interval)
         
         print(f"❌ {operation}失败: {str(e)}")
         print(f"⏳ {wait_time}秒后重试...")
-        time.sleep(wait_time)
+        return wait_time
+    
+    def handle_request_error(self, e, operation, retry_after=None):
+        """统一的错误处理：在当前线程里等待后返回"""
+        time.sleep(self.backoff(e, operation, retry_after))
+    
+    def reset_errors(self):
+        self._errors.count = 0
+    
+    @staticmethod
+    def retry_after(response):
+        """解析 Retry-After（秒数或 HTTP 日期），没有时返回 None"""
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+    
+    def pause_uploads(self, seconds, coalesce=False):
+        """暂停上传线程 seconds 秒，剪贴板监控和同步线程不受影响
+
+        coalesce 为 True（被服务器限流）时，暂停开始之后复制的内容恢复后只上传最新的一条，
+        之前已经在队列里的内容不受影响；网络故障时的积压是离线期间的历史，全部保留。
+        """
+        now = time.time()
+        self.upload_resume_at = max(self.upload_resume_at, now + seconds)
+        if coalesce and self.upload_paused_since is None:
+            self.upload_paused_since = now
+    
+    def wait_for_upload_window(self):
+        delay = self.upload_resume_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        if self.upload_paused_since is not None:
+            merged = self.spool.coalesce(self.upload_paused_since)
+            self.upload_paused_since = None
+            if merged:
+                print(f"🔀 限流期间的 {merged + 1} 条内容已合并为最新的一条")
     
     def upload_clipboard(self, content):
+        """把内容放入本地待上传队列，由上传线程按顺序发送"""
+        self.spool.enqueue(content)
+        self.spool_event.set()
+    
+    def upload_loop(self):
+        """上传线程：有新内容或上次发送失败时，把队列里的内容发送到服务器"""
+        while True:
+            self.spool_event.wait()
+            self.spool_event.clear()
+            try:
+                # 发送失败时已经设置了暂停时间，flush_spool 开始前会先等待
+                while not self.flush_spool():
+                    pass
+            except Exception as e:
+                print(f"❌ 上传过程出错: {str(e)}")
+                time.sleep(1)
+                self.spool_event.set()
+    
+    def flush_spool(self):
+        """按顺序发送队列中的内容，全部发送完返回True，遇到网络错误或被限流返回False"""
+        self.wait_for_upload_window()
+        while True:
+            entries = self.spool.peek(self.batch_size)
+            if not entries:
+                return True
+            batch = self.batchable(entries) if self.batch_supported else []
+            if len(batch) > 1:
+                sent = self.send_batch(batch)
+            else:
+                sent = self.send_single(entries[0])
+            if not sent:
+                return False
+    
+    def batchable(self, entries):
+        """队列开头可以放进同一批发送的内容
+
+        批量接口的内容直接放在请求体里；大内容要走 send_single 的先传哈希和分块上传，
+        遇到大内容就截断，保持上传顺序。
+        """
+        batch = []
+        for entry in entries:
+            if len(entry[2]) >= self.hash_first_threshold:
+                break
+            batch.append(entry)
+        return batch
+    
+    def send_single(self, entry):
+        seq, client_id, content = entry
         url = urljoin(self.server_url, "/clipboard")
-        data = {
-            "content": content,
-            "device_id": self.device_id
-        }
+        data = self.with_group({"device_id": self.device_id, "client_id": client_id})
+        if len(content) >= self.hash_first_threshold:
+            # 重复复制的大段内容服务器上通常已经有了，先只发送哈希
+            data["content_hash"] = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        else:
+            data["content"] = content
         
         try:
             print(f"📤 正在上传内容到 {self.server_url}...")
-            response = requests.post(url, json=data, timeout=10)
-            if response.status_code == 200:
+            response = self.post_json(url, data, timeout=10)
+            if response.status_code in (400, 404) and "content" not in data:
+                # 服务器没有这份内容（旧版本服务器不认识哈希时返回400），补传全文
+                encoded = content.encode("utf-8")
+                chunked = None
+                if self.chunked_supported and len(encoded) >= self.chunked_threshold:
+                    chunked = self.send_chunked(client_id, encoded, data["content_hash"])
+                if chunked is not None:
+                    response = chunked
+                else:
+                    data["content"] = content
+                    response = self.post_json(url, data, timeout=10)
+            if response.status_code in (200, 202):
+                # 202：服务器开启了组提交，已经接收、稍后写入
                 print(f"✅ 成功上传剪贴板内容: {content[:30]}...")
-                self.error_count = 0  # 重置错误计数
+                self.reset_errors()  # 重置错误计数
+            elif response.status_code == 429:
+                self.pause_uploads(self.backoff("请求过于频繁", "上传", self.retry_after(response)), coalesce=True)
+                return False
+            elif response.status_code >= 500:
+                self.pause_uploads(self.backoff(f"服务器错误 {response.status_code}", "上传"))
+                return False
             else:
+                # 请求本身有问题，重试也不会成功，丢弃这条内容
                 print(f"❌ 上传失败: {response.status_code}")
                 print(f"错误信息: {response.text}")
+            self.spool.remove([seq])
+            return True
         except requests.exceptions.RequestException as e:
-            self.handle_request_error(e, "上传")
+            self.pause_uploads(self.backoff(e, "上传"))
+            return False
+    
+    def send_batch(self, entries):
+        url = urljoin(self.server_url, "/clipboard/batch")
+        data = self.with_group({
+            "device_id": self.device_id,
+            "items": [{"client_id": client_id, "content": content} for _, client_id, content in entries]
+        })
+        
+        try:
+            print(f"📤 正在补传 {len(entries)} 条积压内容到 {self.server_url}...")
+            response = self.post_json(url, data, timeout=30)
+            if response.status_code == 200:
+                print(f"✅ 成功补传 {len(entries)} 条内容（剩余 {len(self.spool) - len(entries)} 条）")
+                self.reset_errors()
+                self.spool.remove([seq for seq, _, _ in entries])
+                return True
+            if response.status_code in (404, 405):
+                # 旧版本服务器没有批量接口，逐条上传
+                self.batch_supported = False
+                return True
+            if response.status_code == 429:
+                self.pause_uploads(self.backoff("请求过于频繁", "批量上传", self.retry_after(response)),
+                                   coalesce=True)
+                return False
+            if response.status_code >= 500:
+                self.pause_uploads(self.backoff(f"服务器错误 {response.status_code}", "批量上传"))
+                return False
+            if response.status_code == 413 and len(entries) > 1:
+                # 请求体超过服务器的上限，先发送前一半，剩下的下一轮再取
+                print(f"⚠️ 批量上传的请求体过大，拆成 {len(entries) // 2} 条一批")
+                return self.send_batch(entries[:len(entries) // 2])
+            # 无法判断是哪一条有问题，逐条上传，每条的结果由 send_single 处理；批量请求失败不丢弃内容
+            print(f"❌ 批量上传失败: {response.status_code}，改为逐条上传")
+            print(f"错误信息: {response.text}")
+            for entry in entries:
+                if not self.send_single(entry):
+                    return False
+            return True
+        except requests.exceptions.RequestException as e:
+            self.pause_uploads(self.backoff(e, "批量上传"))
+            return False
+    
+    def send_chunked(self, client_id, encoded, digest):
+        """分块上传大内容，返回提交请求的响应；服务器不支持分块上传时返回None
+
+        中断后重试时先查询上次的会话，从服务器确认过的分块继续上传。
+        """
+        meta = None
+        upload_id = self.pending_uploads.get(client_id)
+        if upload_id:
+            response = self.http.get(urljoin(self.server_url, f"/clipboard/uploads/{upload_id}"), timeout=10)
+            if response.status_code == 200:
+                meta = response.json()
+        if meta is None:
+            response = self.post_json(urljoin(self.server_url, "/clipboard/uploads"), self.with_group({
+                "device_id": self.device_id,
+                "client_id": client_id,
+                "size": len(encoded),
+                "content_hash": digest
+            }), timeout=10)
+            if response.status_code in (404, 405):
+                # 旧版本服务器没有分块上传接口
+                self.chunked_supported = False
+                return None
+            if response.status_code != 201:
+                return response
+            meta = response.json()
+            self.pending_uploads[client_id] = meta["upload_id"]
+        
+        upload_url = urljoin(self.server_url, f"/clipboard/uploads/{meta['upload_id']}")
+        chunk_size = meta["chunk_size"]
+        total_chunks = (len(encoded) + chunk_size - 1) // chunk_size
+        for index in range(meta["next_chunk"], total_chunks):
+            chunk = encoded[index * chunk_size:(index + 1) * chunk_size]
+            response = self.http.put(f"{upload_url}/chunks/{index}", data=chunk,
+                                    headers={"Content-Type": "application/octet-stream"}, timeout=30)
+            if response.status_code != 200:
+                if response.status_code < 500:
+                    # 会话已失效或状态不一致，下次重新开始
+                    self.pending_uploads.pop(client_id, None)
+                return response
+            print(f"📤 已上传 {index + 1}/{total_chunks} 块")
+        
+        response = self.http.post(f"{upload_url}/commit", timeout=30)
+        if response.status_code < 500:
+            self.pending_uploads.pop(client_id, None)
+        return response
+    
+    def post_json(self, url, data, timeout):
+        """发送JSON请求，请求体较大时用gzip压缩"""
+        body = json.dumps(data).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.gzip_supported and len(body) >= self.gzip_threshold:
+            response = self.http.post(url, data=gzip.compress(body),
+                                     headers=dict(headers, **{"Content-Encoding": "gzip"}),
+                                     timeout=timeout)
+            if response.status_code not in (400, 415) or \
+                    response.headers.get("Content-Type", "").startswith("application/json"):
+                return response
+            # 旧版本服务器无法解析压缩的请求体，以后都不再压缩
+            self.gzip_supported = False
+        return self.http.post(url, data=body, headers=headers, timeout=timeout)
+    
+    def read_item(self, data):
+        """解析服务器返回的记录；增量格式时在本地持有的内容上还原"""
+        if "delta" in data:
+            delta = data["delta"]
+            if self.latest_content is None or delta.get("base_id") != self.latest_id:
+                # 本地版本和增量对不上，丢弃本地版本，下次请求全文
+                self.latest_id = self.latest_content = None
+                return None
+            content = apply_delta(self.latest_content, delta)
+        else:
+            content = data.get("content")
+        self.latest_id = data.get("id")
+        self.latest_content = content
+        self.last_seen_id = max(self.last_seen_id, data.get("id", 0))
+        return content
+    
+    def latest_params(self):
+        params = {"device_id": self.device_id}
+        if self.latest_content is not None:
+            params["delta_base"] = self.latest_id
+        return params
     
     def get_latest_content(self):
         url = urljoin(self.server_url, "/clipboard/latest")
-        params = {"device_id": self.device_id}
+        params = self.latest_params()
+        headers = {}
+        if self.latest_etag:
+            headers["If-None-Match"] = self.latest_etag
         
         try:
-            response = requests.get(url, params=params, timeout=5)
+            response = self.http.get(url, params=params, headers=headers, timeout=5)
+            if response.status_code == 304:
+                # 服务器上没有新内容，沿用上次的结果
+                return self.latest_content
             if response.status_code == 200:
-                data = response.json()
-                return data.get("content")
+                content = self.read_item(response.json())
+                self.latest_etag = response.headers.get("ETag") if content is not None else None
+                return content
             return None
         except requests.exceptions.RequestException as e:
             self.handle_request_error(e, "获取最新内容")
             return None
     
+    def wait_latest_content(self):
+        """长轮询：服务器有新内容时立即返回，等待超时返回None"""
+        url = urljoin(self.server_url, "/clipboard/wait")
+        params = self.latest_params()
+        params.update({"since": self.last_seen_id, "timeout": self.long_poll_timeout})
+        
+        try:
+            response = self.http.get(url, params=params, timeout=self.long_poll_timeout + 10)
+            if response.status_code == 200:
+                self.reset_errors()
+                return self.read_item(response.json())
+            if response.status_code == 204:
+                return None
+            if response.status_code in (404, 405):
+                # 旧版本服务器没有长轮询接口，退回定时轮询
+                print("⚠️ 服务器不支持长轮询，改为定时轮询")
+                self.long_poll_supported = False
+            else:
+                print(f"❌ 等待新内容失败: {response.status_code}")
+                time.sleep(self.retry_after(response) or self.poll_interval)
+            return None
+        except requests.exceptions.RequestException as e:
+            self.handle_request_error(e, "等待新内容")
+            return None
+    
+    def fetch_changes(self):
+        """从变更流获取组内其他设备的新记录，返回按序号排列的记录列表
+
+        没有新记录时服务器最多等待 long_poll_timeout 秒。游标在处理完一批后才推进并保存，
+        程序重启后从上次的位置继续，既不会漏掉记录也不会重复传输。
+        """
+        url = urljoin(self.server_url, "/clipboard/changes")
+        params = {"group": self.sync_group, "exclude_device": self.device_id,
+                  "limit": self.changes_batch_size, "timeout": self.long_poll_timeout}
+        if self.changes_cursor is not None:
+            params["since"] = self.changes_cursor
+        
+        try:
+            response = self.http.get(url, params=params, timeout=self.long_poll_timeout + 10)
+            if response.status_code == 200:
+                self.reset_errors()
+                page = response.json()
+                self.changes_cursor = page["next_since"]
+                self.spool.set_state(self.cursor_key, self.changes_cursor)
+                return page["items"]
+            if response.status_code in (404, 405):
+                # 旧版本服务器没有变更流，退回按设备获取最新内容
+                print("⚠️ 服务器不支持同步组，改为获取最新内容")
+                self.sync_group = None
+            else:
+                print(f"❌ 获取变更失败: {response.status_code}")
+                time.sleep(self.retry_after(response) or self.poll_interval)
+            return []
+        except requests.exceptions.RequestException as e:
+            self.handle_request_error(e, "获取变更")
+            return []
+    
     def sync_from_server(self):
         while True:
+            if self.sync_group:
+                try:
+                    items = self.fetch_changes()
+                    for item in items:
+                        print(f"\n📥 来自设备 {item['device_id']} 的新内容 #{item['seq']}: {item['content'][:30]}...")
+                    # 连续复制的多条内容都会收到，剪贴板里放最新的一条
+                    if items and self.watcher.apply(items[-1]["content"]):
+                        print(f"✅ 已同步新内容: {items[-1]['content'][:30]}...")
+                except Exception as e:
+                    print(f"❌ 同步过程出错: {str(e)}")
+                    time.sleep(self.poll_interval)
+                continue
+            
             try:
-                current_content = pyperclip.paste()
-                latest_content = self.get_latest_content()
+                if self.long_poll_supported:
+                    latest_content = self.wait_latest_content()
+                else:
+                    latest_content = self.get_latest_content()
                 
-                if latest_content and latest_content != current_content:
-                    print(f"\n📥 检测到服务器有新内容，正在同步...")
-                    pyperclip.copy(latest_content)
-                    print(f"✅ 已同步新内容: {latest_content[:30]}...")
+                if latest_content and self.watcher.apply(latest_content):
+                    print(f"\n📥 检测到服务器有新内容，已同步: {latest_content[:30]}...")
             except Exception as e:
                 print(f"❌ 同步过程出错: {str(e)}")
             
-            time.sleep(2)
+            if not self.long_poll_supported:
+                time.sleep(self.poll_interval)
+    
+    def refresh_history_loop(self):
+        """定期把服务器上的新记录同步到本地历史副本；离线时跳过，下次再试"""
+        while True:
+            try:
+                added = self.history.sync(self.http, self.server_url)
+                if added:
+                    print(f"🗂️ 本地历史记录新增 {added} 条")
+            except requests.exceptions.RequestException:
+                pass
+            except Exception as e:
+                print(f"❌ 同步本地历史记录出错: {str(e)}")
+            time.sleep(self.history_refresh_interval)
     
     def start(self):
         print(f"📱 设备ID: {self.device_id}")
         print(f"🌐 服务器地址: {self.server_url}")
+        if self.sync_group:
+            print(f"👥 同步组: {self.sync_group}")
         print("🔄 开始监控剪贴板...")
         print("提示：复制的内容会自动上传，其他设备的新内容会自动同步到本地")
         
         try:
-            last_content = pyperclip.paste()
-            print(f"当前剪贴板内容: {last_content[:30]}...")
+            self.watcher.mark_reported()
+            print(f"当前剪贴板内容: {self.watcher.current()[:30]}...")
         except Exception as e:
             print(f"❌ 读取剪贴板失败: {str(e)}")
-            last_content = ""
         
         # 启动服务器同步线程
         sync_thread = threading.Thread(target=self.sync_from_server, daemon=True)
         sync_thread.start()
         
+        # 启动上传线程，先补传上次退出时队列里剩下的内容
+        upload_thread = threading.Thread(target=self.upload_loop, daemon=True)
+        upload_thread.start()
+        
+        if self.history_refresh_interval > 0:
+            threading.Thread(target=self.refresh_history_loop, daemon=True).start()
+        if len(self.spool):
+            print(f"📦 待上传队列中还有 {len(self.spool)} 条内容，开始补传...")
+            self.spool_event.set()
+        
         try:
-            while True:
-                try:
-                    current_content = pyperclip.paste()
-                    if current_content != last_content and current_content.strip():
-                        print(f"\n📋 检测到本地剪贴板变化:")
-                        print(f"新内容: {current_content[:50]}...")
-                        self.upload_clipboard(current_content)
-                        last_content = current_content
-                    time.sleep(0.5)
-                except Exception as e:
-                    print(f"❌ 监控过程出错: {str(e)}")
-                    time.sleep(1)
+            self.watcher.run(self.on_local_change)
         except KeyboardInterrupt:
-            print("\n👋 程序已停止")
+            stats = self.http.stats()
+            print(f"\n📊 共发送 {stats['requests']} 个请求，新建 {stats['connections_opened']} 个连接，"
+                  f"复用连接 {stats['connections_reused']} 次，跳过回传同步来的内容 {self.watcher.suppressed} 次")
+            print("👋 程序已停止")
+    
+    def on_local_change(self, content):
+        print(f"\n📋 检测到本地剪贴板变化:")
+        print(f"新内容: {content[:50]}...")
+        self.upload_clipboard(content)
 
 def main():
     parser = argparse.ArgumentParser(description='剪贴板同步客户端')
@@ -153,6 +540,10 @@ def main():
     parser.add_argument('--host', help='服务器主机地址')
     parser.add_argument('--port', help='服务器端口')
     parser.add_argument('--protocol', choices=['http', 'https'], help='服务器协议')
+    parser.add_argument('--spool', help='本地待上传队列文件路径（默认 ~/.clipboard_sync/spool.db）')
+    parser.add_argument('--pool-size', type=int, help='HTTP连接池大小（默认4）')
+    parser.add_argument('--history', help='本地历史记录副本的文件路径（默认 ~/.clipboard_sync/history-<服务器地址的哈希>.db）')
+    parser.add_argument('--group', help='同步组名，组名相同的设备互相同步（也可用环境变量 CLIPBOARD_SYNC_GROUP）')
     args = parser.parse_args()
     
     # 设置环境变量
@@ -164,7 +555,9 @@ def main():
         os.environ['SERVER_PROTOCOL'] = args.protocol
     
     # 创建并启动同步器
-    syncer = ClipboardSync('local' if args.local else 'cloud')
+    syncer = ClipboardSync('local' if args.local else 'cloud', spool_path=args.spool,
+                           http=HttpClient(pool_size=args.pool_size), group=args.group,
+                           history_path=args.history)
     syncer.start()
 
 if __name__ == "__main__":
@@ -1,40 +1,125 @@
-import requests
-from datetime import datetime
-import pytz
+from datetime import datetime, timezone
+import threading
+from http_client import HttpClient
+from history_cache import HistoryCache
+from upload import ServerConfig
+
+REFRESH_WAIT = 3  # 显示本地记录后等待后台同步的最长时间（秒）
 
 def format_timestamp(timestamp_str):
     """格式化时间戳为本地时间"""
     dt = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-    local_dt = dt.astimezone(pytz.local)
+    if dt.tzinfo is None:
+        # 服务器存的是不带时区的 UTC 时间
+        dt = dt.replace(tzinfo=timezone.utc)
+    local_dt = dt.astimezone()
     return local_dt.strftime("%Y-%m-%d %H:%M:%S")
 
-def view_history(device_id=None, limit=10):
-    """查看剪贴板历史记录"""
-    url = "http://127.0.0.1:5001/clipboard/history"
-    params = {"limit": limit}
+def print_items(items):
+    for item in items:
+        print(f"📝 内容: {item['preview']}{'…' if item['truncated'] else ''}")
+        print(f"📦 大小: {item['size']} 字节")
+        print(f"📱 设备: {item['device_id']}")
+        print(f"⏰ 时间: {format_timestamp(item['timestamp'])}")
+        print("-" * 50)
+
+def refresh_history(cache, http, server_url, results):
+    try:
+        results["added"] = cache.sync(http, server_url)
+    except Exception as e:
+        results["error"] = e
+
+def view_history(device_id=None, limit=10, offline=False, resync=False, wait=REFRESH_WAIT, http=None,
+                 server_url=None, history_path=None):
+    """查看剪贴板历史记录：先从本地副本显示，再从服务器增量同步
+
+    http 为发请求的客户端（HttpClient 或 LocalTransport），为空时新建 HttpClient。
+    server_url 默认和 upload.py 一样是云服务器，所以读的是 upload.py 在后台同步的同一个副本。
+    """
+    server_url = server_url or ServerConfig.get_server_url('cloud')
+    cache = HistoryCache(history_path, server_url)
+    if resync:
+        cache.clear()
+    http = http or HttpClient()
+    results = {}
+    
+    if not len(cache) and not offline:
+        # 本地还没有记录，先同步一次再显示
+        print("⏳ 正在从服务器同步历史记录...")
+        refresh_history(cache, http, server_url, results)
+        if "error" in results:
+            print(f"发生错误: {str(results['error'])}")
+            return
+        offline = True
+    
+    items = cache.query(device_id, limit)
+    print("\n=== 剪贴板历史记录 ===")
+    if items:
+        print(f"显示最近 {len(items)} 条记录:")
+        print("-" * 50)
+        print_items(items)
+    else:
+        print("没有找到历史记录")
+    
+    if offline:
+        return
+    
+    # 本地结果已经显示，后台同步最多等待 wait 秒，新记录接着显示在后面
+    refresher = threading.Thread(target=refresh_history, args=(cache, http, server_url, results), daemon=True)
+    refresher.start()
+    refresher.join(wait)
+    if refresher.is_alive():
+        print("⏳ 服务器响应较慢，下次查看时会显示同步到的新记录")
+    elif "error" in results:
+        last_synced = cache.last_synced
+        synced = last_synced.strftime("%Y-%m-%d %H:%M:%S") if last_synced else "从未"
+        print(f"⚠️ 无法连接服务器，以上为本地记录（上次同步: {synced}）")
+    elif results.get("added"):
+        shown = {item["id"] for item in items}
+        newest = items[0]["timestamp"] if items else ""
+        fresh = [item for item in cache.query(device_id, limit)
+                 if item["id"] not in shown and item["timestamp"] > newest]
+        if fresh:
+            print(f"🆕 新同步了 {len(fresh)} 条记录:")
+            print("-" * 50)
+            print_items(fresh)
+
+def search_history(query, device_id=None, limit=10, http=None, server_url=None):
+    """全文搜索剪贴板历史记录，显示匹配的片段"""
+    url = f"{server_url or ServerConfig.get_server_url('cloud')}/clipboard/search"
+    params = {"q": query}
     if device_id:
         params["device_id"] = device_id
     
+    http = http or HttpClient()
     try:
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            items = response.json()
-            if not items:
-                print("没有找到历史记录")
+        items = []
+        while len(items) < limit:
+            params["limit"] = limit - len(items)
+            response = http.get(url, params=params)
+            if response.status_code != 200:
+                print(f"搜索失败: {response.status_code}")
+                print(f"错误信息: {response.text}")
                 return
-            
-            print("\n=== 剪贴板历史记录 ===")
-            print(f"显示最近 {len(items)} 条记录:")
+            page = response.json()
+            items.extend(page["items"])
+            if not page["next_cursor"]:
+                break
+            params["cursor"] = page["next_cursor"]
+        
+        if not items:
+            print(f"没有找到包含「{query}」的记录")
+            return
+        
+        print(f"\n=== 搜索结果：{query} ===")
+        print(f"找到 {len(items)} 条记录（按相关度排序）:")
+        print("-" * 50)
+        
+        for item in items:
+            print(f"🔍 片段: {item['snippet']}")
+            print(f"📱 设备: {item['device_id']}  🆔 {item['id']}")
+            print(f"⏰ 时间: {format_timestamp(item['timestamp'])}")
             print("-" * 50)
-            
-            for item in items:
-                print(f"📝 内容: {item['content']}")
-                print(f"📱 设备: {item['device_id']}")
-                print(f"⏰ 时间: {format_timestamp(item['timestamp'])}")
-                print("-" * 50)
-        else:
-            print(f"获取历史记录失败: {response.status_code}")
-            print(f"错误信息: {response.text}")
     
     except Exception as e:
         print(f"发生错误: {str(e)}")
@@ -44,6 +129,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="查看剪贴板历史记录")
     parser.add_argument("--device", help="按设备ID筛选")
     parser.add_argument("--limit", type=int, default=10, help="显示记录数量（默认10条）")
+    parser.add_argument("--search", help="全文搜索，只显示匹配的片段")
+    parser.add_argument("--offline", action="store_true", help="只显示本地记录，不连接服务器")
+    parser.add_argument("--resync", action="store_true", help="清空本地副本，重新从服务器同步")
+    parser.add_argument("--local", action="store_true", help="使用本地服务器（和 upload.py --local 相同）")
+    parser.add_argument("--history", help="本地历史记录副本的文件路径（和 upload.py --history 相同）")
     
     args = parser.parse_args()
-    view_history(args.device, args.limit) 
\ No newline at end of file
+    server_url = ServerConfig.get_server_url('local' if args.local else 'cloud')
+    if args.search:
+        search_history(args.search, args.device, args.limit, server_url=server_url)
+    else:
+        view_history(args.device, args.limit, offline=args.offline, resync=args.resync,
+                     server_url=server_url, history_path=args.history) 
\ No newline at end of file
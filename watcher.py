@@ -0,0 +1,211 @@
+"""剪贴板监控
+
+ClipboardWatcher 以可变的间隔轮询剪贴板：有变化后加快，空闲时逐步放慢。
+变化检测比较内容摘要，不保留上一份完整内容；平台能提供剪贴板变化计数时
+（Windows 的 GetClipboardSequenceNumber、macOS 的 changeCount），计数不变就连读都不读。
+连续快速复制只上报最后稳定下来的内容。上传线程和同步线程共用同一次读取结果。
+从服务器同步来的内容通过 apply 写入剪贴板，它们的摘要记在一个有上限的集合里，
+之后读到这些内容不会再上报，避免把别的设备的内容又上传回服务器。
+
+后端是可替换的：PyperclipBackend 读写系统剪贴板，MemoryBackend 用于无图形界面的测试。
+"""
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class ClipboardBackend:
+    def read(self):
+        raise NotImplementedError
+
+    def write(self, content):
+        raise NotImplementedError
+
+    def change_token(self):
+        """返回剪贴板的变化计数，平台不支持时返回 None"""
+        return None
+
+
+class PyperclipBackend(ClipboardBackend):
+    def __init__(self):
+        import pyperclip
+        self._pyperclip = pyperclip
+        self._token_func = self._load_token_func()
+
+    @staticmethod
+    def _load_token_func():
+        if sys.platform == "win32":
+            try:
+                import ctypes
+                return ctypes.windll.user32.GetClipboardSequenceNumber
+            except (ImportError, AttributeError):
+                return None
+        if sys.platform == "darwin":
+            try:
+                from AppKit import NSPasteboard  # 需要安装 pyobjc，可选
+                return NSPasteboard.generalPasteboard().changeCount
+            except ImportError:
+                return None
+        return None
+
+    def read(self):
+        return self._pyperclip.paste()
+
+    def write(self, content):
+        self._pyperclip.copy(content)
+
+    def change_token(self):
+        return self._token_func() if self._token_func else None
+
+
+class MemoryBackend(ClipboardBackend):
+    """内存中的剪贴板，用于测试"""
+
+    def __init__(self, content=""):
+        self.content = content
+        self.token = 0
+        self.reads = 0
+
+    def read(self):
+        self.reads += 1
+        return self.content
+
+    def write(self, content):
+        self.content = content
+        self.token += 1
+
+    def change_token(self):
+        return self.token
+
+
+def digest(content):
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+
+
+class ClipboardWatcher:
+    def __init__(self, backend, min_interval=0.2, max_interval=2.0, backoff=1.5, debounce=0.3,
+                 applied_limit=256):
+        self.backend = backend
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.debounce = debounce
+        self.interval = min_interval
+        self._lock = threading.Lock()
+        self._content = None  # 最近一次读取的结果，供两个线程共用
+        self._digest = None
+        self._token = None
+        self._polled_token = None  # poll 上一次检查时的变化计数；apply 写入会更新 _token，但不更新它
+        self._read_at = 0
+        self._reported = None  # 上一次上报的内容摘要
+        self._pending = None  # 发生了变化、正在等待稳定的内容摘要
+        self._pending_since = 0
+        self._applied = OrderedDict()  # 从服务器同步来的内容摘要，最多保留 applied_limit 个
+        self.applied_limit = applied_limit
+        self.suppressed = 0  # 因为是同步来的内容而没有上报的次数
+
+    def _read(self, token):
+        content = self.backend.read() or ""
+        content_digest = digest(content)
+        with self._lock:
+            self._content = content
+            self._digest = content_digest
+            self._token = token
+            self._read_at = time.monotonic()
+        return content, content_digest
+
+    def _cached(self, token):
+        with self._lock:
+            if self._content is None:
+                return None
+            if token is not None:
+                fresh = token == self._token
+            else:
+                fresh = time.monotonic() - self._read_at < self.min_interval
+            return (self._content, self._digest) if fresh else None
+
+    def current(self):
+        """返回当前剪贴板内容，刚读过或变化计数没变时直接用缓存"""
+        token = self.backend.change_token()
+        cached = self._cached(token)
+        if cached:
+            return cached[0]
+        return self._read(token)[0]
+
+    def write(self, content):
+        self.backend.write(content)
+        self._read(self.backend.change_token())
+
+    def apply(self, content):
+        """写入从服务器同步来的内容并记住它的摘要；剪贴板里已经是这份内容时不写，返回是否写入"""
+        content_digest = digest(content)
+        with self._lock:
+            self._applied[content_digest] = True
+            self._applied.move_to_end(content_digest)
+            while len(self._applied) > self.applied_limit:
+                self._applied.popitem(last=False)
+        if self.current() == content:
+            return False
+        self.write(content)
+        return True
+
+    def mark_reported(self):
+        """把当前内容视为已上报，启动时已有的内容不上传"""
+        token = self.backend.change_token()
+        self._reported = self._read(token)[1]
+        self._polled_token = token
+
+    def _idle(self):
+        self.interval = min(self.interval * self.backoff, self.max_interval)
+
+    def poll(self):
+        """检查一次剪贴板，内容变化并稳定下来时返回新内容，否则返回 None"""
+        token = self.backend.change_token()
+        if token is not None and token == self._polled_token and self._pending is None:
+            self._idle()
+            return None
+        self._polled_token = token
+
+        # apply 写入后计数变了但缓存仍然新鲜，不用重读，照样经过下面的摘要检查
+        content, content_digest = self._cached(token) or self._read(token)
+        now = time.monotonic()
+        if content_digest == self._reported or not content.strip():
+            self._pending = None
+            self._idle()
+            return None
+        with self._lock:
+            applied = content_digest in self._applied
+        if applied:
+            # 同步线程写入的内容，不回传
+            self._reported = content_digest
+            self._pending = None
+            self.suppressed += 1
+            self._idle()
+            return None
+
+        if content_digest != self._pending:
+            # 新的变化：加快轮询，等内容稳定 debounce 秒后再上报
+            self._pending = content_digest
+            self._pending_since = now
+            self.interval = self.min_interval
+        if now - self._pending_since < self.debounce:
+            return None
+
+        self._reported = content_digest
+        self._pending = None
+        return content
+
+    def run(self, on_change, stop_event=None):
+        """持续监控剪贴板，内容变化时调用 on_change(content)"""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                content = self.poll()
+                if content is not None:
+                    on_change(content)
+            except Exception as e:
+                print(f"❌ 监控过程出错: {str(e)}")
+                self.interval = self.max_interval
+            stop_event.wait(self.interval)